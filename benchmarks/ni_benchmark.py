@@ -0,0 +1,96 @@
+"""
+benchmark the acquisition modes of NIDIDaemon against the simulated
+nidaqmx backend. for each mode this reports the achieved sampling rate
+(in 'change' mode this is the rate at which changes were acquired), the
+latency between an edge on a simulated line and the emission of the
+associated signal, and the cpu time used per line
+
+usage:
+    python benchmarks/ni_benchmark.py --lines 16 --edge-rate 5 --duration 10
+"""
+
+import argparse
+import threading
+import time
+import numpy as np
+from PyQt5.QtCore import QCoreApplication, Qt
+
+from pyBehavior.interfaces import ni, ni_sim
+
+
+def run_mode(mode:str, n_lines:int, n_devices:int, edge_rate:float, fs:float, duration:float, seed:int,
+             read_latency:float = 0):
+    ni_sim.reset()
+    devices = [ni_sim.add_device(f"Dev{i+1}", n_lines = n_lines, edge_rate = edge_rate, seed = seed + i,
+                                 read_latency = read_latency)
+               for i in range(n_devices)]
+
+    daemon = ni.NIDIDaemon(fs, mode = mode)
+    lines = {}
+    for dev in devices:
+        for line in dev.di_lines:
+            name = line.name.replace('/', '_')
+            daemon.register(line.name, name)
+            lines[name] = dev.line(line.name)
+
+    latencies = []
+    def on_edge(name):
+        now = time.time()
+        edge = lines[name].last_edge(now)
+        if edge is not None:
+            latencies.append(now - edge)
+
+    for name in daemon.channels.index:
+        # connect directly so the latency doesn't include
+        # the time spent waiting on an event loop
+        daemon.channels.loc[name].rising_edge.connect(on_edge, Qt.DirectConnection)
+        daemon.channels.loc[name].falling_edge.connect(on_edge, Qt.DirectConnection)
+
+    thread = threading.Thread(target = daemon.run)
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+    thread.start()
+    time.sleep(duration)
+    daemon.stop()
+    thread.join()
+    elapsed = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+
+    latencies = np.array(latencies) * 1000
+    n_total = n_lines * n_devices
+    return {
+        'mode': mode,
+        'rate': daemon.n_samples / elapsed,
+        'edges': latencies.size,
+        'lat_p50': np.percentile(latencies, 50) if latencies.size else np.nan,
+        'lat_p99': np.percentile(latencies, 99) if latencies.size else np.nan,
+        'cpu_per_line': 100 * cpu / elapsed / n_total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', nargs = '+', default = list(ni.NIDIDaemon.modes))
+    parser.add_argument('--lines', type = int, default = 16, help = "number of lines per device")
+    parser.add_argument('--devices', type = int, default = 1)
+    parser.add_argument('--edge-rate', type = float, default = 5, help = "average edges per second per line")
+    parser.add_argument('--fs', type = float, default = 1000)
+    parser.add_argument('--duration', type = float, default = 10)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--read-latency', type = float, default = 0, 
+                        help = "simulated duration of an on-demand read in seconds")
+    args = parser.parse_args()
+
+    app = QCoreApplication([])
+    ni.use_backend('sim')
+
+    print(f"{'mode':>10} {'rate [Hz]':>10} {'edges':>7} {'p50 [ms]':>9} {'p99 [ms]':>9} {'cpu/line [%]':>13}")
+    for mode in args.modes:
+        r = run_mode(mode, args.lines, args.devices, args.edge_rate, args.fs, args.duration, args.seed,
+                     args.read_latency)
+        print(f"{r['mode']:>10} {r['rate']:>10.1f} {r['edges']:>7d} {r['lat_p50']:>9.3f} "
+              f"{r['lat_p99']:>9.3f} {r['cpu_per_line']:>13.3f}")
+
+
+if __name__ == '__main__':
+    main()
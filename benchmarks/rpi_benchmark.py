@@ -0,0 +1,161 @@
+"""
+benchmark the remote ratBerryPi interface against the loopback simulator
+in pyBehavior.interfaces.rpi.sim. this reports the round trip latency of
+requests to the simulated pi, then for an increasing number of modules 
+measures the request rate and the latency with which licks are detected
+when polling lick counts through the shared RemotePoller and when receiving
+them through a LickStream. when streaming, the latency of each lick is 
+measured from its time on the pi and only licks after the stream subscribed
+are expected. a module count is sustainable if no licks are missed and the
+99th percentile of the detection latency is below --max-latency. module 
+counts are run in increasing order until the first one which isn't 
+sustainable
+
+usage:
+    python benchmarks/rpi_benchmark.py --latency .002 --lick-rate 8 --modules 1 2 4 8 16
+"""
+
+import argparse
+import time
+import numpy as np
+from PyQt5.QtCore import QCoreApplication, Qt
+
+from pyBehavior.interfaces.rpi import sim
+from pyBehavior.interfaces.rpi.remote import RemotePoller, LickStream, get_many
+try:
+    from ratBerryPi.remote.client import Client
+except ImportError:
+    # speaks the same protocol as the ratBerryPi client
+    Client = sim.SimClient
+
+
+def round_trips(latency:float, n:int):
+    server = sim.SimServer(modules = [f"module{i}" for i in range(10)], latency = latency)
+    server.start()
+    client = Client(server.host, server.port)
+    client.new_channel('run')
+    exprs = [f"modules['module{i}'].lickometer.licks" for i in range(10)]
+    requests = {
+        'get': lambda: client.get(exprs[0], channel = 'run'),
+        'get_many (10)': lambda: get_many(client, exprs, channel = 'run'),
+        'run_command': lambda: client.run_command('toggle_LED', {'module': 'module0', 'on': True}, channel = 'run'),
+    }
+    results = {}
+    for name, request in requests.items():
+        rtt = []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            request()
+            rtt.append(time.perf_counter() - t0)
+        results[name] = np.array(rtt) * 1000
+    if hasattr(client, 'close'):
+        client.close()
+    server.stop()
+    return results
+
+
+def run_modules(mode:str, n_modules:int, lick_rate:float, latency:float, duration:float, seed:int):
+    modules = [f"module{i}" for i in range(n_modules)]
+    server = sim.SimServer(modules = modules, lick_rate = lick_rate, latency = latency, seed = seed)
+    server.start()
+    client = Client(server.host, server.port)
+    latencies = []
+    # latest lick count read from each module when polling, and
+    # the pi's time of each lick received when streaming
+    counted = {m: 0 for m in modules}
+    streamed = []
+
+    def on_stream_licks(module, n, t):
+        # each message carries the time of its most recent lick on the pi
+        latencies.append(time.time() - t)
+        streamed.append(t)
+
+    def on_polled_licks(module, licks):
+        now = time.time()
+        times = server.modules[module].lick_times
+        # polled counts carry no times, so the latency is 
+        # from the most recent lick included in the count
+        if 0 < licks <= len(times):
+            latencies.append(now - times[licks - 1])
+            counted[module] = licks
+
+    if mode == 'stream':
+        stream = LickStream(server.host, server.stream_port)
+        stream.licks.connect(on_stream_licks, Qt.DirectConnection)
+        stream.start()
+        # licks before the server has the subscription are never pushed
+        deadline = time.time() + 5
+        while len(server._streams) == 0:
+            if time.time() > deadline:
+                raise RuntimeError("the lick stream did not subscribe")
+            time.sleep(.001)
+    else:
+        for m in modules:
+            attr = RemotePoller.watch(client, f"modules['{m}'].lickometer.licks", .005)
+            attr.changed.connect(lambda licks, m = m: on_polled_licks(m, licks), Qt.DirectConnection)
+
+    t_start = time.time()
+    n0 = server.n_requests
+    time.sleep(duration)
+    n_requests = server.n_requests - n0
+    with server._lock:
+        t_end = time.time()
+        total = sum(m.lickometer.licks for m in server.modules.values())
+        lick_times = np.concatenate([m.lick_times for m in server.modules.values()] + [[]])
+    # give licks at the very end time to be detected
+    time.sleep(.1)
+    if mode == 'stream':
+        stream.stop()
+        stream.wait()
+        streamed = np.array(streamed)
+        expected = np.sum((lick_times > t_start) & (lick_times <= t_end))
+        missed = int(expected - np.sum((streamed > t_start) & (streamed <= t_end)))
+    else:
+        RemotePoller.stop_all()
+        missed = total - sum(counted.values())
+
+    latencies = np.array(latencies) * 1000
+    if hasattr(client, 'close'):
+        client.close()
+    server.stop()
+    return {
+        'requests': n_requests / duration,
+        'missed': max(0, missed),
+        'lat_p50': np.percentile(latencies, 50) if latencies.size else np.nan,
+        'lat_p99': np.percentile(latencies, 99) if latencies.size else np.nan,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type = float, default = .002, help = "simulated network latency in seconds")
+    parser.add_argument('--lick-rate', type = float, default = 8, help = "average licks per second per module")
+    parser.add_argument('--modules', type = int, nargs = '+', default = [1, 2, 4, 8, 16])
+    parser.add_argument('--modes', nargs = '+', default = ['poll', 'stream'])
+    parser.add_argument('--duration', type = float, default = 5)
+    parser.add_argument('--requests', type = int, default = 200, help = "number of requests per round trip measurement")
+    parser.add_argument('--max-latency', type = float, default = 50, help = "maximum sustainable p99 lick latency in ms")
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    app = QCoreApplication([])
+
+    print(f"{'request':>14} {'p50 [ms]':>9} {'p99 [ms]':>9}")
+    for name, rtt in round_trips(args.latency, args.requests).items():
+        print(f"{name:>14} {np.percentile(rtt, 50):>9.3f} {np.percentile(rtt, 99):>9.3f}")
+    print()
+
+    print(f"{'mode':>7} {'modules':>8} {'req/s':>8} {'missed':>7} {'p50 [ms]':>9} {'p99 [ms]':>9}")
+    for mode in args.modes:
+        sustainable = 0
+        for n in sorted(args.modules):
+            r = run_modules(mode, n, args.lick_rate, args.latency, args.duration, args.seed)
+            print(f"{mode:>7} {n:>8d} {r['requests']:>8.1f} {r['missed']:>7d} {r['lat_p50']:>9.3f} {r['lat_p99']:>9.3f}")
+            if r['missed'] > 0 or not r['lat_p99'] <= args.max_latency:
+                break
+            sustainable = n
+        print(f"{mode:>7} max sustainable modules: {sustainable}")
+
+
+if __name__ == '__main__':
+    main()
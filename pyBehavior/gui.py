@@ -44,6 +44,23 @@ class ModuleDict(UserDict):
             raise ValueError("entries in ModuleDict must be instances of subclasses of gui.RewardWidget")
     
 
+# functions to call when a setup gui is closed
+_close_hooks = []
+
+def register_close_hook(func:typing.Callable):
+    """
+    register a function to call when a setup gui is closed, e.g. to
+    release hardware resources held by an interface module. functions
+    are called once per close in the order they were registered
+
+    Args:
+        func: typing.Callable
+            function to call. it takes no arguments
+    """
+    if func not in _close_hooks:
+        _close_hooks.append(func)
+
+
 class SetupGUI(QMainWindow):
     """
     base class for all setup visualizers
@@ -87,14 +104,20 @@ class SetupGUI(QMainWindow):
             dictionary mapping names to instances of RewardWidgets
     """
 
-    def __init__(self, loc):
+    def __init__(self, loc, ni_di_mode:str = 'poll'):
         super(SetupGUI, self).__init__()
         self.loc = Path(loc)
+        self.ni_di_mode = ni_di_mode
 
         # if there is a ni port map for this setup load it
         if os.path.exists(self.loc/'port_map.csv'):
             mapping = pd.read_csv(self.loc/'port_map.csv').set_index('name')
-            self.init_NIDIDaemon(mapping.loc[mapping.DI].port)
+            di = mapping.loc[mapping.DI]
+            # optional per line debounce and minimum pulse width in ms
+            filters = pd.DataFrame({col: di[f"{col}_ms"].fillna(0)/1000 if f"{col}_ms" in di.columns else 0.
+                                    for col in ['debounce', 'min_pulse']}, index = di.index)
+            self.init_NIDIDaemon(di.port, mode = ni_di_mode, 
+                                 filters = {i: tuple(v) for i, v in filters.iterrows() if (v > 0).any()})
             self.mapping = mapping.port
         else:
             self.mapping = None
@@ -111,11 +134,39 @@ class SetupGUI(QMainWindow):
                 self.interface.start()
                 self._has_local_rpi = True
             else:
-                from ratBerryPi.remote.client import Client
+                if self.rpi_config.get('SIM', False):
+                    # serve a simulated pi on this machine
+                    from pyBehavior.interfaces.rpi.sim import SimServer
+                    try:
+                        from ratBerryPi.remote.client import Client
+                    except ImportError:
+                        from pyBehavior.interfaces.rpi.sim import SimClient as Client
+                    self.rpi_sim = SimServer(modules = self.rpi_config.get('MODULES', ['module1']),
+                                             pumps = self.rpi_config.get('PUMPS', ['pump1']),
+                                             lick_rate = self.rpi_config.get('LICK_RATE', 0),
+                                             latency = self.rpi_config.get('LATENCY', 0),
+                                             ssh = True)
+                    self.rpi_sim.start()
+                    self.rpi_config.update({'HOST': self.rpi_sim.host, 'PORT': self.rpi_sim.port,
+                                            'LICK_STREAM_PORT': self.rpi_sim.stream_port,
+                                            'SSH_PORT': self.rpi_sim.ssh.port, 
+                                            'SSH_KEY': self.rpi_sim.ssh.key_file,
+                                            'USER': self.rpi_config.get('USER', 'pi')})
+                else:
+                    from ratBerryPi.remote.client import Client
                 self.client = Client(self.rpi_config['HOST'], 
                                     self.rpi_config['PORT'])
                 self.client.new_channel("run")
                 self._has_remote_rpi = True
+                # fetch the initial state of all widgets in one request
+                from pyBehavior.interfaces.rpi.remote import snapshot_setup
+                snapshot_setup(self.client, modules = self.rpi_config.get('MODULES', []), 
+                               pumps = self.rpi_config.get('PUMPS', []))
+                if self.rpi_config.get('EXPERIMENTAL_LICK_STREAM', False) and 'LICK_STREAM_PORT' in self.rpi_config:
+                    from pyBehavior.interfaces.rpi.remote import LickStream
+                    self.lick_stream = LickStream(self.rpi_config['HOST'], 
+                                                  self.rpi_config['LICK_STREAM_PORT'])
+                    self.lick_stream.start()
 
         container = QWidget()
         self.layout = QVBoxLayout()
@@ -198,34 +249,6 @@ class SetupGUI(QMainWindow):
         else:
             return None
     
-    def init_NIDIDaemon(self, channels: typing.Dict[str, str], fs = 1000, start = False):
-        """
-        initialize a daemon that will poll a set of digital input lines
-        through nidaqmx continuously in the background and emit signals
-        on the rising and falling edges of each line
-
-        Args:
-            channels:
-                dictionary or pandas series mapping names to 
-                addresses for digital input lines to monitor.
-                keys should be names and values should be addresses
-            fs:
-                rate at which to poll the digital input lines in Hz.
-            start:
-                flag indicating whether or not to automatically
-                start the daemon
-        """
-
-        from pyBehavior.interfaces.ni import NIDIDaemon
-        self._di_daemon = NIDIDaemon(fs)
-        for i, v in channels.items():
-            self._di_daemon.register(v, i)
-        self._di_daemon_thread = QThread()
-        self._di_daemon.moveToThread(self._di_daemon_thread)
-        self._di_daemon_thread.started.connect(self._di_daemon.run)
-        self._di_daemon.finished.connect(self._di_daemon_thread.quit)
-        if start: self._di_daemon_thread.start()
-
     def start_NIDIDaemon(self):
         """
         start the thread running the NI DI Daemon
@@ -259,6 +282,8 @@ class SetupGUI(QMainWindow):
         self._log_fh.setLevel(logging.DEBUG)
         self._log_fh.setFormatter(self._formatter)
         self.logger.addHandler(self._log_fh)
+        for handler in self._eventstring_handlers.values():
+            handler.set_session_dir(dir_name)
 
         # create the state machine
         prot = ".".join([self.loc.name, "protocols", self.prot_name])
@@ -293,11 +318,17 @@ class SetupGUI(QMainWindow):
             ssh_client = paramiko.SSHClient()
             ssh_client.load_system_host_keys()
             ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh_client.connect(self.client.host, username = self.rpi_config['USER'], look_for_keys = True)
+            ssh_client.connect(self.client.host, port = self.rpi_config.get('SSH_PORT', 22),
+                               username = self.rpi_config['USER'], 
+                               key_filename = self.rpi_config.get('SSH_KEY'), look_for_keys = True)
             scp_client = SCPClient(ssh_client.get_transport())
             scp_client.get(rpi_data_path, self._filename.parent.as_posix())
+            ssh_client.close()
             self.logger.info(f"rpi logs saved at: {self.client.get('data_path')}")
             self.client.run_command('stop_recording', channel = 'run')
+        # make sure all queued eventstrings make it to the log file
+        for handler in self._eventstring_handlers.values():
+            handler.flush()
         # remove file handler
         self.logger.removeHandler(self._log_fh)
         
@@ -387,7 +418,105 @@ class SetupGUI(QMainWindow):
         else:
             self.logger.info(event)
 
-    def init_NIDIDaemon(self, channels:dict, fs:float = 1000, start:bool = False):
+    @property
+    def ni_ai(self) -> pd.DataFrame:
+        """
+        series storing references to pyqt signals emitted when
+        an analog input channel crosses its thresholds. each row 
+        corresponds to an analog input channel registered through 
+        self.init_NIAIDaemon and has the same signals as the rows
+        of self.ni_di
+        """
+        if hasattr(self, '_ai_daemon'):
+            return self._ai_daemon.channels
+        else:
+            return None
+
+    def init_NIAIDaemon(self, channels:dict, thresholds:dict, fs:float = 1000, 
+                        window:float = 5., start:bool = False):
+        """
+        start a daemon to stream analog input channels on a
+        national instruments card and detect threshold crossings
+
+        Args:
+            channels: dict
+                dictionary with keys being human readable
+                names for analog inputs and values being the
+                associated address of the channel
+            thresholds: dict
+                dictionary mapping names of the channels to their
+                thresholds in volts. values may either be a single
+                threshold or a tuple of (high, low) thresholds for
+                detecting crossings with hysteresis
+            fs: float (optional)
+                sampling rate in Hz [default: 1000]
+            window: float (optional)
+                duration in seconds of the window of raw samples 
+                to keep for display [default: 5]
+            start: bool
+                whether or not to start the daemon
+                [default: False]
+        """
+
+        from pyBehavior.interfaces.ni import NIAIDaemon
+        self._ai_daemon = NIAIDaemon(fs, window = window)
+        for i, v in channels.items():
+            thresh = thresholds[i]
+            high, low = thresh if isinstance(thresh, (tuple, list)) else (thresh, None)
+            self._ai_daemon.register(v, i, high, low)
+        self._ai_daemon_thread = QThread()
+        self._ai_daemon.moveToThread(self._ai_daemon_thread)
+        self._ai_daemon_thread.started.connect(self._ai_daemon.run)
+        self._ai_daemon.finished.connect(self._ai_daemon_thread.quit)
+        if start:
+            self._ai_daemon_thread.start()
+
+    def start_NIAIDaemon(self):
+        """
+        start the thread running the NI AI Daemon
+        """
+        assert self._ai_daemon_thread is not None, "must initialize the daemon first"
+        self._ai_daemon_thread.start()
+
+    @property
+    def ni_ci(self) -> pd.Series:
+        """
+        series storing references to NICounterChan objects for
+        all lines registered as counters with self.add_NI_counter.
+        the new_counts signal of each counter is emitted with the
+        number of new edges counted whenever the count changes
+        """
+        if hasattr(self, '_di_daemon'):
+            return self._di_daemon.counters
+        else:
+            return None
+
+    def add_NI_counter(self, counter:str, name:str, terminal:str = None, edge:str = 'rising'):
+        """
+        count edges on a digital line using a counter on a national
+        instruments card rather than monitoring every edge with the 
+        digital input daemon. this is useful for high rate lines such as
+        lickometers or camera frame triggers. counters are read by the 
+        digital input daemon so this must be called before the daemon
+        is started
+
+        Args:
+            counter: str
+                address of the counter to use (e.g. Dev1/ctr0)
+            name: str
+                name to assign to the counter
+            terminal: str (optional)
+                terminal the line is connected to (e.g. /Dev1/PFI0).
+                by default the counter's default input terminal is used
+            edge: str (optional)
+                'rising' or 'falling'. which edges to count
+        """
+        if not hasattr(self, '_di_daemon'):
+            self.init_NIDIDaemon({}, mode = self.ni_di_mode)
+        self._di_daemon.register_counter(counter, name, terminal = terminal, edge = edge)
+
+    def init_NIDIDaemon(self, channels:dict, fs:float = 1000, start:bool = False, mode:str = 'poll',
+                        filters:dict = None):
         """
         start a daemon to monitor digital input lines on a
         national instruments card
@@ -403,13 +532,24 @@ class SetupGUI(QMainWindow):
             start: bool
                 whether or not to start the daemon
                 [default: True]
+            mode: str (optional)
+                acquisition mode of the daemon. 'poll' for software
+                timed on-demand reads, 'buffered' for hardware timed
+                reads on the sample clock of each device or 'change'
+                for interrupt driven reads using change detection
+                (see NIDIDaemon) [default: 'poll']
+            filters: dict (optional)
+                dictionary mapping names of digital inputs to a tuple
+                of (debounce, min_pulse) in seconds (see NIDIDaemon)
                 
         """
         
         from pyBehavior.interfaces.ni import NIDIDaemon
-        self._di_daemon = NIDIDaemon(fs)
+        filters = filters if filters is not None else {}
+        self._di_daemon = NIDIDaemon(fs, mode = mode)
         for i, v in channels.items():
-            self._di_daemon.register(v, i)
+            debounce, min_pulse = filters.get(i, (0, 0))
+            self._di_daemon.register(v, i, debounce = debounce, min_pulse = min_pulse)
         self._di_daemon_thread = QThread()
         self._di_daemon.moveToThread(self._di_daemon_thread)
         self._di_daemon_thread.started.connect(self._di_daemon.run)
@@ -442,7 +582,40 @@ class SetupGUI(QMainWindow):
         formatter = lambda x: {"type": input_type, "data": x, "metadata": metadata}
         signal.connect(lambda x: self._template_state_machine_input_handler(x, formatter, before, event_line))
 
-    def add_eventstring_handler(self, event_line_name:str, event_line_port:str):
+    def init_zones(self, position_signal:pyqtSignal, zones:list = None, cell_size:float = None,
+                   event_line:str = None):
+        """
+        create a zone map driven by a position signal and register its
+        enter, exit and dwell events as inputs to the state machine with
+        the input types 'zone entered', 'zone exited' and 'zone dwell'.
+        the data of each input is the name of the zone
+
+        Args:
+            position_signal: pyqtSignal
+                signal emitting [y, x] positions, e.g. the new_position
+                signal of a pyBehavior.interfaces.socket.Position widget
+            zones: list (optional)
+                list of pyBehavior.interfaces.zones.Zone objects. if not
+                provided the zones are loaded from zones.yaml in the setup
+                directory
+            cell_size: float (optional)
+                size of the cells of the grid used to index the zones
+            event_line: str
+                event line to use to log state machine transitions
+        """
+
+        from pyBehavior.interfaces.zones import ZoneMap
+        if zones is None:
+            self.zones = ZoneMap.from_yaml(self.loc/'zones.yaml')
+        else:
+            self.zones = ZoneMap(zones, cell_size)
+        position_signal.connect(self.zones.update)
+        self.register_state_machine_input(self.zones.entered, 'zone entered', event_line = event_line)
+        self.register_state_machine_input(self.zones.exited, 'zone exited', event_line = event_line)
+        self.register_state_machine_input(self.zones.dwell, 'zone dwell', event_line = event_line)
+        return self.zones
+
+    def add_eventstring_handler(self, event_line_name:str, event_line_port:str, code_lines:list = None, **kwargs):
         """
         add a new eventstring handler. 
 
@@ -452,20 +625,45 @@ class SetupGUI(QMainWindow):
             event_line_port: str
                 address of the digital line to toggle when
                 raising this event line
+            code_lines: list, optional
+                addresses of digital lines to write event codes on.
+                if provided the event line is used as the strobe
+            **kwargs:
+                additional keyword arguments passed to EventstringSender
         """
 
         from pyBehavior.interfaces.ni import EventstringSender
-        self._eventstring_handlers[event_line_name] = EventstringSender(self, event_line_name, event_line_port)
+        self._eventstring_handlers[event_line_name] = EventstringSender(self, event_line_name, event_line_port, 
+                                                                        code_lines = code_lines, **kwargs)
         return self._eventstring_handlers[event_line_name] 
 
     def closeEvent(self, event):
         if self._running: self._stop_protocol()
-        if hasattr(self, 'di_daemon'):
+        if hasattr(self, '_di_daemon'):
             if self._di_daemon.running:
                 self._di_daemon.stop()
                 self._di_daemon_thread.quit()
+        if hasattr(self, '_ai_daemon'):
+            if self._ai_daemon.running:
+                self._ai_daemon.stop()
+                self._ai_daemon_thread.quit()
+        for handler in self._eventstring_handlers.values():
+            handler.close()
+        # release resources held by interface modules
+        # (e.g. cached digital output tasks)
+        for hook in _close_hooks:
+            hook()
         if self._has_local_rpi:
             self.interface.stop()
+        if hasattr(self, 'lick_stream'):
+            self.lick_stream.stop()
+            self.lick_stream.wait()
+        if self._has_remote_rpi:
+            from pyBehavior.interfaces.rpi.remote import RemotePoller, RemoteCommands
+            RemotePoller.stop_all()
+            RemoteCommands.stop_all()
+        if hasattr(self, 'rpi_sim'):
+            self.rpi_sim.stop()
         event.accept()
 
     
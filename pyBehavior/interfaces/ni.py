@@ -1,18 +1,54 @@
 import pandas as pd
 import numpy as np
-from PyQt5.QtCore import QThread, pyqtSignal, QObject
+from PyQt5.QtCore import QThread, pyqtSignal, QObject, QTimer
 from PyQt5.QtWidgets import QPushButton, QVBoxLayout, QHBoxLayout, QLineEdit, QLabel, QSpinBox, QGroupBox
 from PyQt5.QtGui import  QDoubleValidator
 import time
 from datetime import datetime
-import nidaqmx
 import logging
 import time
-from pyBehavior.gui import RewardWidget
+from pyBehavior.gui import RewardWidget, register_close_hook
 import socket
+import threading
+import queue
+import os
+import re
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+from abc import ABCMeta, abstractmethod
+import math
+
+try:
+    import nidaqmx
+except ImportError:
+    nidaqmx = None
+
+
+def use_backend(backend):
+    """
+    select the module used to communicate with national instruments cards
+
+    Args:
+        backend: str or module
+            'nidaqmx' to use the nidaqmx package, 'sim' to use the simulated
+            backend in pyBehavior.interfaces.ni_sim, or any module implementing 
+            the same subset of the nidaqmx api
+    """
+    global nidaqmx
+    if backend == 'nidaqmx':
+        import nidaqmx as backend
+    elif backend == 'sim':
+        from pyBehavior.interfaces import ni_sim as backend
+    nidaqmx = backend
+
+if os.environ.get('PYBEHAVIOR_NI_BACKEND'):
+    use_backend(os.environ['PYBEHAVIOR_NI_BACKEND'])
 
 
 def daqmx_supported():
+    if nidaqmx is None:
+        return False
     try:
         with nidaqmx.Task() as task: pass
         return True
@@ -25,88 +61,955 @@ class NIDIChan(QObject):
 
     rising_edge = pyqtSignal(str, name = 'risingEdge')
     falling_edge = pyqtSignal(str, name = 'fallingEdge')
+    rising_edge_time = pyqtSignal(float, name = 'risingEdgeTime')
+    falling_edge_time = pyqtSignal(float, name = 'fallingEdgeTime')
 
-class NIDIDaemon(QObject):
+class NICounterChan(QObject):
+
+    new_counts = pyqtSignal(int, name = 'newCounts')
+    new_counts_time = pyqtSignal(float, name = 'newCountsTime')
+
+class NIDaemonMeta(type(QObject), ABCMeta):
+    pass
+
+class NIDaemon(QObject, metaclass = NIDaemonMeta):
+    """
+    base class for daemons that acquire input channels on national
+    instruments cards and emit the signals of an NIDIChan for every channel
+    whenever its state changes. channels are registered by subclasses, which
+    get one task per device. by default the tasks run on the sample clock of
+    their devices and are read in blocks of block_size through read_block,
+    with devices read concurrently on their own reader threads when there are
+    several. subclasses define how a device's block is read in
+    _read_device_block and may override _acquire to acquire samples differently
+    """
 
     finished = pyqtSignal(int, name = "finished")
 
-    def __init__(self, fs = 1000):
-        super(NIDIDaemon, self).__init__()
+    def __init__(self, fs = 1000, block_size = None, buffer_size = None):
+        super(NIDaemon, self).__init__()
         self.fs = fs
+        # by default read 10 ms worth of samples at a time and
+        # buffer 10 s worth of samples on the device
+        self.block_size = block_size if block_size is not None else max(1, int(fs/100))
+        self.buffer_size = buffer_size if buffer_size is not None else max(self.block_size, int(10 * fs))
         self.tasks = {}
         self.channels = pd.Series([], dtype = object)
         self.running = False
         self.status = 0
+        # number of samples of each line processed since the daemon
+        # was started. useful for measuring the achieved sampling rate
+        self.n_samples = 0
+        self._stop_event = threading.Event()
+        self._readers = None
+        # the state arrays exist from the start so state
+        # can be accessed before the daemon is run
+        NIDaemon._index_channels(self)
 
-    def register(self, channel, name):
-
+    def _add_to_task(self, channel, name):
+        # get the task for the device the channel is on
         dev = channel.split('/')[0]
         if dev not in self.tasks:
             self.tasks[dev] = {'task_handle': nidaqmx.Task(),
-                               'channel_names': [name]}
+                               'channel_names': [name],
+                               'lines': [channel]}
         else:
             self.tasks[dev]['channel_names'].append(name)
-        self.tasks[dev]['task_handle'].di_channels.add_di_chan(channel, name_to_assign_to_lines = name)
-        self.channels.loc[name] =  NIDIChan()
-    
+            self.tasks[dev]['lines'].append(channel)
+        return self.tasks[dev]['task_handle']
+
+    @property
+    def state(self) -> pd.Series:
+        """
+        most recent state of all channels indexed by name.
+        this is a view onto the state array used by the daemon
+        """
+        return pd.Series(self._state, index = self._names, copy = False)
+
+    def _index_channels(self):
+        """
+        assign every channel an index into the state arrays.
+        channels are ordered by device and then by order of registration
+        such that the channels of each device occupy a contiguous slice
+        """
+        self._names = []
+        for dev in self.tasks:
+            start = len(self._names)
+            self._names += self.tasks[dev]['channel_names']
+            self.tasks[dev]['slice'] = slice(start, len(self._names))
+        self._chans = [self.channels.loc[i] for i in self._names]
+        # initialize all states as false
+        self._state = np.zeros(len(self._names), dtype = bool)
+        self._sample = np.zeros(len(self._names), dtype = bool)
+        self._changed = np.zeros(len(self._names), dtype = bool)
+
+    def _has_inputs(self) -> bool:
+        return len(self.tasks) > 0
+
+    def _concurrent_reads(self) -> bool:
+        """
+        whether devices are read on reader threads
+        """
+        return len(self.tasks) > 1
+
     def run(self):
         self.running = True
-        if len(self.tasks)>0:
-            # initialize all states as false
-            self.state = pd.Series([False]*self.channels.size,
-                                   index = self.channels.index)
+        self.status = 0
+        self.n_samples = 0
+        if self._has_inputs():
+            self._index_channels()
+            if self._concurrent_reads():
+                # the first device is read on this thread
+                self._readers = ThreadPoolExecutor(len(self.tasks) - 1, thread_name_prefix = type(self).__name__)
             try:
-                while self.running:
-                    _state = self.read()
-                    for i in self.channels.loc[_state > self.state].index:
-                        self.channels.loc[i].rising_edge.emit(i)
-                    for i in self.channels.loc[_state < self.state].index:
-                        self.channels.loc[i].falling_edge.emit(i)
-                    self.state = _state
-                    time.sleep(1/self.fs)
+                self._acquire()
+                self.status = 1
             except:
+                # reads interrupted by a requested stop are not failures
+                failed = self.running or self.status == 2
                 self.stop()
-                self.status = 2
+                self.status = 2 if failed else 1
             finally:
-                self.status = 1
+                if self._readers is not None:
+                    self._readers.shutdown()
+                    self._readers = None
         self.finished.emit(self.status)
-    
-    def read(self):
-        state = {}
+
+    def _acquire(self):
+        """
+        acquire samples until the daemon is stopped
+        """
+        self._run_buffered()
+
+    def _service(self):
+        """
+        called between blocks in buffered mode for any periodic work
+        """
+        pass
+
+    def _run_buffered(self):
+        AcquisitionType = nidaqmx.constants.AcquisitionType
+
         for dev in self.tasks:
-            names = self.tasks[dev]['channel_names']
-            handle = self.tasks[dev]['task_handle']
-            if len(names)>1:
-                state.update(dict(zip(names, handle.read()))), 
-            else:
-                state.update({names[0]: handle.read()})
+            self.tasks[dev]['task_handle'].timing.cfg_samp_clk_timing(self.fs,
+                                                                      sample_mode = AcquisitionType.CONTINUOUS,
+                                                                      samps_per_chan = self.buffer_size)
+        for dev in self.tasks:
+            self.tasks[dev]['task_handle'].start()
+        self.t0 = time.time()
+        n_read = 0
+        while self.running:
+            block = self.read_block()
+            t = self.t0 + (n_read + np.arange(block.shape[1]))/self.fs
+            self._process_block(block, slice(None), t)
+            n_read += block.shape[1]
+            self.n_samples = n_read
+            self._service()
 
-        return pd.Series(state)
+    def _emit_edge(self, i, rising, t):
+        chan = self._chans[i]
+        if rising:
+            chan.rising_edge.emit(self._names[i])
+            chan.rising_edge_time.emit(t)
+        else:
+            chan.falling_edge.emit(self._names[i])
+            chan.falling_edge_time.emit(t)
+
+    def _process_block(self, block, sl, t):
+        """
+        emit signals for all edges in a block of samples
+        and update the state of the associated channels
+
+        Args:
+            block: np.ndarray
+                boolean array of shape (channels, samples)
+            sl: slice
+                slice of the state array that the
+                channels in the block correspond to
+            t: np.ndarray
+                time of each sample in the block
+        """
+        # compare every sample to the one before it
+        # including the last state before the block
+        full = np.concatenate((self._state[sl, None], block), axis = 1)
+        changed = full[:, 1:] ^ full[:, :-1]
+        ch, samp = np.nonzero(changed)
+        if ch.size > 0:
+            # emit edges in the order they occured
+            idx = np.arange(self._state.size)[sl]
+            for i in np.argsort(samp, kind = 'stable'):
+                c, s = ch[i], samp[i]
+                self._emit_edge(idx[c], block[c, s], t[s])
+        self._state[sl] = block[:, -1]
+
+    def _read_devices(self, read):
+        """
+        call read on every device, concurrently if there are reader
+        threads, and return the results in the order of self.tasks
+        """
+        devs = list(self.tasks)
+        if self._readers is None:
+            return [read(dev) for dev in devs]
+        futures = [self._readers.submit(read, dev) for dev in devs[1:]]
+        return [read(devs[0])] + [f.result() for f in futures]
+
+    @abstractmethod
+    def _read_device_block(self, dev):
+        """
+        read the next block of samples from a device as
+        an array of shape (channels, samples)
+        """
+        ...
+
+    def read_block(self):
+        """
+        read the next block of samples from every device. returns a boolean
+        array of shape (channels, samples) with channels ordered by device
+        and then by order of registration
+        """
+        return np.concatenate(self._read_devices(self._read_device_block), axis = 0)
 
     def stop(self):
         self.running = False
+        self._stop_event.set()
         for dev in self.tasks:
             self.tasks[dev]['task_handle'].close()
 
 
+class NIDIDaemon(NIDaemon):
+    """
+    daemon that monitors digital input lines on national instruments
+    cards and emits signals on the rising and falling edges of each line.
+    the daemon supports the following acquisition modes:
+
+        'poll':
+            on-demand reads of all lines followed by a sleep of 1/fs seconds.
+            the effective sampling rate depends on os scheduling and edges
+            shorter than one loop may be missed
+        'buffered':
+            each device's task runs on its own sample clock at fs with a
+            continuous buffer. samples are read in blocks of block_size and
+            edges are detected across the whole block such that every edge is
+            timestamped to the sample it occured on. NOTE: all registered lines
+            must support hardware timed digital input (e.g. port0 on X-series cards)
+        'change':
+            each device's task uses change detection timing such that the
+            card only acquires a sample when one of the lines changes state.
+            samples are handled in a callback registered with the driver so
+            the daemon is idle while the lines are quiet. edges are timestamped
+            when the callback runs. NOTE: all registered lines must support
+            change detection
+
+    in 'poll' and 'buffered' mode, if lines are registered on more than one
+    device, each device is read concurrently on its own reader thread so the
+    time per iteration does not grow with the number of devices
+
+    in addition to rising_edge and falling_edge, each channel emits rising_edge_time
+    and falling_edge_time with the time of the edge in seconds since the epoch
+
+    high rate lines (e.g. lickometers or camera frame triggers) may instead be
+    registered as counters through register_counter. edges on these lines are
+    counted in hardware by a counter input task which is read at counter_rate.
+    whenever the count has changed the associated NICounterChan emits new_counts
+    with the number of new edges followed by new_counts_time with the time
+    the count was read
+
+    lines which bounce or pick up glitches can be filtered by passing debounce
+    and/or min_pulse when registering them. after an edge is accepted on a line,
+    further changes are ignored for debounce seconds, and a new level is only
+    accepted once it has been held for min_pulse seconds. edges which are filtered
+    out never reach qt and are counted in glitches. accepted edges are timestamped
+    with the time the new level started
+    """
+
+    modes = ('poll', 'buffered', 'change')
+
+    def __init__(self, fs = 1000, mode = 'poll', block_size = None, buffer_size = None, counter_rate = 50):
+        if mode not in self.modes:
+            raise ValueError(f"invalid mode '{mode}'. mode must be one of {self.modes}")
+        super(NIDIDaemon, self).__init__(fs, block_size = block_size, buffer_size = buffer_size)
+        self.mode = mode
+        self.counter_rate = counter_rate
+        self.counter_tasks = {}
+        self.counters = pd.Series([], dtype = object)
+        self.filters = {}
+        # the state arrays exist from the start so state and glitches
+        # can be accessed before the daemon is run
+        NIDIDaemon._index_channels(self)
+
+    def register(self, channel, name, debounce:float = 0, min_pulse:float = 0):
+        """
+        monitor a digital input line
+
+        Args:
+            channel: str
+                address of the line
+            name: str
+                name to assign to the line
+            debounce: float (optional)
+                time in seconds after an edge during which
+                further changes on the line are ignored
+            min_pulse: float (optional)
+                time in seconds a new level must be held for
+                before an edge is accepted
+        """
+
+        self._add_to_task(channel, name).di_channels.add_di_chan(channel, name_to_assign_to_lines = name)
+        self.channels.loc[name] =  NIDIChan()
+        if debounce > 0 or min_pulse > 0:
+            self.filters[name] = (debounce, min_pulse)
+        self._index_channels()
+
+    def register_counter(self, counter:str, name:str, terminal:str = None, edge:str = 'rising'):
+        """
+        count edges on a line in hardware rather than monitoring each edge
+
+        Args:
+            counter: str
+                address of the counter to use (e.g. Dev1/ctr0)
+            name: str
+                name to assign to the counter
+            terminal: str (optional)
+                terminal the line to count edges on is connected to
+                (e.g. /Dev1/PFI0). by default the counter's default
+                input terminal is used
+            edge: str (optional)
+                'rising' or 'falling'. which edges to count
+        """
+        task = nidaqmx.Task()
+        try:
+            edge = nidaqmx.constants.Edge.RISING if edge == 'rising' else nidaqmx.constants.Edge.FALLING
+            chan = task.ci_channels.add_ci_count_edges_chan(counter, name_to_assign_to_channel = name, edge = edge)
+            if terminal is not None:
+                chan.ci_count_edges_term = terminal
+        except:
+            task.close()
+            raise
+        self.counter_tasks[name] = {'task_handle': task, 'count': 0}
+        self.counters.loc[name] = NICounterChan()
+
+    @property
+    def glitches(self) -> pd.Series:
+        """
+        number of changes filtered out on each channel since the daemon was started
+        """
+        return pd.Series(self._glitches, index = self._names, copy = False)
+
+    def _index_channels(self):
+        super(NIDIDaemon, self)._index_channels()
+
+        # filter parameters and state. _raw holds the last sample of each
+        # line and _pending the time at which a line started to differ from
+        # its accepted state (nan if it doesn't)
+        params = np.array([self.filters.get(i, (0, 0)) for i in self._names], dtype = float).reshape(-1, 2)
+        self._debounce = params[:, 0]
+        self._min_pulse = params[:, 1]
+        self._filtering = bool((params > 0).any())
+        self._raw = np.zeros(len(self._names), dtype = bool)
+        self._pending = np.full(len(self._names), np.nan)
+        self._last_edge = np.full(len(self._names), -np.inf)
+        self._glitches = np.zeros(len(self._names), dtype = np.int64)
+        self._filter_lock = threading.Lock()
+        # scratch space so filtering doesn't allocate on every iteration
+        self._accept = np.zeros(len(self._names), dtype = bool)
+        self._mask = np.zeros(len(self._names), dtype = bool)
+        self._differs = np.zeros(len(self._names), dtype = bool)
+        self._idle = np.zeros(len(self._names), dtype = bool)
+        self._elapsed = np.zeros(len(self._names))
+
+    def _has_inputs(self) -> bool:
+        return len(self.tasks) > 0 or len(self.counter_tasks) > 0
+
+    def _concurrent_reads(self) -> bool:
+        return len(self.tasks) > 1 and self.mode != 'change'
+
+    def _acquire(self):
+        self._start_counters()
+        if len(self.tasks) == 0:
+            self._wait_for_stop()
+        elif self.mode == 'buffered':
+            self._run_buffered()
+        elif self.mode == 'change':
+            self._run_change_detection()
+        else:
+            self._run_poll()
+
+    def _service(self):
+        self._service_counters()
+
+    def _run_poll(self):
+        while self.running:
+            sample = self.read()
+            self.n_samples += 1
+            if self._filtering:
+                self._filter_sample(sample, time.time())
+                self._service_counters()
+                time.sleep(1/self.fs)
+                continue
+            np.not_equal(sample, self._state, out = self._changed)
+            if self._changed.any():
+                t = time.time()
+                for i in np.flatnonzero(self._changed):
+                    self._emit_edge(i, sample[i], t)
+                np.copyto(self._state, sample)
+            self._service_counters()
+            time.sleep(1/self.fs)
+
+    def _run_change_detection(self):
+        AcquisitionType = nidaqmx.constants.AcquisitionType
+
+        for dev in self.tasks:
+            handle = self.tasks[dev]['task_handle']
+            sl = self.tasks[dev]['slice']
+
+            # read the initial state of the lines on demand before
+            # switching over to change detection
+            init = np.asarray(handle.read(), dtype = bool).reshape(-1, 1)
+            self._process_block(init, sl, np.array([time.time()]))
+
+            lines = ','.join(self.tasks[dev]['lines'])
+            handle.timing.cfg_change_detection_timing(rising_edge_chan = lines,
+                                                      falling_edge_chan = lines,
+                                                      sample_mode = AcquisitionType.CONTINUOUS,
+                                                      samps_per_chan = self.buffer_size)
+            self.tasks[dev]['callback'] = self._change_callback(handle, sl)
+            handle.register_every_n_samples_acquired_into_buffer_event(1, self.tasks[dev]['callback'])
+
+        for dev in self.tasks:
+            self.tasks[dev]['task_handle'].start()
+        # nothing to do here besides reading
+        # counters until we're told to stop
+        self._wait_for_stop()
+        if self.status == 2:
+            raise RuntimeError("failed to read samples in change detection callback")
+
+    def _wait_for_stop(self):
+        self._stop_event.clear()
+        while self.running:
+            timeout = None
+            if len(self.counter_tasks) > 0:
+                timeout = max(0, self._next_counter_read - time.perf_counter())
+            if len(self.tasks) > 0 and self._filtering:
+                # in change detection mode no samples arrive while a line holds
+                # its level so wake up when a pending edge should be accepted
+                with self._filter_lock:
+                    pending = ~np.isnan(self._pending)
+                    if pending.any():
+                        due = np.maximum(self._pending + self._min_pulse, 
+                                         self._last_edge + self._debounce)[pending].min()
+                        timeout = max(0, due - time.time()) if timeout is None else min(timeout, max(0, due - time.time()))
+            self._stop_event.wait(timeout)
+            self._stop_event.clear()
+            self._service_counters()
+            if len(self.tasks) > 0 and self._filtering and self.running:
+                with self._filter_lock:
+                    self._accept_edges(slice(None), time.time())
+
+    def _start_counters(self):
+        for name in self.counter_tasks:
+            self.counter_tasks[name]['task_handle'].start()
+            self.counter_tasks[name]['count'] = 0
+        self._next_counter_read = time.perf_counter()
+
+    def _service_counters(self):
+        """
+        read all counters if it's time to and emit the 
+        number of new counts for any that have changed
+        """
+        now = time.perf_counter()
+        if len(self.counter_tasks) == 0 or now < self._next_counter_read:
+            return
+        self._next_counter_read = max(self._next_counter_read + 1/self.counter_rate, now)
+        t = time.time()
+        for name in self.counter_tasks:
+            entry = self.counter_tasks[name]
+            count = int(entry['task_handle'].read())
+            # counters roll over at 2^32
+            delta = (count - entry['count']) % 2**32
+            if delta > 0:
+                entry['count'] = count
+                self.counters.loc[name].new_counts.emit(delta)
+                self.counters.loc[name].new_counts_time.emit(t)
+
+    def _change_callback(self, handle, sl):
+        n_chans = sl.stop - sl.start
+        def callback(task_handle, every_n_samples_event_type, number_of_samples, callback_data):
+            try:
+                data = handle.read(number_of_samples_per_channel = number_of_samples)
+                block = np.asarray(data, dtype = bool).reshape(n_chans, -1)
+                self._process_block(block, sl, np.full(block.shape[1], time.time()))
+                self.n_samples += block.shape[1]
+            except:
+                if self.running:
+                    self.status = 2
+                    self.running = False
+                    self._stop_event.set()
+            return 0
+        return callback
+
+    def _accept_edges(self, sl, t):
+        """
+        accept the pending levels of channels in sl which have 
+        been held long enough by time t and emit their edges
+        """
+        raw, state = self._raw[sl], self._state[sl]
+        pending, last = self._pending[sl], self._last_edge[sl]
+        accept, mask, elapsed = self._accept[sl], self._mask[sl], self._elapsed[sl]
+        np.not_equal(raw, state, out = accept)
+        np.subtract(t, pending, out = elapsed)
+        np.greater_equal(elapsed, self._min_pulse[sl], out = mask)
+        accept &= mask
+        np.subtract(t, last, out = elapsed)
+        np.greater_equal(elapsed, self._debounce[sl], out = mask)
+        accept &= mask
+        if accept.any():
+            idx = np.arange(self._state.size)[sl]
+            accepted = np.flatnonzero(accept)
+            for c in accepted[np.argsort(pending[accepted], kind = 'stable')]:
+                self._emit_edge(idx[c], raw[c], pending[c])
+            state[accept] = raw[accept]
+            last[accept] = pending[accept]
+            pending[accept] = np.nan
+
+    def _update_pending(self, t):
+        """
+        update the pending levels of all channels after a
+        new sample has been copied into the raw state array
+        """
+        differs, idle = self._differs, self._idle
+        np.not_equal(self._raw, self._state, out = differs)
+        np.isnan(self._pending, out = idle)
+        # a line returning to its accepted level before 
+        # the new level was accepted is a glitch
+        np.logical_or(differs, idle, out = self._mask)
+        np.logical_not(self._mask, out = self._mask)
+        self._glitches += self._mask
+        np.copyto(self._pending, np.nan, where = self._mask)
+        np.logical_and(differs, idle, out = self._mask)
+        np.copyto(self._pending, t, where = self._mask)
+
+    def _filter_sample(self, sample, t):
+        """
+        filter a single sample of all channels read on demand. unlike 
+        _filter_block this only uses preallocated arrays
+
+        Args:
+            sample: np.ndarray
+                boolean array with the state of each channel
+            t: float
+                time of the sample
+        """
+        with self._filter_lock:
+            if not np.array_equal(sample, self._raw):
+                # levels which matured before this sample
+                self._accept_edges(slice(None), t)
+                np.copyto(self._raw, sample)
+                self._update_pending(t)
+            self._accept_edges(slice(None), t)
+
+    def _filter_block(self, block, sl, t):
+        """
+        filter a block of samples with the debounce and minimum pulse
+        width of each channel before emitting any edges. only samples
+        where at least one line changes need to be stepped through
+
+        Args:
+            block: np.ndarray
+                boolean array of shape (channels, samples)
+            sl: slice
+                slice of the state array that the 
+                channels in the block correspond to
+            t: np.ndarray
+                time of each sample in the block
+        """
+        with self._filter_lock:
+            full = np.concatenate((self._raw[sl, None], block), axis = 1)
+            cols = np.flatnonzero((full[:, 1:] ^ full[:, :-1]).any(axis = 0))
+            raw, state, pending = self._raw[sl], self._state[sl], self._pending[sl]
+            for s in cols:
+                # levels which matured before this sample
+                self._accept_edges(sl, t[s])
+                raw[:] = block[:, s]
+                differs = raw != state
+                # a line returning to its accepted level before 
+                # the new level was accepted is a glitch
+                glitch = ~differs & ~np.isnan(pending)
+                self._glitches[sl] += glitch
+                pending[glitch] = np.nan
+                start = differs & np.isnan(pending)
+                pending[start] = t[s]
+                self._accept_edges(sl, t[s])
+            self._accept_edges(sl, t[-1])
+            if self.mode == 'change' and not np.isnan(pending).all():
+                # wake up _wait_for_stop so it can accept the pending edges
+                self._stop_event.set()
+
+    def _process_block(self, block, sl, t):
+        if self._filtering:
+            return self._filter_block(block, sl, t)
+        super(NIDIDaemon, self)._process_block(block, sl, t)
+
+    def _read_sample(self, dev):
+        self._sample[self.tasks[dev]['slice']] = self.tasks[dev]['task_handle'].read()
+
+    def read(self):
+        """
+        read the current state of all channels on demand. the returned
+        array is reused on every call and ordered as in the state array
+        """
+        self._read_devices(self._read_sample)
+        return self._sample
+
+    def _read_device_block(self, dev):
+        data = self.tasks[dev]['task_handle'].read(number_of_samples_per_channel = self.block_size)
+        return np.atleast_2d(np.asarray(data, dtype = bool))
+
+    def stop(self):
+        super(NIDIDaemon, self).stop()
+        for name in self.counter_tasks:
+            self.counter_tasks[name]['task_handle'].close()
+
+
+class NIAIDaemon(NIDaemon):
+    """
+    daemon that streams analog input channels on national instruments
+    cards and emits the same signals as NIDIDaemon when a channel crosses
+    a threshold. this is useful for analog sensors such as capacitive
+    lickometers or photodiodes in beam breaks.
+
+    each device's task runs on its own sample clock at fs and samples are 
+    read in blocks of block_size. crossings are detected with hysteresis,
+    i.e. a channel goes high when it reaches its high threshold and only 
+    goes low again once it drops to its low threshold. the most recent 
+    window seconds of raw samples of every channel are kept in a ring 
+    buffer which can be accessed through get_window (e.g. for live display)
+    """
+
+    def __init__(self, fs = 1000, block_size = None, buffer_size = None, window:float = 5.):
+        super(NIAIDaemon, self).__init__(fs, block_size = block_size, buffer_size = buffer_size)
+        self.window = window
+        self.thresholds = {}
+        self._ring_lock = threading.Lock()
+        NIAIDaemon._index_channels(self)
+
+    def register(self, channel:str, name:str, high:float, low:float = None, 
+                 min_val:float = -10., max_val:float = 10.):
+        """
+        register an analog input channel
+
+        Args:
+            channel: str
+                address of the channel (e.g. Dev1/ai0)
+            name: str
+                name to assign to the channel
+            high: float
+                threshold in volts at which the channel goes high
+            low: float (optional)
+                threshold in volts at which the channel goes low.
+                by default this is the same as high
+            min_val: float (optional)
+                minimum value expected on the channel in volts
+            max_val: float (optional)
+                maximum value expected on the channel in volts
+        """
+        low = high if low is None else low
+        if low > high:
+            raise ValueError("the low threshold must not be greater than the high threshold")
+        self._add_to_task(channel, name).ai_channels.add_ai_voltage_chan(channel, name_to_assign_to_channel = name,
+                                                                         min_val = min_val, max_val = max_val)
+        self.thresholds[name] = (high, low)
+        self.channels.loc[name] = NIDIChan()
+        self._index_channels()
+
+    def _index_channels(self):
+        super(NIAIDaemon, self)._index_channels()
+        self._high = np.array([self.thresholds[i][0] for i in self._names])[:, None]
+        self._low = np.array([self.thresholds[i][1] for i in self._names])[:, None]
+        with self._ring_lock:
+            self._ring = np.zeros((len(self._names), max(1, int(self.window * self.fs))))
+            self._n_written = 0
+
+    def get_window(self, name:str = None) -> np.ndarray:
+        """
+        get a copy of the most recent samples in the ring buffer in 
+        chronological order
+
+        Args:
+            name: str (optional)
+                name of the channel to get samples for. by default
+                samples for all channels are returned as an array
+                of shape (channels, samples) ordered as in self.state
+        """
+        with self._ring_lock:
+            size = self._ring.shape[1]
+            n = min(self._n_written, size)
+            idx = (self._n_written - n + np.arange(n)) % size
+            if name is None:
+                return self._ring[:, idx]
+            return self._ring[self._names.index(name), idx]
+
+    def _read_device_block(self, dev):
+        data = self.tasks[dev]['task_handle'].read(number_of_samples_per_channel = self.block_size)
+        return np.atleast_2d(np.asarray(data, dtype = float))
+
+    def read_block(self):
+        """
+        read the next block of samples from every device, store them in the
+        ring buffer, and return whether each channel is high at each sample
+        as a boolean array of shape (channels, samples)
+        """
+        block = np.concatenate(self._read_devices(self._read_device_block), axis = 0)
+
+        with self._ring_lock:
+            n, size = block.shape[1], self._ring.shape[1]
+            keep = min(n, size)
+            idx = (self._n_written + n - keep + np.arange(keep)) % size
+            self._ring[:, idx] = block[:, n - keep:]
+            self._n_written += n
+
+        # samples at or above the high threshold are high, samples at or 
+        # below the low threshold are low and all others hold the previous
+        # state. the previous state is carried forward by finding the index
+        # of the last sample that crossed a threshold for every sample
+        crossed = np.full((block.shape[0], block.shape[1] + 1), -1, dtype = np.int8)
+        crossed[:, 0] = self._state
+        crossed[:, 1:][block <= self._low] = 0
+        crossed[:, 1:][block >= self._high] = 1
+        idx = np.where(crossed >= 0, np.arange(crossed.shape[1]), 0)
+        np.maximum.accumulate(idx, axis = 1, out = idx)
+        return np.take_along_axis(crossed, idx, axis = 1)[:, 1:].astype(bool)
+
+
+class DOTaskCache:
+    """
+    cache of digital output tasks. a task is created for a port, 
+    or group of ports, the first time it is written to and is kept
+    running until it is released or the cache is closed. this avoids
+    creating, committing and tearing down a task on every write
+
+    ports may either be written to on demand through write or have
+    a waveform generated on them on the sample clock of the device 
+    through generate. switching a port between the two requires 
+    recreating its task so a port should generally stick to one
+
+    NOTE: a line can only belong to one running task at a time so
+    a line should either always be written to individually or always
+    as part of the same group. groups which are only written once, or
+    whose lines are shared with other groups, should be released after
+    writing
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(port):
+        return port if isinstance(port, str) else tuple(port)
+
+    def get(self, port, timed = False):
+        """
+        get the task used to write to a port or group of ports,
+        creating it if necessary. returns a dictionary with the task
+        handle at 'task_handle' and a lock which should be held while 
+        writing to the task at 'lock'
+
+        Args:
+            port: str or list
+                address of the port or list of addresses 
+                of a group of ports
+            timed: bool
+                whether the task should be configured for 
+                hardware timed generation rather than on-demand writes
+        """
+        key = self._key(port)
+        with self._lock:
+            entry = self.tasks.get(key)
+            if entry is not None and entry['timed'] != timed:
+                with entry['lock']:
+                    entry['task_handle'].close()
+                entry = None
+            if entry is None:
+                task = nidaqmx.Task()
+                try:
+                    for p in ([key] if isinstance(key, str) else key):
+                        task.do_channels.add_do_chan(p)
+                    # on-demand tasks are started once here so that 
+                    # writes don't implicitly start and stop the task
+                    if not timed: task.start()
+                except:
+                    task.close()
+                    raise
+                entry = {'task_handle': task, 'lock': threading.Lock(), 
+                         'timed': timed, 'generating': False}
+                self.tasks[key] = entry
+            return entry
+
+    def write(self, port, value):
+        """
+        write a value to a port or group of ports
+
+        Args:
+            port: str or list
+                address of the port or list of addresses 
+                of a group of ports
+            value: bool or list
+                value to write. if writing to a group of ports
+                this should be a list with one value per port
+        """
+        entry = self.get(port)
+        with entry['lock']:
+            entry['task_handle'].write(value)
+
+    def generate(self, port, waveform, rate:float):
+        """
+        generate a waveform on a port, or group of ports, on the sample 
+        clock of the device. this returns as soon as generation has started. 
+        if a previous waveform is still being generated on the port this 
+        waits for it to finish first. once generation is done the port holds 
+        the last value of the waveform
+
+        Args:
+            port: str or list
+                address of the port or list of addresses 
+                of a group of ports
+            waveform: np.ndarray
+                boolean array of samples to generate. if generating on 
+                a group of ports this should have shape (ports, samples)
+            rate: float
+                sampling rate in Hz
+        """
+        AcquisitionType = nidaqmx.constants.AcquisitionType
+        WAIT_INFINITELY = nidaqmx.constants.WAIT_INFINITELY
+
+        waveform = np.asarray(waveform, dtype = bool)
+        # finite generation requires at least 2 samples
+        if waveform.shape[-1] < 2:
+            waveform = np.concatenate((waveform, waveform[..., -1:]), axis = -1)
+        entry = self.get(port, timed = True)
+        with entry['lock']:
+            task = entry['task_handle']
+            if entry['generating']:
+                task.wait_until_done(timeout = WAIT_INFINITELY)
+                task.stop()
+            task.timing.cfg_samp_clk_timing(rate, sample_mode = AcquisitionType.FINITE,
+                                            samps_per_chan = waveform.shape[-1])
+            task.write(waveform.tolist())
+            task.start()
+            entry['generating'] = True
+
+    def is_done(self, port) -> bool:
+        """
+        check without blocking whether waveform generation on a port is done
+        """
+        entry = self.get(port, timed = True)
+        with entry['lock']:
+            return not entry['generating'] or entry['task_handle'].is_task_done()
+
+    def wait_until_done(self, port):
+        """
+        wait for waveform generation on a port to finish
+        """
+        WAIT_INFINITELY = nidaqmx.constants.WAIT_INFINITELY
+
+        entry = self.get(port, timed = True)
+        with entry['lock']:
+            if entry['generating']:
+                entry['task_handle'].wait_until_done(timeout = WAIT_INFINITELY)
+
+    def release(self, port):
+        """
+        close the task associated to a port or group of ports
+        """
+        with self._lock:
+            entry = self.tasks.pop(self._key(port), None)
+        if entry is not None:
+            with entry['lock']:
+                entry['task_handle'].close()
+
+    def close(self):
+        """
+        close all tasks in the cache
+        """
+        with self._lock:
+            keys = list(self.tasks.keys())
+        for key in keys:
+            self.release(key)
+
+
+# tasks used by digital_write. these are closed when the setup gui is closed
+do_tasks = DOTaskCache()
+register_close_hook(do_tasks.close)
+
+
 def digital_write(port, value):
-    with nidaqmx.Task() as task:
-        task.do_channels.add_do_chan(port)
-        task.write(value, auto_start = True)
-        task.wait_until_done()
+    do_tasks.write(port, value)
+
+
+def pulse_waveform(durations, gap:float, rate:float, active:bool = True):
+    """
+    create a waveform for a train of pulses
+
+    Args:
+        durations: list
+            duration of each pulse in seconds
+        gap: float
+            time between pulses in seconds
+        rate: float
+            sampling rate of the waveform in Hz
+        active: bool
+            value of the line during a pulse. the line
+            idles at the opposite value before and after
+            the train
+    
+    Returns:
+        boolean array of samples
+    """
+    n_gap = int(round(gap * rate))
+    segments = []
+    for i, dur in enumerate(durations):
+        if i > 0: segments.append(np.full(n_gap, not active))
+        segments.append(np.full(max(1, int(round(dur * rate))), active))
+    segments.append(np.full(1, not active))
+    return np.concatenate(segments)
 
 
 class NIRewardControl(RewardWidget):
-    def __init__(self, port, name, parent, purge_port, flush_port, bleed_port1, bleed_port2):
+    """
+    widget for controlling a reward module through pinch valves
+    on digital output lines of a national instruments card. 
+
+    by default the valve is opened and closed by on-demand writes with
+    the time in between measured in software. if hw_timed is set, rewards 
+    and pulse trains are instead generated as a finite waveform on the 
+    sample clock of the device such that the duration of each pulse 
+    is exact and the gui thread is not blocked while the valve is open.
+    rewards triggered while a previous waveform is still being generated
+    are queued and started as soon as it finishes.
+    NOTE: hw_timed requires the valve line to support hardware timed 
+    digital output (e.g. port0 on X-series cards)
+    """
+
+    def __init__(self, port, name, parent, purge_port, flush_port, bleed_port1, bleed_port2, 
+                 hw_timed:bool = False, hw_rate:float = 10000):
         
         super(NIRewardControl, self).__init__()
 
         self.port = port
         self.name = name
         self.parent = parent
+        self.hw_timed = hw_timed
+        self.hw_rate = hw_rate
+        self.pulse_gap = .2
         self.valve_in_use = False
         self.lick_thresh = 3
         self.bout_thresh = .5
+        # waveforms waiting for the valve in hardware timed mode
+        self._waveforms = deque()
+        self._busy_until = 0
+        self._waveform_timer = QTimer(self)
+        self._waveform_timer.setSingleShot(True)
+        self._waveform_timer.timeout.connect(self._next_waveform)
 
         vlayout= QVBoxLayout()
         valve_label = QLabel(self.name)
@@ -165,14 +1068,45 @@ class NIRewardControl(RewardWidget):
         vlayout.addLayout(pulse_mult_layout)      
         self.setLayout(vlayout)
 
-        with nidaqmx.Task() as task:
-            task.do_channels.add_do_chan(purge_port)
-            task.do_channels.add_do_chan(flush_port)
-            task.do_channels.add_do_chan(bleed_port1)
-            task.do_channels.add_do_chan(bleed_port2)
-            task.do_channels.add_do_chan(self.port)
-            task.write([True, True, False, False, True], auto_start = True)
-            task.wait_until_done()
+        # the purge, flush and bleed lines are written together so they switch
+        # at once. they are only written here, and may be shared with other
+        # widgets, so the task is released rather than holding the lines for
+        # the session. the valve line keeps its own task so it can be reused
+        # when delivering reward
+        lines = [purge_port, flush_port, bleed_port1, bleed_port2]
+        digital_write(lines, [True, True, False, False])
+        do_tasks.release(lines)
+        self._write_valve(True)
+
+    def _write_valve(self, value):
+        # in hardware timed mode the valve line belongs to a 
+        # timed task so static writes are also generated on it
+        if self.hw_timed:
+            do_tasks.generate(self.port, [value], self.hw_rate)
+        else:
+            digital_write(self.port, value)
+
+    def _generate(self, waveform):
+        """
+        generate a waveform on the valve line, or queue it if 
+        a previous waveform is still being generated
+        """
+        self._waveforms.append(waveform)
+        if not self._waveform_timer.isActive():
+            self._next_waveform()
+
+    def _next_waveform(self):
+        if not self._waveforms:
+            return
+        remaining = self._busy_until - time.time()
+        if remaining > 0 or not do_tasks.is_done(self.port):
+            self._waveform_timer.start(max(1, int(math.ceil(remaining * 1000))))
+            return
+        waveform = self._waveforms.popleft()
+        do_tasks.generate(self.port, waveform, self.hw_rate)
+        self._busy_until = time.time() + len(waveform)/self.hw_rate
+        if self._waveforms:
+            self._waveform_timer.start(max(1, int(math.ceil(len(waveform)/self.hw_rate * 1000))))
     
     def single_pulse(self):
         if not self.valve_in_use:
@@ -183,37 +1117,57 @@ class NIRewardControl(RewardWidget):
     def small_pulse(self):
         if not self.valve_in_use:
             self.valve_in_use = True
-            self.trigger_reward(self.port, float(self.small_pulse_frac.text()) * float(self.amt.text()))
+            self.trigger_reward(float(self.small_pulse_frac.text()) * float(self.amt.text()))
             self.valve_in_use = False
         pass
 
     def pulse_multiple(self):
         if not self.valve_in_use:
             self.valve_in_use = True
-            for _ in range(self.pulse_mult_num.value()):
-                self.trigger_reward(float(self.amt.text()))
-                time.sleep(.2)
+            if self.hw_timed:
+                # generate the whole train at once
+                dur = float(self.amt.text())/float(self.flow_rate.text())
+                if dur > 0:
+                    durs = [dur] * self.pulse_mult_num.value()
+                    self._generate(pulse_waveform(durs, self.pulse_gap, self.hw_rate, active = False))
+            else:
+                for _ in range(self.pulse_mult_num.value()):
+                    self.trigger_reward(float(self.amt.text()))
+                    time.sleep(self.pulse_gap)
             self.valve_in_use = False
 
     def open_valve(self):
         if not self.valve_in_use:
-            digital_write(self.port, False)
+            self._write_valve(False)
             self.parent.log(f"{self.name} open")
         return
 
     def close_valve(self):
         if not self.valve_in_use:
-            digital_write(self.port, True)
+            self._write_valve(True)
             self.parent.log(f"{self.name} close")
         return
     
     def trigger_reward(self, amount, sync = False):
         dur = amount/float(self.flow_rate.text())
         if dur > 0:
-            if sync:
-                digital_write(self.widget.port, False)
+            if self.hw_timed:
+                waveform = pulse_waveform([dur], 0, self.hw_rate, active = False)
+                if sync:
+                    # deliver any queued rewards first so they stay in order
+                    while self._waveforms:
+                        self._waveform_timer.stop()
+                        do_tasks.wait_until_done(self.port)
+                        self._busy_until = 0
+                        self._next_waveform()
+                    do_tasks.generate(self.port, waveform, self.hw_rate)
+                    do_tasks.wait_until_done(self.port)
+                else:
+                    self._generate(waveform)
+            elif sync:
+                digital_write(self.port, False)
                 time.sleep(dur) # i should prob do this asynchronously.
-                digital_write(self.widget.port, True)
+                digital_write(self.port, True)
             else:
                 self.reward_thread = self.RewardDeliveryThread(self, dur)
                 self.reward_thread.start()
@@ -231,38 +1185,309 @@ class NIRewardControl(RewardWidget):
 
 
 class EventstringSender(QGroupBox):
-    def __init__(self, parent, event_line_name:str, event_line_addr:str, ip:str = socket.gethostbyname(socket.gethostname()), port:int = 2345):
+    """
+    widget for sending event strings to a timestamping unit while
+    simultaneously raising a digital line on a national instruments card.
+
+    messages passed to send are timestamped and put on a queue which is
+    consumed by a dedicated worker thread. the worker owns the socket and
+    the event line. each message gets its own pulse on the event line and
+    its own datagram so downstream timestampers can pair them one to one.
+    if coalesce is set, bursts of messages which are queued before the 
+    worker gets to them are instead sent as a single pulse and a single 
+    datagram to each destination with one message per line. messages are
+    logged with the time at which they were queued. errors writing to the
+    card are logged and do not stop the worker
+
+    if code lines are provided each event type is assigned a numeric code
+    which is written as a parallel word on the code lines alongside a
+    strobe on the event line. the words and strobes for a batch of events
+    are generated in one hardware-timed write so the acquisition system
+    records each event, and which event it was, in a single sample. codes
+    start at 1 and 0 is left as the idle word. the code table is saved to
+    the session directory as {event_line_name}_event_codes.csv
+    """
+
+    _STOP = object()
+    _REBIND = object()
+    _SET_CODE = object()
+
+    def __init__(self, parent, event_line_name:str, event_line_addr:str, ip:str = socket.gethostbyname(socket.gethostname()), 
+                 port:int = 2345, max_batch:int = 64, code_lines:list = None, code_key = None, 
+                 strobe_width:float = 1e-3, hw_rate:float = 10000, coalesce:bool = False):
+        """
+        Args:
+            parent: SetupGUI
+                the gui this handler belongs to
+            event_line_name: str
+                name of the event line
+            event_line_addr: str
+                address of the digital line to pulse for each event. 
+                when using event codes this is the strobe line
+            ip: str
+                ip address to send eventstrings to
+            port: int
+                port to send eventstrings to
+            max_batch: int
+                maximum number of queued messages to handle at once
+            code_lines: list, optional
+                addresses of the digital lines to write event codes on,
+                least significant bit first. all lines must be on the
+                same device as the event line
+            code_key: callable, optional
+                function mapping a message to its event type. by default 
+                standalone numbers in the message are ignored so, for example,
+                rewards of different amounts share a code
+            strobe_width: float
+                duration of the strobe in seconds
+            hw_rate: float
+                sampling rate used to generate the code words
+            coalesce: bool
+                whether to send bursts of queued messages as one pulse
+                and one datagram per destination
+        """
         super(EventstringSender, self).__init__()
 
         self.setTitle(f"{event_line_name} Eventstring Destination")
         self.parent = parent
+        self.name = event_line_name
         self.event_line_addr = event_line_addr
+        self.max_batch = max_batch
+        self.code_lines = list(code_lines) if code_lines is not None else None
+        self.code_key = code_key if code_key is not None else self._default_code_key
+        self.strobe_width = strobe_width
+        self.hw_rate = hw_rate
+        self.coalesce = coalesce
+        self.codes = {}
+        self._session_dir = None
         port_layout = QHBoxLayout()
         ip_label = QLabel(f"IP: ")
         self.ip = QLineEdit()
         self.ip.setText(ip)
+        self.ip.editingFinished.connect(self._update_dest)
         port_label = QLabel("PORT: ")
         self.port = QLineEdit()
         self.port.setValidator(QDoubleValidator())
         self.port.setText(f"{port}")
+        self.port.editingFinished.connect(self._update_dest)
 
         port_layout.addWidget(ip_label)
         port_layout.addWidget(self.ip)
         port_layout.addWidget(port_label)
         port_layout.addWidget(self.port)
-
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        
         self.setLayout(port_layout)
+
+        # destination is cached here so the worker
+        # never has to touch the line edits
+        self._update_dest()
+        self._queue = queue.SimpleQueue()
+        self.sender_thread = EventstringSender.SenderThread(self)
+        self.sender_thread.start()
+
+    def _update_dest(self):
+        self._dest = (self.ip.text(), int(self.port.text()))
+
+    @staticmethod
+    def _default_code_key(msg):
+        return re.sub(r"(?<![\w.])[-+]?\d+(\.\d+)?(?![\w.])", "#", msg)
+
+    def set_code(self, event_type:str, code:int):
+        """
+        assign a code to an event type ahead of time. this should be 
+        called before any events of this type are sent. the code table
+        is owned by the worker thread so the assignment is made, and 
+        the table saved, on the worker after any messages already queued
+
+        Args:
+            event_type: str
+                event type as returned by code_key
+            code: int
+                code to assign
+        """
+        if self.code_lines is None:
+            raise ValueError("this eventstring handler was not configured with code lines")
+        if not 0 < code < 2**len(self.code_lines):
+            raise ValueError(f"code must be between 1 and {2**len(self.code_lines) - 1}")
+        result = Future()
+        self._queue.put((self._SET_CODE, event_type, code, result))
+        # raises if the code is already assigned
+        result.result(timeout = 5.)
+
+    def _assign_code(self, event_type, code):
+        if code in self.codes.values() and self.codes.get(event_type) != code:
+            raise ValueError(f"code {code} is already assigned")
+        self.codes[event_type] = code
+        self._save_codes()
+
+    def _get_code(self, msg):
+        event_type = self.code_key(msg)
+        code = self.codes.get(event_type)
+        if code is None:
+            used = set(self.codes.values())
+            code = next((i for i in range(1, 2**len(self.code_lines)) if i not in used), None)
+            if code is None:
+                self.parent.logger.warning(f"ran out of event codes, not assigning a code to '{event_type}'")
+                return 0
+            self.codes[event_type] = code
+            self._save_codes()
+        return code
+
+    def _save_codes(self):
+        if self._session_dir is None or self.code_lines is None:
+            return
+        table = pd.DataFrame({'code': list(self.codes.values()), 'event': list(self.codes.keys())})
+        table.sort_values('code').to_csv(Path(self._session_dir)/f"{self.name}_event_codes.csv", index = False)
+
+    def _code_waveform(self, codes):
+        """
+        build the waveform for a sequence of event codes. each code is
+        set up one sample before the strobe rises and held for one sample
+        after it falls. the lines are all low at the end
+        """
+        n_bits = len(self.code_lines)
+        width = max(1, int(round(self.strobe_width * self.hw_rate)))
+        length = width + 2
+        bits = (np.asarray(codes)[:, None] >> np.arange(n_bits)) & 1
+        waveform = np.zeros((n_bits + 1, len(codes) * length + 1), dtype = bool)
+        for i, b in enumerate(bits.astype(bool)):
+            start = i * length
+            waveform[:n_bits, start:start + length] = b[:, None]
+            waveform[n_bits, start + 1:start + 1 + width] = True
+        return waveform
+
+    def set_session_dir(self, session_dir):
+        """
+        set the directory the code table is saved to. the table is saved
+        immediately and again whenever a new code is assigned
+
+        Args:
+            session_dir: str or Path
+                directory to save the code table to
+        """
+        # the worker owns the code table so this is handled on its thread
+        self._queue.put(Path(session_dir))
     
     def bind_port(self):
-        if self.sock is not None:
-            self.sock.close()
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._queue.put(self._REBIND)
 
     def send(self, msg):
-        digital_write(self.event_line_addr, True)
-        if self.sock is not None:
-            self.sock.sendto(msg.encode("utf8"), (self.ip.text(), int(self.port.text())))
-        self.parent.logger.info(msg)
-        digital_write(self.event_line_addr, False)
\ No newline at end of file
+        # messages are logged on the worker, so the caller is looked
+        # up here to attribute the log record to the code that sent it
+        logger = self.parent.logger
+        caller = logger.findCaller(stacklevel = 2)[:3] if logger.isEnabledFor(logging.INFO) else None
+        self._queue.put((time.time(), msg, self._dest, caller))
+
+    def flush(self, timeout:float = 5.) -> bool:
+        """
+        block until all messages queued so far have been sent and logged
+
+        Args:
+            timeout: float
+                maximum time to wait in seconds
+
+        Returns:
+            whether the messages were sent before the timeout
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        if not done.wait(timeout):
+            self.parent.logger.warning(f"timed out flushing {self.name} eventstrings")
+            return False
+        return True
+
+    def close(self):
+        """
+        send any queued messages and stop the worker
+        """
+        self._queue.put(self._STOP)
+        self.sender_thread.wait()
+
+    class SenderThread(QThread):
+        def __init__(self, sender):
+            super(EventstringSender.SenderThread, self).__init__()
+            self.sender = sender
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        def run(self):
+            q = self.sender._queue
+            running = True
+            while running:
+                # block until there is something to send then
+                # grab whatever else has been queued in the meantime
+                batch = []
+                flushed = None
+                item = q.get()
+                while True:
+                    if item is EventstringSender._STOP:
+                        running = False
+                    elif isinstance(item, threading.Event):
+                        flushed = item
+                        break
+                    elif item is EventstringSender._REBIND:
+                        self.sock.close()
+                        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    elif isinstance(item, Path):
+                        self.sender._session_dir = item
+                        self.sender._save_codes()
+                    elif item[0] is EventstringSender._SET_CODE:
+                        _, event_type, code, result = item
+                        try:
+                            self.sender._assign_code(event_type, code)
+                            result.set_result(code)
+                        except Exception as e:
+                            result.set_exception(e)
+                    else:
+                        batch.append(item)
+                    if not running or len(batch) >= self.sender.max_batch:
+                        break
+                    try:
+                        item = q.get_nowait()
+                    except queue.Empty:
+                        break
+                try:
+                    if self.sender.coalesce and len(batch) > 0:
+                        self.send_batch(batch)
+                    else:
+                        for item in batch:
+                            self.send_batch([item])
+                except Exception:
+                    self.sender.parent.logger.exception(f"error sending {self.sender.name} eventstrings")
+                finally:
+                    if flushed is not None:
+                        flushed.set()
+            self.sock.close()
+
+        def send_batch(self, batch):
+            logger = self.sender.parent.logger
+            raised = False
+            try:
+                if self.sender.code_lines is not None:
+                    codes = [self.sender._get_code(msg) for _, msg, _, _ in batch]
+                    lines = self.sender.code_lines + [self.sender.event_line_addr]
+                    do_tasks.generate(lines, self.sender._code_waveform(codes), self.sender.hw_rate)
+                else:
+                    digital_write(self.sender.event_line_addr, True)
+                    raised = True
+            except Exception as e:
+                logger.error(f"failed to pulse {self.sender.name} event line: {e}")
+            dests = {}
+            for _, msg, dest, _ in batch:
+                dests.setdefault(dest, []).append(msg)
+            for dest, msgs in dests.items():
+                try:
+                    self.sock.sendto("\n".join(msgs).encode("utf8"), dest)
+                except OSError as e:
+                    logger.error(f"failed to send eventstring to {dest}: {e}")
+            for t, msg, _, caller in batch:
+                if caller is None or not logger.isEnabledFor(logging.INFO):
+                    continue
+                fn, lno, func = caller
+                record = logger.makeRecord(logger.name, logging.INFO, fn, lno, msg, None, None, func)
+                record.created = t
+                record.msecs = (t - int(t)) * 1000
+                logger.handle(record)
+            if raised:
+                try:
+                    digital_write(self.sender.event_line_addr, False)
+                except Exception as e:
+                    logger.error(f"failed to lower {self.sender.name} event line: {e}")
@@ -0,0 +1,542 @@
+"""
+simulated stand-in for the subset of the nidaqmx api used by
+pyBehavior.interfaces.ni. this makes it possible to benchmark and
+test the national instruments interface without a physical card.
+
+virtual devices are created with add_device and replay either scripted
+or random edge patterns on their digital lines. the simulated backend
+can be selected by calling pyBehavior.interfaces.ni.use_backend('sim')
+or by setting the environment variable PYBEHAVIOR_NI_BACKEND=sim before
+importing pyBehavior.interfaces.ni. for example:
+
+    from pyBehavior.interfaces import ni, ni_sim
+    ni.use_backend('sim')
+    dev = ni_sim.add_device('Dev1', n_lines = 16, edge_rate = 5)
+    daemon = ni.NIDIDaemon(mode = 'buffered')
+    daemon.register('Dev1/port0/line0', 'lick')
+"""
+
+import threading
+import time
+import types
+import re
+import zlib
+from enum import Enum
+from collections import deque
+import numpy as np
+
+
+class AcquisitionType(Enum):
+    FINITE = 10178
+    CONTINUOUS = 10123
+
+
+class Edge(Enum):
+    RISING = 10280
+    FALLING = 10171
+
+
+WAIT_INFINITELY = -1.0
+READ_ALL_AVAILABLE = -1
+
+constants = types.SimpleNamespace(AcquisitionType = AcquisitionType,
+                                  Edge = Edge,
+                                  WAIT_INFINITELY = WAIT_INFINITELY,
+                                  READ_ALL_AVAILABLE = READ_ALL_AVAILABLE)
+
+
+class DaqError(Exception):
+    pass
+
+class DaqNotSupportedError(DaqError):
+    pass
+
+class DaqNotFoundError(DaqError):
+    pass
+
+errors = types.SimpleNamespace(DaqError = DaqError, DaqNotSupportedError = DaqNotSupportedError)
+_lib = types.SimpleNamespace(DaqNotFoundError = DaqNotFoundError)
+
+
+class SimLine:
+    """
+    a simulated digital line. when used as an input the state of the line
+    is defined by a sorted list of times at which it toggles. these are either
+    scripted or generated on the fly as a poisson process with rate edge_rate.
+    when used as an output the line keeps track of the last value written to it
+    """
+
+    def __init__(self, name:str, t0:float, edge_rate:float = 0, rng:np.random.Generator = None):
+        self.name = name
+        self.t0 = t0
+        self.edge_rate = edge_rate
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.toggles = []
+        self._toggles = np.zeros(0)
+        self._horizon = t0
+        # edges may be generated from several reader threads at once
+        self._lock = threading.Lock()
+        self.value = False
+        self.n_writes = 0
+
+    def script(self, events):
+        """
+        replace the edges on this line with a scripted pattern
+
+        Args:
+            events: list
+                list of (time, value) tuples where time is in seconds
+                relative to the creation of the device
+        """
+        toggles = []
+        state = False
+        for t, value in sorted(events):
+            if bool(value) != state:
+                toggles.append(self.t0 + t)
+                state = bool(value)
+        with self._lock:
+            self.edge_rate = 0
+            self.toggles = toggles
+            self._toggles = np.array(toggles)
+            self._horizon = np.inf
+
+    def _extend(self, t):
+        # generate random edges up to time t
+        if self.edge_rate > 0 and self._horizon <= t:
+            with self._lock:
+                while self._horizon <= t:
+                    self._horizon += self.rng.exponential(1/self.edge_rate)
+                    self.toggles.append(self._horizon)
+                self._toggles = np.array(self.toggles)
+
+    def states(self, times):
+        """
+        state of the line at each of the specified times
+        """
+        times = np.asarray(times, dtype = float)
+        self._extend(times.max(initial = self.t0))
+        return np.searchsorted(self._toggles, times, side = 'right') % 2 == 1
+
+    def next_edge(self, after:float):
+        """
+        time of the first edge after a specified time
+        """
+        self._extend(after)
+        i = np.searchsorted(self._toggles, after, side = 'right')
+        return self._toggles[i] if i < self._toggles.size else np.inf
+
+    def last_edge(self, before:float):
+        """
+        time of the last edge at or before a specified time
+        """
+        self._extend(before)
+        i = np.searchsorted(self._toggles, before, side = 'right')
+        return self._toggles[i - 1] if i > 0 else None
+
+
+class SimDevice:
+    """
+    a simulated national instruments device. read_latency is the time 
+    in seconds an on-demand read on the device takes, to mimic the cost
+    of a driver call
+    """
+
+    def __init__(self, name:str, n_lines:int = 8, n_ai:int = 0, n_ao:int = 0, n_ctr:int = 0,
+                 edge_rate:float = 0, seed:int = None, serial:int = None, 
+                 ai_levels:tuple = (0., 5.), ai_noise:float = .05, read_latency:float = 0):
+        self.name = name
+        self.read_latency = read_latency
+        self.product_type = 'Simulated'
+        self.dev_serial_num = serial if serial is not None else zlib.crc32(name.encode())
+        self.t0 = time.time()
+        rng = np.random.default_rng(seed)
+        self.lines = []
+        for i in range(n_lines):
+            self.lines.append(SimLine(f"{name}/port{i//8}/line{i%8}", self.t0, edge_rate, rng))
+        self.di_lines = [types.SimpleNamespace(name = l.name) for l in self.lines]
+        self.do_lines = [types.SimpleNamespace(name = l.name) for l in self.lines]
+        # analog inputs switch between two levels with the same 
+        # edge statistics as the digital lines plus gaussian noise
+        self.rng = rng
+        self.ai_levels = ai_levels
+        self.ai_noise = ai_noise
+        self.ai = [SimLine(f"{name}/ai{i}", self.t0, edge_rate, rng) for i in range(n_ai)]
+        self.ai_physical_chans = [types.SimpleNamespace(name = l.name) for l in self.ai]
+        self.ao_physical_chans = [types.SimpleNamespace(name = f"{name}/ao{i}") for i in range(n_ao)]
+        self.ci_physical_chans = [types.SimpleNamespace(name = f"{name}/ctr{i}") for i in range(n_ctr)]
+
+    def line(self, name:str) -> SimLine:
+        m = re.fullmatch(r".+/ai(\d+)", name)
+        if m is not None:
+            if int(m.group(1)) >= len(self.ai):
+                raise DaqError(f"channel '{name}' does not exist")
+            return self.ai[int(m.group(1))]
+        m = re.fullmatch(r".+/port(\d+)/line(\d+)", name)
+        if m is None:
+            raise DaqError(f"invalid line '{name}'")
+        i = 8 * int(m.group(1)) + int(m.group(2))
+        if i >= len(self.lines):
+            raise DaqError(f"line '{name}' does not exist")
+        return self.lines[i]
+
+    def script(self, line:str, events):
+        """
+        replace the edges on a line with a scripted pattern. see SimLine.script
+        """
+        self.line(line).script(events)
+
+
+_devices = {}
+# running task holding each digital output line. as on a real card
+# an output line can only belong to one running task at a time
+_reserved = {}
+
+def add_device(name:str, **kwargs) -> SimDevice:
+    """
+    create a new simulated device. all keyword arguments are passed to SimDevice
+    """
+    _devices[name] = SimDevice(name, **kwargs)
+    return _devices[name]
+
+def remove_device(name:str):
+    _devices.pop(name, None)
+
+def reset():
+    """
+    remove all simulated devices
+    """
+    _devices.clear()
+    _reserved.clear()
+
+def _expand(names:str):
+    # expand a comma separated list of physical channels
+    # optionally using ranges, e.g. Dev1/port0/line0:3
+    out = []
+    for name in names.split(','):
+        name = name.strip()
+        m = re.fullmatch(r"(.*?)(\d+):(\d+)", name)
+        if m is not None:
+            out += [f"{m.group(1)}{i}" for i in range(int(m.group(2)), int(m.group(3)) + 1)]
+        else:
+            out.append(name)
+    return out
+
+def _get_line(name:str) -> SimLine:
+    dev = name.split('/')[0]
+    if dev not in _devices:
+        raise DaqError(f"device '{dev}' does not exist")
+    return _devices[dev].line(name)
+
+
+class System:
+    @staticmethod
+    def local():
+        return System()
+
+    @property
+    def devices(self):
+        return list(_devices.values())
+
+system = types.SimpleNamespace(System = System)
+
+
+class _DIChannels:
+    def __init__(self, task):
+        self._task = task
+
+    def add_di_chan(self, lines, name_to_assign_to_lines = '', **kwargs):
+        for line in _expand(lines):
+            self._task._add_line(line, 'di')
+
+
+class _DOChannels:
+    def __init__(self, task):
+        self._task = task
+
+    def add_do_chan(self, lines, name_to_assign_to_lines = '', **kwargs):
+        for line in _expand(lines):
+            self._task._add_line(line, 'do')
+
+
+class _CIChannel:
+    def __init__(self, task, counter):
+        self._task = task
+        self.name = counter
+        # by default count edges on the line with the 
+        # same index as the counter
+        dev, ctr = counter.split('/')
+        i = int(ctr.replace('ctr', ''))
+        self._line = _devices[dev].lines[i] if dev in _devices and i < len(_devices[dev].lines) else None
+
+    @property
+    def ci_count_edges_term(self):
+        return self._line.name
+
+    @ci_count_edges_term.setter
+    def ci_count_edges_term(self, terminal):
+        # PFIn terminals are mapped to line n on port 1 as on X-series cards
+        m = re.fullmatch(r"/?(\w+)/PFI(\d+)", terminal)
+        if m is not None:
+            terminal = f"{m.group(1)}/port1/line{m.group(2)}"
+        self._line = _get_line(terminal.lstrip('/'))
+
+
+class _CIChannels:
+    def __init__(self, task):
+        self._task = task
+
+    def add_ci_count_edges_chan(self, counter, name_to_assign_to_channel = '', edge = Edge.RISING, 
+                                initial_count = 0, **kwargs):
+        dev = counter.split('/')[0]
+        if dev not in _devices or counter not in [c.name for c in _devices[dev].ci_physical_chans]:
+            raise DaqError(f"counter '{counter}' does not exist")
+        if self._task.kind is not None:
+            raise DaqError("cannot add more than one counter to a task")
+        self._task.kind = 'ci'
+        chan = _CIChannel(self._task, counter)
+        chan.edge = edge
+        chan.initial_count = initial_count
+        self._task.counter = chan
+        return chan
+
+
+class _AIChannels:
+    def __init__(self, task):
+        self._task = task
+
+    def add_ai_voltage_chan(self, physical_channel, name_to_assign_to_channel = '', **kwargs):
+        for chan in _expand(physical_channel):
+            self._task._add_line(chan, 'ai')
+
+
+class _Timing:
+    def __init__(self, task):
+        self._task = task
+
+    def cfg_samp_clk_timing(self, rate, source = '', active_edge = None,
+                            sample_mode = AcquisitionType.FINITE, samps_per_chan = 1000):
+        self._task._timing = {'type': 'sample_clock', 'rate': float(rate),
+                              'mode': sample_mode, 'samps_per_chan': samps_per_chan}
+
+    def cfg_change_detection_timing(self, rising_edge_chan = '', falling_edge_chan = '',
+                                    sample_mode = AcquisitionType.CONTINUOUS, samps_per_chan = 1000):
+        self._task._timing = {'type': 'change', 'mode': sample_mode,
+                              'samps_per_chan': samps_per_chan}
+
+
+class Task:
+    """
+    simulated nidaqmx task
+    """
+
+    def __init__(self, new_task_name = ''):
+        self.name = new_task_name
+        self.lines = []
+        self.kind = None
+        self.di_channels = _DIChannels(self)
+        self.do_channels = _DOChannels(self)
+        self.ci_channels = _CIChannels(self)
+        self.ai_channels = _AIChannels(self)
+        self.counter = None
+        self.timing = _Timing(self)
+        self._timing = None
+        self._read_latency = 0
+        self._running = False
+        self._closed = False
+        self._callback = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._buffer = deque()
+        self._waveform = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _add_line(self, name, kind):
+        if self.kind is not None and self.kind != kind:
+            raise DaqError("cannot mix channel types in a task")
+        self.kind = kind
+        self.lines.append(_get_line(name))
+        self._read_latency = max(self._read_latency, _devices[name.split('/')[0]].read_latency)
+
+    def _check(self):
+        if self._closed:
+            raise DaqError("task has been closed")
+
+    def register_every_n_samples_acquired_into_buffer_event(self, sample_interval, callback_method):
+        self._callback = (sample_interval, callback_method)
+
+    def _reserve(self):
+        if self.kind != 'do':
+            return
+        for line in self.lines:
+            owner = _reserved.get(line.name)
+            if owner is not None and owner is not self:
+                raise DaqError(f"the specified resource is reserved: '{line.name}' "
+                               f"belongs to task '{owner.name}'")
+        for line in self.lines:
+            _reserved[line.name] = self
+
+    def _unreserve(self):
+        for line in self.lines:
+            if _reserved.get(line.name) is self:
+                del _reserved[line.name]
+
+    def start(self):
+        self._check()
+        self._reserve()
+        self._running = True
+        self._t_start = time.time()
+        self._n_read = 0
+        self._stop_event.clear()
+        if self._timing is not None and self._timing['type'] == 'change':
+            self._last = self._states(self._t_start)
+            self._thread = threading.Thread(target = self._detect_changes, daemon = True)
+            self._thread.start()
+
+    def stop(self):
+        self._finish_generation()
+        self._unreserve()
+        self._running = False
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def close(self):
+        if not self._closed:
+            self.stop()
+            self._closed = True
+
+    def _states(self, t):
+        return np.array([line.states([t])[0] for line in self.lines])
+
+    def _detect_changes(self):
+        t = self._t_start
+        while self._running:
+            nxt = min(line.next_edge(t) for line in self.lines)
+            if self._stop_event.wait(min(max(nxt - time.time(), 0), .1)):
+                break
+            if nxt > time.time():
+                continue
+            t = nxt
+            state = self._states(t)
+            if (state != self._last).any():
+                self._last = state
+                self._buffer.append(state)
+                if self._callback is not None and len(self._buffer) >= self._callback[0]:
+                    self._callback[1](0, 1, self._callback[0], None)
+
+    def _to_analog(self, data):
+        if self.kind != 'ai':
+            return data
+        dev = _devices[self.lines[0].name.split('/')[0]]
+        lo, hi = dev.ai_levels
+        return np.where(data, hi, lo) + dev.rng.normal(0, dev.ai_noise, data.shape)
+
+    def _format(self, data, n_samples):
+        data = self._to_analog(data)
+        # mimic the shapes returned by nidaqmx
+        if n_samples is None:
+            data = data[:, 0].tolist()
+            return data[0] if len(self.lines) == 1 else data
+        data = data.tolist()
+        return data[0] if len(self.lines) == 1 else data
+
+    def _count(self):
+        # number of edges on the counter's line since the task was started
+        chan = self.counter
+        if chan._line is None:
+            raise DaqError(f"no terminal configured for '{chan.name}'")
+        now = time.time()
+        chan._line._extend(now)
+        toggles = chan._line._toggles
+        # lines start low so every other toggle is a rising edge
+        edges = toggles[0::2] if chan.edge == Edge.RISING else toggles[1::2]
+        n = np.searchsorted(edges, now, side = 'right') - np.searchsorted(edges, self._t_start, side = 'right')
+        return (chan.initial_count + int(n)) % 2**32
+
+    def read(self, number_of_samples_per_channel = None, timeout = 10.0):
+        self._check()
+        if self.kind == 'ci':
+            if not self._running:
+                self.start()
+            return self._count()
+        if self.kind not in ('di', 'ai'):
+            raise DaqError("read is only supported for input tasks")
+        n = number_of_samples_per_channel
+        if self._timing is None or not self._running:
+            # on demand read
+            if self._read_latency > 0:
+                time.sleep(self._read_latency)
+            data = self._states(time.time())[:, None]
+        elif self._timing['type'] == 'change':
+            if n is None: n = 1
+            if n == READ_ALL_AVAILABLE: n = len(self._buffer)
+            deadline = time.time() + timeout
+            while len(self._buffer) < n:
+                if time.time() > deadline or not self._running:
+                    raise DaqError("timed out waiting for samples")
+                time.sleep(.001)
+            data = np.array([self._buffer.popleft() for _ in range(n)]).T.reshape(len(self.lines), n)
+        else:
+            rate = self._timing['rate']
+            if n is None: n = 1
+            if n == READ_ALL_AVAILABLE:
+                n = int((time.time() - self._t_start) * rate) - self._n_read
+            times = self._t_start + (self._n_read + np.arange(n))/rate
+            if n > 0:
+                wait = times[-1] - time.time()
+                if wait > timeout:
+                    raise DaqError("timed out waiting for samples")
+                if wait > 0 and self._stop_event.wait(wait):
+                    raise DaqError("task stopped while waiting for samples")
+            self._check()
+            self._n_read += n
+            data = np.array([line.states(times) for line in self.lines]).reshape(len(self.lines), n)
+        return self._format(data, number_of_samples_per_channel)
+
+    def write(self, data, auto_start = None, timeout = 10.0):
+        self._check()
+        if self.kind != 'do':
+            raise DaqError("write is only supported for digital output tasks")
+        data = np.asarray(data, dtype = bool).reshape(len(self.lines), -1)
+        if self._timing is not None and self._timing['type'] == 'sample_clock':
+            self._waveform = data
+        else:
+            # a write to a task which isn't running starts
+            # it implicitly for the duration of the write
+            if not self._running:
+                self._reserve()
+            for line, value in zip(self.lines, data[:, -1]):
+                line.value = bool(value)
+                line.n_writes += 1
+            if not self._running:
+                self._unreserve()
+        return data.shape[1]
+
+    def _generation_end(self):
+        return self._t_start + self._waveform.shape[1]/self._timing['rate']
+
+    def _finish_generation(self):
+        if self._waveform is not None and self._running:
+            for line, value in zip(self.lines, self._waveform[:, -1]):
+                line.value = bool(value)
+                line.n_writes += 1
+            self._waveform = None
+
+    def is_task_done(self):
+        if self._waveform is None or not self._running:
+            return True
+        return time.time() >= self._generation_end()
+
+    def wait_until_done(self, timeout = 10.0):
+        if self._waveform is not None and self._running:
+            wait = self._generation_end() - time.time()
+            if timeout >= 0 and wait > timeout:
+                raise DaqError("timed out waiting for the task to finish")
+            if wait > 0: time.sleep(wait)
+            self._finish_generation()
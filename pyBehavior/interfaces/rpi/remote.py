@@ -1,10 +1,498 @@
-from PyQt5.QtCore import QThread, pyqtSignal
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import QThread, pyqtSignal, QObject
 from PyQt5.QtWidgets import QGroupBox, QSizePolicy, QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QLineEdit, QLabel, QComboBox, QTabWidget
 from PyQt5.QtGui import  QDoubleValidator
 import time
 from pyBehavior.gui import RewardWidget
 import typing
+import socket
+import threading
+import json
+import asyncio
+import functools
+import itertools
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor, Future
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# whether the server behind each client has 
+# evaluated a batched list expression successfully
+_list_exprs = weakref.WeakKeyDictionary()
+
+
+def get_many(client, exprs:typing.List[str], channel:str = 'run') -> list:
+    """
+    get the values of several attributes on the pi, in a single round trip 
+    if the server allows it. the attributes are requested as one list 
+    expression, e.g. "[auto_fill, pumps['pump1'].speed]", which only works
+    if the ratBerryPi server evaluates it like any other attribute. this has
+    not been verified for the stock server, so batching is best-effort: if
+    a server which has never accepted a list expression rejects one, a 
+    warning is logged and attributes are requested one at a time from 
+    then on
+
+    Args:
+        client: ratBerryPi.remote.client.Client
+            client to make the request through
+        exprs: typing.List[str]
+            attributes to get, as would be passed to client.get
+        channel: str (optional)
+            channel to make the request on
+    """
+    exprs = list(exprs)
+    if len(exprs) > 1 and _list_exprs.get(client, True):
+        try:
+            values = client.get("[" + ", ".join(exprs) + "]", channel = channel)
+            if isinstance(values, (list, tuple)) and len(values) == len(exprs):
+                _list_exprs[client] = True
+                return list(values)
+        except Exception:
+            # fall through so an error can be traced to an attribute
+            pass
+        if client not in _list_exprs:
+            logger.warning("the ratBerryPi server does not support batched requests. requesting attributes one at a time")
+            _list_exprs[client] = False
+    return [client.get(expr, channel = channel) for expr in exprs]
+
+
+class RemoteSnapshot:
+    """
+    cache of attribute values on the pi which are fetched in bulk through
+    get_many. remote widgets read their initial state from the snapshot of
+    their client so a widget can be built with a single round trip where 
+    the server supports batched requests, or none at all if the attributes
+    it needs were prefetched when the gui started.
+    values older than max_age seconds are fetched again
+    """
+
+    global_attrs = ['auto_fill', 'auto_fill_frac_thresh']
+    _snapshots = {}
+
+    def __init__(self, client, channel:str = 'run', max_age:float = 5.):
+        self.client = client
+        self.channel = channel
+        self.max_age = max_age
+        self.values = {}
+
+    @classmethod
+    def for_client(cls, client) -> "RemoteSnapshot":
+        """
+        get the snapshot shared by all widgets using a client
+        """
+        if id(client) not in cls._snapshots:
+            cls._snapshots[id(client)] = cls(client)
+        return cls._snapshots[id(client)]
+
+    def _fresh(self, expr:str) -> bool:
+        return expr in self.values and (time.time() - self.values[expr][1]) < self.max_age
+
+    def prefetch(self, exprs:typing.List[str]) -> None:
+        """
+        fetch any of the attributes which aren't in the 
+        snapshot already in one batched request
+        """
+        exprs = [e for e in dict.fromkeys(exprs) if not self._fresh(e)]
+        if len(exprs) > 0:
+            t = time.time()
+            for expr, value in zip(exprs, get_many(self.client, exprs, channel = self.channel)):
+                self.values[expr] = (value, t)
+
+    def get(self, expr:str):
+        """
+        get the value of an attribute from the snapshot, 
+        fetching it if it isn't there
+        """
+        if not self._fresh(expr):
+            self.prefetch([expr])
+        return self.values[expr][0]
+
+
+def snapshot_setup(client, modules:typing.List[str] = (), pumps:typing.List[str] = ()) -> RemoteSnapshot:
+    """
+    take a snapshot of all attributes needed to build the remote widgets
+    for a set of modules and pumps. where the server evaluates list 
+    expressions this is a single round trip. batching is best-effort 
+    (see get_many), so otherwise this falls back to one request per 
+    attribute
+
+    Args:
+        client: ratBerryPi.remote.client.Client
+            client to make the request through
+        modules: typing.List[str] (optional)
+            names of the modules to fetch attributes for
+        pumps: typing.List[str] (optional)
+            names of the pumps to fetch attributes for
+    """
+    exprs = list(RemoteSnapshot.global_attrs)
+    for pump in pumps:
+        exprs += PumpConfig.remote_attrs(pump)
+    for module in modules:
+        exprs += RPIRewardControl.remote_attrs(module)
+    snapshot = RemoteSnapshot.for_client(client)
+    snapshot.prefetch(exprs)
+    return snapshot
+
+
+class RemoteCommands(QObject):
+    """
+    asynchronous command layer over a ratBerryPi client. commands and 
+    requests are scheduled on an asyncio event loop running in a worker 
+    thread and return a concurrent.futures.Future immediately, so the gui
+    is never blocked by the network or by long running commands on the pi.
+    commands are run in order on each channel and channels run concurrently. 
+    the layer opens its own channels on the client (prefixed with 'async_') 
+    so it never shares a channel with synchronous calls. since the client's
+    channels aren't thread safe they are opened on the gui thread, either
+    through open_channel or by run_command and get, before any work is 
+    submitted on them. the 'run' channel is opened when the layer is created
+
+    callbacks passed to run_command or get are called on the gui thread with 
+    the result. the coroutines run_command_async and get_async may be awaited 
+    inside coroutines passed to submit to chain requests without going back 
+    to the gui thread in between. there is one command layer per client 
+    which is accessed through RemoteCommands.for_client
+
+    ...
+    PyQt Signals
+
+    command_failed(str, str)
+        name of the failed command and the error message
+    """
+
+    command_failed = pyqtSignal(str, str)
+    _deliver = pyqtSignal(object, object)
+    _layers = {}
+
+    def __init__(self, client):
+        super(RemoteCommands, self).__init__()
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self._executors = {}
+        self._lock = threading.Lock()
+        self._deliver.connect(lambda callback, result: callback(result))
+        self._thread = threading.Thread(target = self.loop.run_forever, daemon = True,
+                                        name = "RemoteCommands")
+        self._thread.start()
+        self.open_channel('run')
+
+    @classmethod
+    def for_client(cls, client) -> "RemoteCommands":
+        """
+        get the command layer shared by all widgets using a client. 
+        this should be called on the gui thread
+        """
+        if id(client) not in cls._layers:
+            cls._layers[id(client)] = cls(client)
+        return cls._layers[id(client)]
+
+    @classmethod
+    def stop_all(cls):
+        for layer in cls._layers.values():
+            layer.stop()
+        cls._layers.clear()
+
+    def open_channel(self, channel:str) -> None:
+        """
+        open a channel for the layer to use. this must be called on 
+        the gui thread before coroutines using the channel are submitted
+        """
+        # each channel gets its own connection and a single
+        # thread so requests on a channel run in order
+        with self._lock:
+            if channel not in self._executors:
+                self.client.new_channel(f"async_{channel}")
+                self._executors[channel] = ThreadPoolExecutor(1, thread_name_prefix = f"async_{channel}")
+
+    def _channel(self, channel:str):
+        with self._lock:
+            executor = self._executors.get(channel)
+        if executor is None:
+            raise RuntimeError(f"channel '{channel}' must be opened with open_channel before it is used")
+        return executor
+
+    async def run_command_async(self, cmd:str, args:dict, channel:str = 'run'):
+        """
+        run a command on the pi and return its status. raises a 
+        RuntimeError if the command does not succeed
+        """
+        func = functools.partial(self.client.run_command, cmd, args, channel = f"async_{channel}")
+        status = await self.loop.run_in_executor(self._channel(channel), func)
+        if status != 'SUCCESS\n':
+            raise RuntimeError(f"error status {status!r}")
+        return status
+
+    async def get_async(self, expr:str, channel:str = 'run'):
+        """
+        get the value of an attribute on the pi
+        """
+        func = functools.partial(self.client.get, expr, channel = f"async_{channel}")
+        return await self.loop.run_in_executor(self._channel(channel), func)
+
+    async def get_many_async(self, exprs:typing.List[str], channel:str = 'run') -> list:
+        """
+        get the values of several attributes on the pi (see get_many)
+        """
+        func = functools.partial(get_many, self.client, exprs, channel = f"async_{channel}")
+        return await self.loop.run_in_executor(self._channel(channel), func)
+
+    def submit(self, coro, callback:typing.Callable = None, name:str = None, 
+               finished:typing.Callable = None, report:bool = True) -> Future:
+        """
+        schedule a coroutine on the event loop
+
+        Args:
+            coro: coroutine
+                coroutine to run
+            callback: typing.Callable (optional)
+                function to call on the gui thread with 
+                the result once the coroutine is done
+            name: str (optional)
+                name to report if the coroutine fails
+            finished: typing.Callable (optional)
+                function to call on the gui thread with no arguments
+                once the coroutine is done whether or not it succeeded
+            report: bool (optional)
+                whether to log failures and emit command_failed. callers
+                which report failures themselves should set this to False
+                so failures are only reported once
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(lambda f: self._done(f, callback, name, finished, report))
+        return future
+
+    def _done(self, future:Future, callback:typing.Callable, name:str, finished:typing.Callable, report:bool):
+        if not future.cancelled():
+            exc = future.exception()
+            if exc is not None:
+                if report:
+                    logger.error(f"remote command '{name}' failed: {exc}")
+                    self.command_failed.emit(name or "", str(exc))
+            elif callback is not None:
+                self._deliver.emit(callback, future.result())
+        if finished is not None:
+            self._deliver.emit(lambda _: finished(), None)
+
+    def run_command(self, cmd:str, args:dict, channel:str = 'run', callback:typing.Callable = None,
+                    finished:typing.Callable = None) -> Future:
+        """
+        run a command on the pi without blocking. see submit
+        """
+        self.open_channel(channel)
+        return self.submit(self.run_command_async(cmd, args, channel), callback, cmd, finished)
+
+    def get(self, expr:str, channel:str = 'run', callback:typing.Callable = None) -> Future:
+        """
+        get the value of an attribute on the pi without blocking. see submit
+        """
+        self.open_channel(channel)
+        return self.submit(self.get_async(expr, channel), callback, expr)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        for executor in self._executors.values():
+            executor.shutdown(wait = False)
+
+
+class RemoteAttr(QObject):
+    """
+    an attribute on the pi watched by a RemotePoller
+
+    ...
+    PyQt Signals
+
+    changed(object)
+    """
+    changed = pyqtSignal(object)
+
+    def __init__(self, expr:str, interval:float):
+        super(RemoteAttr, self).__init__()
+        self.expr = expr
+        self.interval = interval
+        self.value = None
+        self.next_read = 0.
+
+
+class RemotePoller(QThread):
+    """
+    thread which polls attributes on the pi for all widgets sharing a
+    client. watched attributes which are due are fetched together with 
+    one batched request per tick on a single channel, and each attribute 
+    emits changed only when its value changes. there is one poller per 
+    client which is created and started the first time an attribute 
+    is watched through RemotePoller.watch
+    """
+
+    _pollers = {}
+
+    def __init__(self, client, channel:str = 'poll'):
+        super(RemotePoller, self).__init__()
+        self.client = client
+        self.channel = channel
+        self.client.new_channel(self.channel)
+        self.attrs = {}
+        self.running = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    @classmethod
+    def for_client(cls, client) -> "RemotePoller":
+        """
+        get the poller shared by all widgets using a client
+        """
+        if id(client) not in cls._pollers:
+            cls._pollers[id(client)] = cls(client)
+        return cls._pollers[id(client)]
+
+    @classmethod
+    def watch(cls, client, expr:str, interval:float) -> RemoteAttr:
+        """
+        watch an attribute on the pi through the poller of a client. if 
+        the attribute is already being watched the same RemoteAttr is 
+        returned and it is polled at the shorter of the two intervals
+
+        Args:
+            client: ratBerryPi.remote.client.Client
+                client to poll through
+            expr: str
+                attribute to watch, as would be passed to client.get
+            interval: float
+                time between reads in seconds
+        """
+        poller = cls.for_client(client)
+        with poller._lock:
+            attr = poller.attrs.get(expr)
+            if attr is None:
+                attr = RemoteAttr(expr, interval)
+                poller.attrs[expr] = attr
+            else:
+                attr.interval = min(attr.interval, interval)
+        if not poller.isRunning():
+            poller.running = True
+            poller.start()
+        poller._wake.set()
+        return attr
+
+    @classmethod
+    def stop_all(cls):
+        for poller in cls._pollers.values():
+            poller.stop()
+            poller.wait()
+        cls._pollers.clear()
+
+    def run(self):
+        while self.running:
+            now = time.perf_counter()
+            with self._lock:
+                # attributes due within half of their interval are read early 
+                # so attributes with the same interval share requests
+                due = [a for a in self.attrs.values() if a.next_read <= now + a.interval/2]
+            if len(due) > 0:
+                try:
+                    values = get_many(self.client, [a.expr for a in due], channel = self.channel)
+                except Exception as e:
+                    logger.warning(f"failed to poll the ratBerryPi: {e}")
+                    values = [a.value for a in due]
+                for attr, value in zip(due, values):
+                    attr.next_read = max(attr.next_read + attr.interval, now)
+                    if value != attr.value:
+                        attr.value = value
+                        attr.changed.emit(value)
+            with self._lock:
+                next_read = min([a.next_read for a in self.attrs.values()], default = np.inf)
+            self._wake.wait(max(0, next_read - time.perf_counter()) if np.isfinite(next_read) else None)
+            self._wake.clear()
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+
+
+class LickStream(QThread):
+    """
+    EXPERIMENTAL: thread which receives lick events pushed by a ratBerryPi
+    over a single persistent tcp connection, as an alternative to polling 
+    lick counts. the ratBerryPi server does not implement this protocol, so
+    this requires a server extension (pyBehavior.interfaces.rpi.sim provides
+    a reference implementation). after connecting, the stream sends the 
+    line {"subscribe": "licks"} and the pi should then send one json object
+    per line of the form
+
+        {"module": str, "licks": int, "time": float}
+
+    whenever licks are detected, where licks is the number of new licks 
+    (usually 1) and time is the time of the most recent of them on the pi in
+    seconds since the epoch. since each message only carries new licks, 
+    resetting the lick count on the pi doesn't affect the stream. licks 
+    detected while the connection is down are lost; the stream reconnects
+    automatically
+
+    ...
+    PyQt Signals
+
+    connected(bool)
+    licks(str, int, float)
+        name of the module, number of new licks and time of the last lick
+    """
+
+    connected = pyqtSignal(bool)
+    licks = pyqtSignal(str, int, float)
+
+    def __init__(self, host:str, port:int, reconnect_interval:float = 1.):
+        super(LickStream, self).__init__()
+        self.host = host
+        self.port = port
+        self.reconnect_interval = reconnect_interval
+        self.running = False
+        self._stop_event = threading.Event()
+        self._sock = None
+
+    def run(self):
+        self.running = True
+        while self.running:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout = self.reconnect_interval)
+            except OSError:
+                self._stop_event.wait(self.reconnect_interval)
+                continue
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._sock = sock
+            try:
+                sock.sendall(b'{"subscribe": "licks"}\n')
+                self.connected.emit(True)
+                for line in sock.makefile('r', encoding = 'utf8'):
+                    self._dispatch(line)
+            except OSError:
+                pass
+            finally:
+                self._sock = None
+                sock.close()
+                self.connected.emit(False)
+            if self.running:
+                self._stop_event.wait(self.reconnect_interval)
+
+    def _dispatch(self, line:str):
+        try:
+            msg = json.loads(line)
+            module, licks, t = msg['module'], int(msg['licks']), float(msg['time'])
+        except (ValueError, KeyError, TypeError):
+            print(f"invalid message on lick stream: {line!r}")
+            return
+        self.licks.emit(module, licks, t)
+
+    def stop(self):
+        self.running = False
+        self._stop_event.set()
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
 
 class PumpConfig(QGroupBox):
@@ -20,6 +508,13 @@ class PumpConfig(QGroupBox):
         self.pump = pump
         self.modules = modules
         self.parent = parent
+        self.client.new_channel(self.pump)
+        self.commands = RemoteCommands.for_client(self.client)
+        self.commands.open_channel(self.pump)
+
+        # fetch everything needed to build the widget at once
+        snapshot = RemoteSnapshot.for_client(self.client)
+        snapshot.prefetch(PumpConfig.remote_attrs(self.pump))
 
         vlayout = QVBoxLayout()
 
@@ -33,9 +528,10 @@ class PumpConfig(QGroupBox):
         self.pos_label.setEnabled(False)
         playout.addWidget(self.pos_label)
         vlayout.addLayout(playout)
-        self.pos_thread = PumpConfig.RPIPumpPosThread(self.client, self.pump)
-        self.pos_thread.pos_updated.connect(self._update_pos)
-        self.pos_thread.start()
+        self.pos_attr = RemotePoller.watch(self.client, f"pumps['{self.pump}'].position", .1)
+        self.pos_attr.changed.connect(self._update_pos)
+        if self.pos_attr.value is not None:
+            self._update_pos(self.pos_attr.value)
 
         # button to calibrate the pump
         self.calibrate_btn = QPushButton("Calibrate")
@@ -51,7 +547,7 @@ class PumpConfig(QGroupBox):
         syringe_label = QLabel("Syringe Type:")
         self.syringe_select = QComboBox()
         self.syringe_select.addItems(["BD1mL", "BD3mL", "BD5mL", "BD10mL", "BD30mL"])
-        cur_syringe = self.client.get(f"pumps['{self.pump}'].syringe.syringeType", channel = 'run')
+        cur_syringe = snapshot.get(f"pumps['{self.pump}'].syringe.syringeType")
         self.syringe_select.setCurrentIndex(self.syringe_select.findText(cur_syringe))
         self.syringe_select.currentIndexChanged.connect(lambda x: self.change_syringe(None))
         syringe_layout.addWidget(syringe_label)
@@ -63,7 +559,7 @@ class PumpConfig(QGroupBox):
         step_type_label = QLabel("Microstep Type: ")
         self.step_type_select = QComboBox()
         self.step_type_select.addItems(['Full', 'Half', '1/4', '1/8', '1/16', '1/32'])
-        cur_microstep = self.client.get(f"pumps['{self.pump}'].stepType", channel = 'run')
+        cur_microstep = snapshot.get(f"pumps['{self.pump}'].stepType")
         self.step_type_select.setCurrentIndex(self.step_type_select.findText(cur_microstep))
         self.step_type_select.currentIndexChanged.connect(lambda x: self.set_microstep_type(None))
         step_type_layout.addWidget(step_type_label)
@@ -75,7 +571,7 @@ class PumpConfig(QGroupBox):
         step_speed_label = QLabel("Microstep Rate (steps/s): ")
         self.step_speed = QLineEdit()
         self.step_speed.setValidator(QDoubleValidator())
-        cur_speed =self.client.get(f"pumps['{self.pump}'].speed", channel = 'run')
+        cur_speed = snapshot.get(f"pumps['{self.pump}'].speed")
         self.step_speed.setText(f"{cur_speed}")
         self.step_speed.editingFinished.connect(self.set_step_speed)
         step_speed_layout.addWidget(step_speed_label)
@@ -87,7 +583,7 @@ class PumpConfig(QGroupBox):
         flow_rate_label = QLabel("Flow Rate (mL/s): ")
         self.flow_rate = QLineEdit()
         self.flow_rate.setValidator(QDoubleValidator())
-        cur_flow_rate =self.client.get(f"pumps['{self.pump}'].flow_rate", channel = 'run')
+        cur_flow_rate = snapshot.get(f"pumps['{self.pump}'].flow_rate")
         self.flow_rate.setText(f"{cur_flow_rate}")
         self.flow_rate.editingFinished.connect(self.set_flow_rate)
         flow_rate_layout.addWidget(flow_rate_label)
@@ -98,12 +594,12 @@ class PumpConfig(QGroupBox):
         auto_fill_layout = QHBoxLayout()
         auto_fill_thresh_label = QLabel("Auto Fill Threshold Fraction: ")
         self.auto_fill_thresh = QLineEdit()
-        self.auto_fill_thresh.setText(f"{self.client.get('auto_fill_frac_thresh', channel = 'run')}")
+        self.auto_fill_thresh.setText(f"{snapshot.get('auto_fill_frac_thresh')}")
         self.auto_fill_thresh.setValidator(QDoubleValidator(0., 1., 6, notation = QDoubleValidator.StandardNotation))
         self.auto_fill_thresh.editingFinished.connect(self.set_auto_fill_frac_thresh)
         self.auto_fill_btn = QPushButton("Toggle Auto-Fill")
         self.auto_fill_btn.setCheckable(True)
-        init_state = bool(self.client.get(f"auto_fill", channel = 'run'))
+        init_state = bool(snapshot.get("auto_fill"))
         self.auto_fill_btn.setChecked(init_state)
         self.auto_fill_btn.clicked.connect(self.toggle_auto_fill)
         auto_fill_layout.addWidget(auto_fill_thresh_label)
@@ -156,22 +652,40 @@ class PumpConfig(QGroupBox):
         vlayout.addWidget(tabs)
         self.setLayout(vlayout)
 
+    @staticmethod
+    def remote_attrs(pump:str) -> typing.List[str]:
+        """
+        attributes on the pi needed to build the widget for a pump
+        """
+        return [f"pumps['{pump}'].syringe.syringeType", f"pumps['{pump}'].stepType",
+                f"pumps['{pump}'].speed", f"pumps['{pump}'].flow_rate"] + RemoteSnapshot.global_attrs
+
     def _update_pos(self, pos:float) -> None:
-        self.pos_label.setText(f"{pos:.3f}")
+        try:
+            self.pos_label.setText(f"{float(pos):.3f}")
+        except (ValueError, TypeError):
+            print(f"invalid position read on '{self.pump}'")
 
-    def calibrate(self) -> None:
+    def calibrate(self) -> Future:
         """
-        set pump position to 0
+        set pump position to 0. this returns immediately
         """
-        self.client.run_command('calibrate', {'pump': self.pump}, channel = 'run')
-
-    def fill_lines(self, modules:typing.List[str] = None, fill_all:bool = False) -> None:
+        return self.commands.run_command('calibrate', {'pump': self.pump})
+
+    def _run_pump_op(self, cmd:str, args:dict) -> Future:
+        # long running pump operations run on the pump's own channel 
+        # and the controls are disabled until they are done
+        btns = [self.fill_btn, self.fill_all_btn, self.empty_btn, self.push_res_btn]
+        for btn in btns: btn.setEnabled(False)
+        def enable():
+            for btn in btns: btn.setEnabled(True)
+        return self.commands.run_command(cmd, args, channel = self.pump, finished = enable)
+
+    def fill_lines(self, modules:typing.List[str] = None, fill_all:bool = False) -> Future:
         """
-        fill all of the lines leading to the modules
-        this call is blocking currently so the gui will freeze
-
-        TODO: neeed to handle the freezing more gracefully
-        maybe a little loading window?
+        fill all of the lines leading to the modules. this returns
+        immediately and the pump controls are disabled until filling
+        is done
 
         Args:
             modules: typing.List[str] (optional)
@@ -185,22 +699,21 @@ class PumpConfig(QGroupBox):
         elif modules is None:
             modules = self.modules
 
-        self.client.run_command('fill_lines', {'modules': modules}, channel = 'run')
+        return self._run_pump_op('fill_lines', {'modules': modules})
 
-    def empty_lines(self) -> None:
+    def empty_lines(self) -> Future:
         """
-        empty all of the lines leading to the modules
+        empty all of the lines leading to the modules. this returns
+        immediately and the pump controls are disabled until emptying
+        is done
         NOTE: this can only work by emptying all lines 
         for all modules associated to the pump on the 
         ratBerryPi side
-
-        TODO: neeed to handle the freezing more gracefully
-        maybe a little loading window?
         """
 
-        self.client.run_command('empty_lines', {}, channel = 'run')
+        return self._run_pump_op('empty_lines', {})
 
-    def toggle_auto_fill(self, on:bool = None) -> None:
+    def toggle_auto_fill(self, on:bool = None) -> Future:
         """
         toggle whether or not the pumps on the reward interface
         are in auto-fill mode (i.e. they refill the syringes
@@ -212,12 +725,16 @@ class PumpConfig(QGroupBox):
                 the opposite of the current state
         """
 
-        on = on if on is not None else not bool(self.client.get(f"auto_fill", channel = 'run'))
-        self.client.run_command('toggle_auto_fill', {'on': on}, channel = 'run')
-        time.sleep(.1)
-        self.auto_fill_btn.setChecked(bool(self.client.get(f"auto_fill", channel = 'run')))
+        async def toggle():
+            nonlocal on
+            if on is None:
+                on = not bool(await self.commands.get_async("auto_fill"))
+            await self.commands.run_command_async('toggle_auto_fill', {'on': on})
+            await asyncio.sleep(.1)
+            return bool(await self.commands.get_async("auto_fill"))
+        return self.commands.submit(toggle(), self.auto_fill_btn.setChecked, 'toggle_auto_fill')
 
-    def set_auto_fill_frac_thresh(self, value:float = None) -> None:
+    def set_auto_fill_frac_thresh(self, value:float = None) -> Future:
         """
         set the threshold fraction of the syringe volume
         at which to trigger a refill
@@ -228,10 +745,26 @@ class PumpConfig(QGroupBox):
         """
         
         value = value if value is not None else float(self.auto_fill_thresh.text())
-        self.client.run_command('set_auto_fill_frac_thresh', {'value': value}, channel = 'run')
         self.auto_fill_thresh.setText(f"{value}")
+        return self.commands.run_command('set_auto_fill_frac_thresh', {'value': value})
+
+    def _set_pump_param(self, cmd:str, args:dict, name:str = None) -> Future:
+        """
+        run a command which changes a pump parameter without blocking
+        and update the flow rate and step speed shown in the gui once
+        it is done
+        """
+        async def run():
+            await self.commands.run_command_async(cmd, args)
+            return await self.commands.get_many_async([f"pumps['{self.pump}'].flow_rate", f"pumps['{self.pump}'].speed"])
+        return self.commands.submit(run(), self._update_rates, name or cmd)
+
+    def _update_rates(self, rates):
+        flow_rate, speed = rates
+        self.flow_rate.setText(f"{float(flow_rate)}")
+        self.step_speed.setText(f"{float(speed)}")
 
-    def set_microstep_type(self, step_type:str = None) -> None:
+    def set_microstep_type(self, step_type:str = None) -> Future:
         """
         set microstepping level of the pump
         
@@ -251,42 +784,36 @@ class PumpConfig(QGroupBox):
             'pump': self.pump,
             'stepType': step_type
         }
-        self.client.run_command('set_microstep_type', args, channel = 'run')
         self.step_type_select.setCurrentIndex(idx)
-        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = self.pump))
-        self.flow_rate.setText(f"{flow_rate}")
+        return self._set_pump_param('set_microstep_type', args)
 
-    def set_step_speed(self, speed:float=None) -> None:
+    def set_step_speed(self, speed:float=None) -> Future:
         """
-        set the flow rate of the pump
+        set the step speed of the pump. this returns immediately 
+        and the flow rate is updated once the speed has been set
         """
         speed = speed if speed is not None else float(self.step_speed.text())     
         args = {
             'pump': self.pump,
             'speed': speed
         }
-        self.client.run_command('set_step_speed', args, channel = 'run')
         self.step_speed.setText(f"{speed}")
-        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = self.pump))
-        self.flow_rate.setText(f"{flow_rate}")
+        return self._set_pump_param('set_step_speed', args)
 
 
-    def set_flow_rate(self, flow_rate:float=None) -> None:
+    def set_flow_rate(self, flow_rate:float=None) -> Future:
         """
-        set the flow rate of the pump
+        set the flow rate of the pump. this returns immediately and the
+        flow rate and step speed are updated once the flow rate has been set
         """
         flow_rate = flow_rate if flow_rate is not None else float(self.flow_rate.text())     
         args = {
             'pump': self.pump,
             'flow_rate': flow_rate
         }
-        self.client.run_command('set_flow_rate', args, channel = 'run')
-        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = self.pump))
-        self.flow_rate.setText(f"{flow_rate}")
-        speed = float(self.client.get(f"pumps['{self.pump}'].speed", channel = self.pump))
-        self.step_speed.setText(f"{speed}")
+        return self._set_pump_param('set_flow_rate', args)
 
-    def change_syringe(self, syringe_type:str = None) -> None:
+    def change_syringe(self, syringe_type:str = None) -> Future:
         """
         change the syringe type
 
@@ -305,12 +832,10 @@ class PumpConfig(QGroupBox):
             'pump': self.pump,
             'syringeType': syringe_type
         }
-        self.client.run_command('change_syringe', args, channel = 'run')
         self.syringe_select.setCurrentIndex(idx)
-        flow_rate = float(self.client.get(f"pumps['{self.pump}'].flow_rate", channel = self.pump))
-        self.flow_rate.setText(f"{flow_rate}")
+        return self._set_pump_param('change_syringe', args)
 
-    def push_to_res(self, amount:float = None) -> None:
+    def push_to_res(self, amount:float = None) -> Future:
         """
         push a specified amount of fluid to the reservoir
 
@@ -326,56 +851,71 @@ class PumpConfig(QGroupBox):
             'pump': self.pump,
             'amount': amount
         }
-        self.client.run_command('push_to_reservoir', args, channel = 'run')
-        
-    class RPIPumpPosThread(QThread):
-        """
-        thread to keep track of pump piston position
-
-        ...
-        PyQt Signals
-
-        pos_updated(float)
-        """
-        pos_updated = pyqtSignal(float)
-        def __init__(self, client, pump):
-            super(PumpConfig.RPIPumpPosThread, self).__init__()
-            self.client = client
-            self.pump = pump
-            self.client.new_channel(self.pump)
-            self.pos = None
-
-        def run(self):
-            while True:
-                try:
-                    pos = self.client.get(f"pumps['{self.pump}'].position", channel = self.pump)
-                    if pos != self.pos:
-                        self.pos = pos
-                        self.pos_updated.emit(self.pos)
-                except ValueError as e:
-                    print(f"invalid position read on '{self.pump}'")
-                finally:
-                    time.sleep(.1)
+        return self._run_pump_op('push_to_reservoir', args)
         
 
 class RPIRewardControl(RewardWidget):
     """
-    A widget for controlling ratBerryPi reward modules remotely through a client
+    A widget for controlling ratBerryPi reward modules remotely through a client.
+    the lick count and the state of the LED and valve are polled through the 
+    RemotePoller shared by all widgets using the client. if an (experimental)
+    LickStream is provided, or the parent has one at parent.lick_stream, licks
+    are instead received from the stream
+
+    in pipelined mode, rewards, tones and LED commands return immediately 
+    without waiting for the pi to acknowledge them. each command is tagged
+    with a sequence number and sent in order on the module's own channel of
+    the RemoteCommands layer. acknowledgements are matched to the commands
+    as they arrive and failures are written to the parent's log and reported 
+    through the widget's command_failed, rather than that of the command layer
+
+    sequences of commands which should run with precise relative timing (e.g.
+    a tone, then the LED 200 ms later, then a reward) can be defined as named
+    actions with define_action and run with run_action. by default each step
+    is sent at its own time on this computer's event loop. a ratBerryPi 
+    server extended with a 'run_action' command can instead run the whole 
+    sequence on its own clock (see run_action)
+
+    the volume dispensed and the number of pulses shown in the widget are
+    only updated once the pi reports that a reward succeeded
 
     ...
     PyQt Signals
 
-    new_lick(bool)
+    new_licks(int)
+    new_licks_time(float)
+    command_failed(int, str, str)
+        sequence number, name and error message of a failed command
     """
 
     new_licks = pyqtSignal(int)
+    new_licks_time = pyqtSignal(float)
+    command_failed = pyqtSignal(int, str, str)
+    _acked = pyqtSignal(int, str, object)
+    _dispensed = pyqtSignal(float)
 
-    def __init__(self, client, module, parent):
+    def __init__(self, client, module, parent, lick_stream:LickStream = None, pipelined:bool = False):
         super(RPIRewardControl, self).__init__()
 
         self.module = module
         self.client = client
         self.parent = parent
+        self.lick_stream = lick_stream if lick_stream is not None else getattr(parent, 'lick_stream', None)
+        self.commands = RemoteCommands.for_client(self.client)
+        self.commands.open_channel(self.module)
+        self.pipelined = pipelined
+        self._seq = itertools.count()
+        # pending is only touched on the gui thread. acknowledgements
+        # arrive on the event loop's thread and are queued to _on_ack
+        self.pending = {}
+        self._on_success = {}
+        self._acked.connect(self._on_ack)
+        self._dispensed.connect(self._add_dispensed)
+        self.actions = {}
+
+        # fetch everything needed to build the widget at once
+        snapshot = RemoteSnapshot.for_client(self.client)
+        snapshot.prefetch(RPIRewardControl.remote_attrs(self.module))
     
         vlayout= QVBoxLayout()
 
@@ -383,7 +923,7 @@ class RPIRewardControl(RewardWidget):
         self.setTitle(self.module)
 
         # pump name
-        pump_name = self.client.get(f"modules['{self.module}'].pump.name", channel = 'run')
+        pump_name = snapshot.get(f"modules['{self.module}'].pump.name")
         playout = QHBoxLayout()
         playout.addWidget(QLabel(f"Pump: "))
         pump_le = QLineEdit()
@@ -394,7 +934,7 @@ class RPIRewardControl(RewardWidget):
 
         # widget to display and reset lick count
         lick_layout = QHBoxLayout()
-        self.lick_count_n = int(self.client.get(f"modules['{self.module}'].lickometer.licks", channel = 'run'))
+        self.lick_count_n = int(snapshot.get(f"modules['{self.module}'].lickometer.licks"))
         lick_layout.addWidget(QLabel(f"Lick Count: "))
         self.lick_count = QLineEdit()
         self.lick_count.setText(f"{self.lick_count_n}")
@@ -404,9 +944,12 @@ class RPIRewardControl(RewardWidget):
         reset_btn.clicked.connect(self.reset_licks)
         lick_layout.addWidget(reset_btn)
         vlayout.addLayout(lick_layout)
-        self.lick_thread = RPIRewardControl.RPILickThread(self.client, self.module)
-        self.lick_thread.lick_num_updated.connect(self._update_licks)
-        self.lick_thread.start()
+        self._licks = self.lick_count_n
+        if self.lick_stream is not None:
+            self.lick_stream.licks.connect(lambda module, n, t: self._on_stream_licks(n, t) if module == self.module else None)
+        else:
+            lick_attr = RemotePoller.watch(self.client, f"modules['{self.module}'].lickometer.licks", .005)
+            lick_attr.changed.connect(lambda licks: self._on_licks(licks, time.time()))
 
         # cummulative reward amount
         amt_widget = QGroupBox()
@@ -444,7 +987,7 @@ class RPIRewardControl(RewardWidget):
         post_delay_layout.addWidget(QLabel("Post Reward Delay (s): "))
         self.post_delay = QLineEdit()
         self.post_delay.setValidator(QDoubleValidator())
-        self.post_delay.setText(str(self.client.get(f"modules['{self.module}'].post_delay", channel = 'run')))
+        self.post_delay.setText(str(snapshot.get(f"modules['{self.module}'].post_delay")))
         self.post_delay.editingFinished.connect(self.update_post_delay)
         post_delay_layout.addWidget(self.post_delay)
         rlayout.addLayout(post_delay_layout)
@@ -533,18 +1076,23 @@ class RPIRewardControl(RewardWidget):
         self.led_btn = QPushButton("Toggle LED")
         self.led_btn.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.led_btn.setCheckable(True)
-        init_state = bool(self.client.get(f"modules['{self.module}'].LED.on", channel = 'run'))
-        self.led_btn.setChecked(init_state)
+        # last commanded state of the led, used when toggling in pipelined mode
+        self._led_on = bool(snapshot.get(f"modules['{self.module}'].LED.on"))
+        self.led_btn.setChecked(self._led_on)
         self.led_btn.clicked.connect(self.toggle_led)
+        self._led_attr = RemotePoller.watch(self.client, f"modules['{self.module}'].LED.on", .5)
+        self._led_attr.changed.connect(self._on_led_polled)
         clayout.addWidget(self.led_btn)
 
         # button to toggle the valve
         self.valve_btn = QPushButton("Toggle Valve")
         self.valve_btn.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.valve_btn.setCheckable(True)
-        init_state = bool(self.client.get(f"modules['{self.module}'].valve.is_open", channel = 'run'))
+        init_state = bool(snapshot.get(f"modules['{self.module}'].valve.is_open"))
         self.valve_btn.setChecked(init_state)
         self.valve_btn.clicked.connect(self.toggle_valve)
+        valve_attr = RemotePoller.watch(self.client, f"modules['{self.module}'].valve.is_open", .5)
+        valve_attr.changed.connect(lambda is_open: self.valve_btn.setChecked(bool(is_open)))
         clayout.addWidget(self.valve_btn)
 
         hlayout.addLayout(clayout)
@@ -553,10 +1101,146 @@ class RPIRewardControl(RewardWidget):
         vlayout.addWidget(gb)
         self.setLayout(vlayout)
 
+    def _send(self, cmd:str, args:dict, on_success:typing.Callable = None) -> typing.Optional[Future]:
+        """
+        run a command on the pi. in pipelined mode this returns a future 
+        immediately, otherwise this blocks until the command is done.
+        on_success is called on the gui thread if the command succeeds
+        """
+        if not self.pipelined:
+            status = self.client.run_command(cmd, args, channel = 'run')
+            if not status=='SUCCESS\n':
+                print('error status', status)
+            elif on_success is not None:
+                on_success()
+            return None
+        seq = next(self._seq)
+        self.pending[seq] = cmd
+        if on_success is not None:
+            self._on_success[seq] = on_success
+        # failures are reported once, by _on_ack
+        future = self.commands.submit(self.commands.run_command_async(cmd, args, channel = self.module), 
+                                      name = cmd, report = False)
+        future.add_done_callback(lambda f: self._ack(seq, cmd, f))
+        return future
+
+    def _ack(self, seq:int, cmd:str, future:Future):
+        # called on the event loop's thread once the pi responds
+        exc = future.exception() if not future.cancelled() else RuntimeError("cancelled")
+        self._acked.emit(seq, cmd, exc)
+
+    def _on_ack(self, seq:int, cmd:str, exc:Exception):
+        self.pending.pop(seq, None)
+        on_success = self._on_success.pop(seq, None)
+        if exc is None and on_success is not None:
+            on_success()
+        if exc is not None:
+            logger = getattr(self.parent, 'logger', logging.getLogger(__name__))
+            logger.error(f"command {seq} ({cmd}) on {self.module} failed: {exc}")
+            self.command_failed.emit(seq, cmd, str(exc))
+
+    def define_action(self, name:str, steps:typing.List[tuple]) -> None:
+        """
+        define a named sequence of commands to run on this module
+
+        Args:
+            name: str
+                name of the action
+            steps: typing.List[tuple]
+                list of (time, command, args) tuples where time is the time in
+                seconds from the start of the action to run the command at, 
+                command is the name of a command (e.g. 'play_tone', 'toggle_LED'
+                or 'trigger_reward') and args is a dictionary of arguments for 
+                the command. the module is added to the arguments if missing.
+                for example:
+
+                    [(0, 'play_tone', {'freq': 800, 'dur': .5, 'volume': 1}),
+                     (.2, 'toggle_LED', {'on': True}),
+                     (.5, 'trigger_reward', {'amount': .2})]
+        """
+        self.actions[name] = [{'at': float(t), 'command': cmd, 'args': {'module': self.module, **args}}
+                              for t, cmd, args in sorted(steps, key = lambda x: x[0])]
+        # each step is sent on its own channel so a step is
+        # never held up waiting for the previous one's reply
+        for i in range(len(steps)):
+            self.commands.open_channel(self._step_channel(i))
+
+    def _step_channel(self, i:int) -> str:
+        return f"{self.module}_step{i}"
+
+    def run_action(self, name:str, on_pi:bool = False) -> typing.Optional[Future]:
+        """
+        run a named action defined through define_action
+
+        Args:
+            name: str
+                name of the action
+            on_pi: bool (optional)
+                if False (default) each command is sent through the 
+                RemoteCommands layer at its own time from the start of the 
+                action, timed on this computer. steps are sent on separate
+                channels so a slow reply to one step doesn't delay the next.
+                if True the action is sent to the pi as a single 'run_action'
+                command, of the form {'module': str, 'name': str, 'steps': list}
+                with the steps as stored in self.actions, which should succeed
+                once all steps are done. NOTE: the ratBerryPi server does not 
+                implement 'run_action', so this requires a server extended to 
+                support it (pyBehavior.interfaces.rpi.sim.SimServer provides a
+                reference implementation)
+        """
+        steps = self.actions[name]
+        if on_pi:
+            def dispensed():
+                for step in steps:
+                    if step['command'] == 'trigger_reward':
+                        self._add_dispensed(step['args']['amount'])
+            return self._send('run_action', {'module': self.module, 'name': name, 'steps': steps}, dispensed)
+
+        async def run_step(t0, i, step):
+            await asyncio.sleep(max(0, t0 + step['at'] - self.commands.loop.time()))
+            await self.commands.run_command_async(step['command'], step['args'], channel = self._step_channel(i))
+            if step['command'] == 'trigger_reward':
+                self._dispensed.emit(step['args']['amount'])
+
+        async def run():
+            t0 = self.commands.loop.time()
+            await asyncio.gather(*[run_step(t0, i, step) for i, step in enumerate(steps)])
+        return self.commands.submit(run(), name = name)
+
+    def _add_dispensed(self, amount:float):
+        self.amt_disp.setText(f"{float(self.amt_disp.text()) + amount}")
+        self.npulse.setText(f"{float(self.npulse.text()) + 1}")
+
     def reset_amount_dispensed(self):
         self.amt_disp.setText(f"{0}")
         self.npulse.setText(f"{0}")
     
+    @staticmethod
+    def remote_attrs(module:str) -> typing.List[str]:
+        """
+        attributes on the pi needed to build the widget for a module
+        """
+        return [f"modules['{module}'].pump.name", f"modules['{module}'].lickometer.licks",
+                f"modules['{module}'].post_delay", f"modules['{module}'].LED.on",
+                f"modules['{module}'].valve.is_open"]
+
+    def _on_licks(self, licks, t):
+        try:
+            licks = int(licks)
+        except (ValueError, TypeError):
+            print(f"invalid read on '{self.module}'")
+            return
+        if licks != self._licks:
+            self._update_licks(licks - self._licks)
+            # the count dropping means the licks were reset
+            if licks > self._licks: self.new_licks_time.emit(t)
+            self._licks = licks
+
+    def _on_stream_licks(self, n, t):
+        if n > 0:
+            self._update_licks(n)
+            self.new_licks_time.emit(t)
+
     def _update_licks(self, amt):
         if amt > 0: self.new_licks.emit(amt)
         self.lick_count_n += amt
@@ -572,14 +1256,18 @@ class RPIRewardControl(RewardWidget):
         self.parent.log(f"manually pulsing {amt} mL to {self.module}")
         self.trigger_reward(amt)
 
-    def reset_licks(self) -> None:
+    def reset_licks(self) -> Future:
         """
-        reset the lick count for this module
+        reset the lick count for this module. this returns immediately
         """
 
-        self.client.run_command("reset_licks", {'module': self.module}, channel = "run")
+        def reset(status):
+            if self.lick_stream is not None:
+                # the stream only carries new licks so the count is reset here
+                self._update_licks(-self.lick_count_n)
+        return self.commands.run_command("reset_licks", {'module': self.module}, callback = reset)
     
-    def update_post_delay(self, post_delay:float = None) -> None:
+    def update_post_delay(self, post_delay:float = None) -> Future:
         """
         update the time to wait post pump actuation before closing the
         valve associated to a module
@@ -592,10 +1280,10 @@ class RPIRewardControl(RewardWidget):
         post_delay = post_delay if post_delay is not None else float(self.post_delay.text())
         args = {'module': self.module,
                 'post_delay': post_delay}
-        self.client.run_command('update_post_delay', args, channel = 'run')
         self.post_delay.setText(f"{post_delay}")
+        return self.commands.run_command('update_post_delay', args)
 
-    def play_tone(self, freq:float = None, volume:float = None, dur:float = None) -> None:
+    def play_tone(self, freq:float = None, volume:float = None, dur:float = None) -> typing.Optional[Future]:
         """
         play a tone of a specified frequency volume and duration.
         by default all inputs are set according to the values set in
@@ -618,54 +1306,67 @@ class RPIRewardControl(RewardWidget):
                 'freq': freq,
                 'dur': dur,
                 'volume': volume}
-        status = self.client.run_command('play_tone', args, channel = 'run')
-        if not status=='SUCCESS\n':
-            print('error status', status)
+        return self._send('play_tone', args)
 
-    def toggle_led(self, on:bool = None) -> None:
+    def toggle_led(self, on:bool = None) -> Future:
         """
         toggle the led. by default the led is toggled
         to the opposite of it's current state 
-        (i.e. turned off if on and vice versa)
+        (i.e. turned off if on and vice versa).
+        this returns immediately and the button is 
+        updated once the led has been toggled
 
         Args:
             on: bool (optional)
                 whether to turn the led on 
         """
 
-        if on is None:
-            led_state = bool(self.client.get(f"modules['{self.module}'].LED.on", channel = 'run'))
-            on = not led_state
-        
-        args = {'module': self.module,
-                'on': on}
-        status = self.client.run_command('toggle_LED', args, channel = 'run')
-        if not status=='SUCCESS\n': print('error status', status)
-        led_state = bool(self.client.get(f"modules['{self.module}'].LED.on", channel = 'run'))
-        self.led_btn.setChecked(led_state)
-
-    def toggle_valve(self, open_valve:bool = None):
+        expr = f"modules['{self.module}'].LED.on"
+        if self.pipelined:
+            # use the last commanded state rather than asking the pi
+            on = on if on is not None else not self._led_on
+            self._set_led(on)
+            return self._send('toggle_LED', {'module': self.module, 'on': on})
+        async def toggle():
+            nonlocal on
+            if on is None:
+                on = not bool(await self.commands.get_async(expr))
+            await self.commands.run_command_async('toggle_LED', {'module': self.module, 'on': on})
+            return bool(await self.commands.get_async(expr))
+        return self.commands.submit(toggle(), self._set_led, 'toggle_LED')
+
+    def _set_led(self, on:bool):
+        self._led_on = bool(on)
+        self.led_btn.setChecked(self._led_on)
+
+    def _on_led_polled(self, on):
+        # polled values may predate commands which haven't been acknowledged
+        if 'toggle_LED' not in self.pending.values():
+            self._set_led(on)
+
+    def toggle_valve(self, open_valve:bool = None) -> Future:
         """
         toggle the state of the valve. by default the valve
         is toggled to the opposite of its current state
-        (i.e. opened if closed and vice versa)
+        (i.e. opened if closed and vice versa).
+        this returns immediately and the button is 
+        updated once the valve has been toggled
 
         Args:
             open_valve: bool (optional)
                 whether to open the valve
         """
 
-        if open_valve is None:
-            valve_state = bool(self.client.get(f"modules['{self.module}'].valve.is_open", channel = 'run'))
-            open_valve = not valve_state
-        args = {'module': self.module,
-                'open_valve': open_valve}
-        status = self.client.run_command('toggle_valve', args, channel = 'run')
-        if not status=='SUCCESS\n': print('error status', status)
-        valve_state = bool(self.client.get(f"modules['{self.module}'].valve.is_open", channel = 'run'))
-        self.valve_btn.setChecked(valve_state)
+        expr = f"modules['{self.module}'].valve.is_open"
+        async def toggle():
+            nonlocal open_valve
+            if open_valve is None:
+                open_valve = not bool(await self.commands.get_async(expr))
+            await self.commands.run_command_async('toggle_valve', {'module': self.module, 'open_valve': open_valve})
+            return bool(await self.commands.get_async(expr))
+        return self.commands.submit(toggle(), self.valve_btn.setChecked, 'toggle_valve')
         
-    def trigger_reward(self, amount:float, force:bool = True, enqueue:bool = False) -> None:
+    def trigger_reward(self, amount:float, force:bool = True, enqueue:bool = False) -> typing.Optional[Future]:
         """
         trigger a reward of a specified amount
 
@@ -687,43 +1388,4 @@ class RPIRewardControl(RewardWidget):
                 'amount': amount,
                 'force': force,
                 'enqueue' : enqueue}
-        status = self.client.run_command("trigger_reward", args, channel = 'run')
-        if not status=='SUCCESS\n':
-            print('error status', status)
-        self.amt_disp.setText(f"{float(self.amt_disp.text()) + amount}")
-        self.npulse.setText(f"{float(self.npulse.text()) + 1}")
-
-    class RPILickThread(QThread):
-        """
-        thread to monitor licks on the pi
-
-        ...
-        PyQt Signals
-
-        lick_num_updated(int)
-
-        """
-
-        lick_num_updated = pyqtSignal(int)
-        
-        def __init__(self, client, module):
-            super(RPIRewardControl.RPILickThread, self).__init__()
-            self.client = client
-            self.module = module
-            self.client.new_channel(f"{self.module}_licks")
-        
-        def run(self):
-            prev_licks = int(self.client.get(f"modules['{self.module}'].lickometer.licks",
-                                                channel = f"{self.module}_licks"))
-            while True:
-                try:
-                    licks = int(self.client.get(f"modules['{self.module}'].lickometer.licks",
-                                                channel = f"{self.module}_licks"))
-                    if licks!=prev_licks:
-                        self.lick_num_updated.emit(licks - prev_licks)
-                        prev_licks = licks
-                except ValueError as e:
-                    print(f"invalid read on '{self.module}'")
-                    raise e
-                finally:
-                    time.sleep(.005)
\ No newline at end of file
+        return self._send("trigger_reward", args, lambda: self._add_dispensed(amount))
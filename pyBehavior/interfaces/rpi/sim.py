@@ -0,0 +1,523 @@
+"""
+loopback stand-in for a remote ratBerryPi. SimServer simulates the pumps,
+lickometers, LEDs and valves of a ratBerryPi and serves them over tcp on the
+local machine using the ratBerryPi client protocol, with configurable lick
+rates and artificial network latency, so the remote widgets in
+pyBehavior.interfaces.rpi.remote can be exercised and benchmarked through
+ratBerryPi.remote.client.Client without a pi. for example:
+
+    from ratBerryPi.remote.client import Client
+    from pyBehavior.interfaces.rpi import sim
+    server = sim.SimServer(modules = ['module1', 'module2'], lick_rate = 5, latency = .005)
+    server.start()
+    client = Client(server.host, server.port)
+
+where ratBerryPi is not installed, SimClient implements the same interface
+as the ratBerryPi client (new_channel, get and run_command) over the same
+protocol and nothing else, so code exercised through it runs unchanged
+against a real pi.
+
+the protocol is reconstructed from the ratBerryPi client: each channel is
+its own tcp connection on which requests are sent as one json object per
+line. commands are sent as {"command": str, "args": dict} and answered with
+a status line, 'SUCCESS\\n' if the command succeeded. attributes are requested
+with {"command": "GET", "req": str}, where req is a python expression which
+is evaluated against the attributes of the reward interface (e.g.
+"modules['module1'].LED.on" or a list of such expressions), and answered
+with the json encoded value on one line. the simulator only evaluates
+attribute lookups and subscripts, never arbitrary python.
+
+if ssh is set, the server also serves its data directory through an ssh
+endpoint which supports scp downloads, so the scp step of
+SetupGUI._stop_protocol runs as it would against a pi. the server also
+implements the experimental lick stream expected by
+pyBehavior.interfaces.rpi.remote.LickStream on server.stream_port, and the
+'run_action' command expected by RPIRewardControl.run_action(on_pi = True)
+"""
+
+import ast
+import json
+import os
+import shlex
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import types
+import numpy as np
+
+
+class SimModule:
+    """
+    a simulated reward module. licks arrive as a poisson process
+    """
+
+    def __init__(self, name:str, pump:str, lick_rate:float = 0, rng:np.random.Generator = None):
+        self.name = name
+        self.pump = None
+        self.pump_name = pump
+        self.lick_rate = lick_rate
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.lickometer = types.SimpleNamespace(licks = 0)
+        # times of all licks, for measuring detection latency
+        self.lick_times = []
+        self.LED = types.SimpleNamespace(on = False)
+        self.valve = types.SimpleNamespace(is_open = False)
+        self.post_delay = 1.
+        self.next_lick = self._draw(time.time())
+
+    def _draw(self, t:float) -> float:
+        if self.lick_rate <= 0:
+            return np.inf
+        return t + self.rng.exponential(1/self.lick_rate)
+
+
+class SimPump:
+    """
+    a simulated syringe pump
+    """
+
+    def __init__(self, name:str):
+        self.name = name
+        self.position = 0.
+        self.syringe = types.SimpleNamespace(syringeType = 'BD5mL')
+        self.stepType = 'Full'
+        self.speed = 1000.
+        self.flow_rate = .1
+
+
+class SimServer:
+    """
+    simulated ratBerryPi server
+
+    Args:
+        modules: list
+            names of the reward modules to simulate
+        pumps: list (optional)
+            names of the pumps to simulate. by default one pump is
+            simulated and shared by all modules
+        lick_rate: float (optional)
+            average licks per second on each module
+        latency: float (optional)
+            artificial delay in seconds added before every response
+        host: str (optional)
+            address to serve on
+        port: int (optional)
+            port to serve requests on. by default a free port is chosen
+        stream_port: int (optional)
+            port to push lick events on. by default a free port is chosen
+        fill_time: float (optional)
+            time in seconds that filling or emptying lines takes
+        ssh: bool (optional)
+            whether to serve the data directory through an ssh endpoint
+            (see SimSSHServer)
+        seed: int (optional)
+            seed for the random number generator
+    """
+
+    def __init__(self, modules:list = ('module1',), pumps:list = ('pump1',), lick_rate:float = 0,
+                 latency:float = 0, host:str = '127.0.0.1', port:int = 0, stream_port:int = 0,
+                 fill_time:float = 1., ssh:bool = False, seed:int = None):
+        rng = np.random.default_rng(seed)
+        self.pumps = {name: SimPump(name) for name in pumps}
+        self.modules = {name: SimModule(name, pumps[i % len(pumps)], lick_rate, rng) for i, name in enumerate(modules)}
+        for module in self.modules.values():
+            module.pump = self.pumps[module.pump_name]
+        self.auto_fill = False
+        self.auto_fill_frac_thresh = .1
+        self.latency = latency
+        self.fill_time = fill_time
+        # while recording, commands are logged to the file at data_path
+        self.data_dir = tempfile.mkdtemp(prefix = 'ratBerryPi_sim_')
+        self.data_path = os.path.join(self.data_dir, 'ratBerryPi_log.csv')
+        self.recording = False
+        self.n_requests = 0
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._streams = []
+
+        server = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server._handle(self.rfile, self.wfile)
+        class StreamHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.rfile.readline()
+                with server._lock:
+                    server._streams.append(self.wfile)
+                server._stop_event.wait()
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._stream_server = socketserver.ThreadingTCPServer((host, stream_port), StreamHandler)
+        self._stream_server.daemon_threads = True
+        self.host = host
+        self.port = self._server.server_address[1]
+        self.stream_port = self._stream_server.server_address[1]
+        self.ssh = SimSSHServer(self.data_dir, host) if ssh else None
+
+    def start(self):
+        # a short poll interval so stop doesn't wait on the servers
+        threading.Thread(target = self._server.serve_forever, args = (.05,), daemon = True).start()
+        threading.Thread(target = self._stream_server.serve_forever, args = (.05,), daemon = True).start()
+        threading.Thread(target = self._run_licks, daemon = True).start()
+        if self.ssh is not None:
+            self.ssh.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._server.shutdown()
+        self._stream_server.shutdown()
+        self._server.server_close()
+        self._stream_server.server_close()
+        if self.ssh is not None:
+            self.ssh.stop()
+        shutil.rmtree(self.data_dir, ignore_errors = True)
+
+    def _run_licks(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                t = time.time()
+                for module in self.modules.values():
+                    while module.next_lick <= t:
+                        module.lickometer.licks += 1
+                        module.lick_times.append(module.next_lick)
+                        self._push({'module': module.name, 'licks': 1, 'time': module.next_lick})
+                        module.next_lick = module._draw(module.next_lick)
+                nxt = min([m.next_lick for m in self.modules.values()], default = np.inf)
+            self._stop_event.wait(min(max(0, nxt - time.time()), .1))
+
+    def _push(self, msg:dict):
+        line = (json.dumps(msg) + '\n').encode('utf8')
+        for wfile in list(self._streams):
+            try:
+                wfile.write(line)
+                wfile.flush()
+            except OSError:
+                self._streams.remove(wfile)
+
+    def _handle(self, rfile, wfile):
+        for line in rfile:
+            try:
+                req = json.loads(line)
+                cmd = None
+                with self._lock:
+                    self.n_requests += 1
+                    if req['command'] == 'GET':
+                        resp = json.dumps(self.get(req['req']), default = _to_json) + '\n'
+                    else:
+                        cmd = self.run_command(req['command'], req.get('args', {}))
+                if cmd is not None:
+                    # commands may block (e.g. filling lines) so
+                    # they are run outside of the lock
+                    resp = cmd()
+            except Exception as e:
+                resp = f"ERROR: {type(e).__name__}: {e}\n"
+            if self.latency > 0:
+                time.sleep(self.latency)
+            try:
+                wfile.write(resp.encode('utf8'))
+                wfile.flush()
+            except OSError:
+                return
+
+    def get(self, expr:str):
+        """
+        evaluate an attribute expression such as "modules['module1'].LED.on"
+        against the attributes of the simulated reward interface. only 
+        names, public attributes, subscripts with constant keys, and lists 
+        or tuples of these are evaluated; anything else raises a ValueError
+        """
+        namespace = {'modules': self.modules, 'pumps': self.pumps, 'auto_fill': self.auto_fill,
+                     'auto_fill_frac_thresh': self.auto_fill_frac_thresh, 'data_path': self.data_path,
+                     'recording': self.recording}
+        return self._eval(ast.parse(expr, mode = 'eval').body, namespace)
+
+    @classmethod
+    def _eval(cls, node:ast.AST, namespace:dict):
+        if isinstance(node, ast.Name):
+            if node.id not in namespace:
+                raise NameError(f"name '{node.id}' is not defined")
+            return namespace[node.id]
+        if isinstance(node, ast.Attribute):
+            if node.attr.startswith('_'):
+                raise ValueError(f"access to private attribute '{node.attr}' is not allowed")
+            return getattr(cls._eval(node.value, namespace), node.attr)
+        if isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Constant):
+            return cls._eval(node.value, namespace)[node.slice.value]
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return [cls._eval(elt, namespace) for elt in node.elts]
+        raise ValueError(f"unsupported expression '{ast.unparse(node)}'")
+
+    def run_command(self, cmd:str, args:dict):
+        """
+        apply a command to the simulated state and return a function
+        which completes it and returns its status
+        """
+        done = lambda: 'SUCCESS\n'
+        wait = lambda dur: (lambda: (time.sleep(dur), 'SUCCESS\n')[1])
+        if cmd == 'trigger_reward':
+            module = self.modules[args['module']]
+            module.pump.position += args['amount']
+        elif cmd in ('play_tone', 'record', 'stop_recording', 'calibrate'):
+            if cmd == 'record': self.recording = True
+            if cmd == 'stop_recording': self.recording = False
+            if cmd == 'calibrate': self.pumps[args['pump']].position = 0.
+        elif cmd == 'toggle_LED':
+            self.modules[args['module']].LED.on = bool(args['on'])
+        elif cmd == 'toggle_valve':
+            self.modules[args['module']].valve.is_open = bool(args['open_valve'])
+        elif cmd == 'reset_licks':
+            self.modules[args['module']].lickometer.licks = 0
+        elif cmd == 'update_post_delay':
+            self.modules[args['module']].post_delay = float(args['post_delay'])
+        elif cmd in ('fill_lines', 'empty_lines'):
+            done = wait(self.fill_time)
+        elif cmd == 'push_to_reservoir':
+            self.pumps[args['pump']].position += args['amount']
+        elif cmd == 'toggle_auto_fill':
+            self.auto_fill = bool(args['on'])
+        elif cmd == 'set_auto_fill_frac_thresh':
+            self.auto_fill_frac_thresh = float(args['value'])
+        elif cmd == 'set_microstep_type':
+            self.pumps[args['pump']].stepType = args['stepType']
+        elif cmd == 'set_step_speed':
+            self.pumps[args['pump']].speed = float(args['speed'])
+        elif cmd == 'set_flow_rate':
+            self.pumps[args['pump']].flow_rate = float(args['flow_rate'])
+        elif cmd == 'change_syringe':
+            self.pumps[args['pump']].syringe.syringeType = args['syringeType']
+        elif cmd == 'run_action':
+            done = self._run_action(args['steps'])
+        else:
+            raise ValueError(f"unknown command '{cmd}'")
+        if self.recording:
+            with open(self.data_path, 'a') as f:
+                f.write(f"{time.time()},{cmd},{json.dumps(args)}\n")
+        return done
+
+    def _run_action(self, steps:list):
+        """
+        reference implementation of the 'run_action' command expected by
+        RPIRewardControl.run_action. each step, of the form {'at': float, 
+        'command': str, 'args': dict}, is run at its time in seconds from 
+        now on the server's clock. returns a function which waits for all
+        steps to finish and returns 'SUCCESS\n' if they all succeeded
+        """
+        start = time.time()
+        errors = []
+        def run_step(step):
+            try:
+                with self._lock:
+                    done = self.run_command(step['command'], step.get('args', {}))
+                status = done()
+            except Exception as e:
+                status = f"ERROR: {type(e).__name__}: {e}\n"
+            if status != 'SUCCESS\n':
+                errors.append(f"{step['command']}: {status.strip()}")
+
+        timers = [threading.Timer(max(0, start + float(step['at']) - time.time()), run_step, (step,))
+                  for step in steps]
+        for timer in timers:
+            timer.daemon = True
+            timer.start()
+        def wait():
+            for timer in timers:
+                timer.join()
+            if len(errors) > 0:
+                return f"ERROR: {'; '.join(errors)}\n"
+            return 'SUCCESS\n'
+        return wait
+
+
+def _to_json(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"{type(obj).__name__} is not json serializable")
+
+
+class SimSSHServer:
+    """
+    ssh endpoint for a simulated pi which only serves scp downloads
+    (i.e. 'scp -f') of files and directories under root. keys are
+    generated when the server is created; clients authenticate with
+    the private key saved at key_file and any user name
+
+    Args:
+        root: str
+            directory to serve
+        host: str (optional)
+            address to serve on
+        port: int (optional)
+            port to serve on. by default a free port is chosen
+    """
+
+    def __init__(self, root:str, host:str = '127.0.0.1', port:int = 0):
+        import paramiko
+        self.root = os.path.realpath(root)
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._client_key = paramiko.RSAKey.generate(2048)
+        fd, self.key_file = tempfile.mkstemp(prefix = 'ratBerryPi_sim_key_')
+        os.close(fd)
+        self._client_key.write_private_key_file(self.key_file)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen()
+        self.host = host
+        self.port = self._sock.getsockname()[1]
+        self._running = False
+
+    def start(self):
+        self._running = True
+        threading.Thread(target = self._accept, daemon = True).start()
+
+    def stop(self):
+        self._running = False
+        self._sock.close()
+        if os.path.exists(self.key_file):
+            os.remove(self.key_file)
+
+    def _accept(self):
+        while self._running:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target = self._serve, args = (conn,), daemon = True).start()
+
+    def _serve(self, conn):
+        import paramiko
+
+        client_key = self._client_key
+        commands = []
+        requested = threading.Event()
+        class Interface(paramiko.ServerInterface):
+            def get_allowed_auths(self, username):
+                return 'publickey'
+            def check_auth_publickey(self, username, key):
+                if key.get_base64() == client_key.get_base64():
+                    return paramiko.AUTH_SUCCESSFUL
+                return paramiko.AUTH_FAILED
+            def check_channel_request(self, kind, chanid):
+                if kind == 'session':
+                    return paramiko.OPEN_SUCCEEDED
+                return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+            def check_channel_exec_request(self, channel, command):
+                commands.append((channel, command))
+                requested.set()
+                return True
+
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self._host_key)
+        try:
+            transport.start_server(server = Interface())
+            while transport.is_active():
+                if not requested.wait(.5):
+                    continue
+                requested.clear()
+                while commands:
+                    channel, command = commands.pop(0)
+                    status = self._scp(channel, command.decode('utf8'))
+                    channel.send_exit_status(status)
+                    channel.close()
+        except Exception:
+            pass
+        finally:
+            transport.close()
+
+    def _scp(self, channel, command:str) -> int:
+        """
+        act as the source of an scp download and return the exit status
+        """
+        args = shlex.split(command)
+        if len(args) < 3 or args[0] != 'scp' or '-f' not in args:
+            channel.sendall(b'\x01scp: only downloads are supported\n')
+            return 1
+        recursive = '-r' in args
+        paths = [a for a in args[1:] if not a.startswith('-')]
+        channel.settimeout(10)
+        try:
+            self._ack(channel)
+            for path in paths:
+                path = os.path.realpath(path)
+                if os.path.commonpath([path, self.root]) != self.root or not os.path.exists(path):
+                    channel.sendall(f"\x01scp: {path}: No such file or directory\n".encode('utf8'))
+                    return 1
+                if os.path.isdir(path) and not recursive:
+                    channel.sendall(f"\x01scp: {path}: not a regular file\n".encode('utf8'))
+                    return 1
+                self._send(channel, path)
+        except (OSError, EOFError):
+            return 1
+        return 0
+
+    @staticmethod
+    def _ack(channel):
+        reply = channel.recv(1)
+        if reply != b'\x00':
+            raise EOFError("scp client did not acknowledge")
+
+    def _send(self, channel, path:str):
+        name = os.path.basename(path)
+        if os.path.isdir(path):
+            channel.sendall(f"D0755 0 {name}\n".encode('utf8'))
+            self._ack(channel)
+            for child in sorted(os.listdir(path)):
+                self._send(channel, os.path.join(path, child))
+            channel.sendall(b"E\n")
+            self._ack(channel)
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+            channel.sendall(f"C0644 {len(data)} {name}\n".encode('utf8'))
+            self._ack(channel)
+            channel.sendall(data + b'\x00')
+            self._ack(channel)
+
+
+class SimClient:
+    """
+    minimal client for the ratBerryPi protocol (see the module docstring)
+    for use where ratBerryPi is not installed. this only implements the
+    interface of ratBerryPi.remote.client.Client used by pyBehavior. each
+    channel is a separate connection
+    """
+
+    def __init__(self, host:str, port:int):
+        self.host = host
+        self.port = port
+        self.channels = {}
+        self.new_channel('default')
+
+    def new_channel(self, name:str):
+        if name in self.channels:
+            return
+        sock = socket.create_connection((self.host, self.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.channels[name] = {'sock': sock, 'file': sock.makefile('rb'), 'lock': threading.Lock()}
+
+    def _request(self, req:dict, channel:str) -> str:
+        chan = self.channels[channel]
+        with chan['lock']:
+            chan['sock'].sendall((json.dumps(req) + '\n').encode('utf8'))
+            return chan['file'].readline().decode('utf8')
+
+    def get(self, req:str, channel:str = 'default'):
+        reply = self._request({'command': 'GET', 'req': req}, channel)
+        try:
+            return json.loads(reply)
+        except ValueError:
+            raise RuntimeError(reply.strip())
+
+    def run_command(self, command:str, args:dict = {}, channel:str = 'default') -> str:
+        return self._request({'command': command, 'args': args}, channel)
+
+    def close(self):
+        for chan in self.channels.values():
+            chan['file'].close()
+            chan['sock'].close()
+        self.channels.clear()
@@ -4,6 +4,253 @@ import socket
 from PyQt5.QtWidgets import QVBoxLayout, QHBoxLayout, QLineEdit, QLabel, QGroupBox
 from PyQt5.QtGui import  QDoubleValidator
 import ast
+import os
+import select
+import struct
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+
+# binary position packets start with a fixed header followed by
+# n_keypoints rows of (x, y, conf) as little endian float32
+POSITION_MAGIC = b'PBPS'
+POSITION_VERSION = 1
+position_header = np.dtype([('magic', 'S4'), ('version', '<u2'), ('n_keypoints', '<u2'),
+                            ('frame', '<u8'), ('timestamp', '<f8')])
+
+
+def pack_position(frame:int, timestamp:float, keypoints:np.ndarray) -> bytes:
+    """
+    pack keypoints into a binary position packet
+
+    Args:
+        frame: int
+            index of the frame the keypoints were estimated from
+        timestamp: float
+            time the frame was acquired in seconds since the epoch
+        keypoints: np.ndarray
+            array of shape (n_keypoints, 3) with the x and y
+            position and confidence of each keypoint
+    """
+    keypoints = np.ascontiguousarray(keypoints, dtype = '<f4')
+    header = struct.pack('<4sHHQd', POSITION_MAGIC, POSITION_VERSION, keypoints.shape[0], frame, timestamp)
+    return header + keypoints.tobytes()
+
+
+# shared memory rings start with a header followed by capacity slots
+# which each hold one frame. slot sequence numbers are set to 0 while a
+# slot is written and to the (1-based) sequence number of the frame after.
+# instance is a random id drawn when the ring is created, so readers can
+# tell when a ring was recreated under the same name
+ring_header = np.dtype([('magic', 'S4'), ('version', '<u2'), ('n_keypoints', '<u2'),
+                        ('capacity', '<u4'), ('instance', '<u4'), ('seq', '<u8')])
+RING_MAGIC = b'PBPR'
+
+
+def ring_slot(n_keypoints:int) -> np.dtype:
+    return np.dtype([('seq', '<u8'), ('frame', '<u8'), ('timestamp', '<f8'),
+                     ('keypoints', '<f4', (n_keypoints, 3))])
+
+
+class PositionRing:
+    """
+    ring buffer of keypoint frames in named shared memory, for passing
+    positions from a tracker to pyBehavior on the same computer without
+    any serialization. the tracker creates the ring and writes frames to
+    it, and PositionThread attaches to it by name and reads the newest
+    frame whenever the sequence counter advances. for example, in the
+    tracker:
+
+        ring = PositionRing('rataGUI', n_keypoints = 8, create = True)
+        ring.write(frame, time.time(), keypoints)
+
+    a frame which is overwritten while it is being read is detected with
+    the slot's sequence number and read again
+
+    Args:
+        name: str
+            name of the shared memory block
+        n_keypoints: int (optional)
+            number of keypoints per frame. required when creating the ring
+        capacity: int (optional)
+            number of frames the ring holds [default: 64]
+        create: bool (optional)
+            whether to create the ring or attach to an existing one
+            [default: False]
+    """
+
+    def __init__(self, name:str, n_keypoints:int = None, capacity:int = 64, create:bool = False):
+        self.name = name
+        if create:
+            assert n_keypoints is not None, "n_keypoints must be specified when creating a ring"
+            size = ring_header.itemsize + capacity * ring_slot(n_keypoints).itemsize
+            self.shm = shared_memory.SharedMemory(name, create = True, size = size)
+            header = np.ndarray(1, ring_header, buffer = self.shm.buf)
+            instance = int.from_bytes(os.urandom(4), 'little') or 1
+            header[0] = (RING_MAGIC, POSITION_VERSION, n_keypoints, capacity, instance, 0)
+        else:
+            # the tracker owns the block, so don't let the resource
+            # tracker unlink it when this process exits
+            try:
+                self.shm = shared_memory.SharedMemory(name, track = False)
+            except TypeError:
+                # track was added in python 3.13
+                self.shm = shared_memory.SharedMemory(name)
+                if os.name == 'posix':
+                    resource_tracker.unregister(self.shm._name, 'shared_memory')
+            header = np.ndarray(1, ring_header, buffer = self.shm.buf)
+            if header[0]['magic'] != RING_MAGIC:
+                del header
+                self.shm.close()
+                raise ValueError(f"shared memory block '{name}' is not a position ring")
+        self._header = header
+        self._seq = header['seq']
+        self.n_keypoints = int(header[0]['n_keypoints'])
+        self.capacity = int(header[0]['capacity'])
+        self.instance = int(header[0]['instance'])
+        self._slots = np.ndarray(self.capacity, ring_slot(self.n_keypoints), buffer = self.shm.buf,
+                                 offset = ring_header.itemsize)
+        self._slot_seq = self._slots['seq']
+        self._slot_frame = self._slots['frame']
+        self._slot_timestamp = self._slots['timestamp']
+        self._slot_keypoints = self._slots['keypoints']
+
+    @property
+    def seq(self) -> int:
+        """
+        number of frames written to the ring
+        """
+        return int(self._seq[0])
+
+    def write(self, frame:int, timestamp:float, keypoints:np.ndarray):
+        """
+        write a frame to the ring
+
+        Args:
+            frame: int
+                index of the frame the keypoints were estimated from
+            timestamp: float
+                time the frame was acquired in seconds since the epoch
+            keypoints: np.ndarray
+                array of shape (n_keypoints, 3) with the x and y
+                position and confidence of each keypoint
+        """
+        seq = self.seq + 1
+        i = (seq - 1) % self.capacity
+        self._slot_seq[i] = 0
+        self._slot_frame[i] = frame
+        self._slot_timestamp[i] = timestamp
+        self._slot_keypoints[i] = keypoints
+        self._slot_seq[i] = seq
+        self._seq[0] = seq
+
+    def read(self, seq:int, out:np.ndarray) -> tuple:
+        """
+        copy the keypoints of frame number seq into out. returns the
+        frame index and timestamp of the frame or None if the slot
+        no longer holds the frame
+        """
+        i = (seq - 1) % self.capacity
+        if self._slot_seq[i] != seq:
+            return None
+        np.copyto(out, self._slot_keypoints[i])
+        frame = int(self._slot_frame[i])
+        timestamp = float(self._slot_timestamp[i])
+        if self._slot_seq[i] != seq:
+            return None
+        return frame, timestamp
+
+    def close(self):
+        # views onto the block must be released before closing it
+        self._header = self._seq = self._slots = None
+        self._slot_seq = self._slot_frame = self._slot_timestamp = self._slot_keypoints = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class ConstantVelocityKalman:
+    """
+    constant velocity kalman filter for 2d positions. the state is
+    (x, y, vx, vy) and the acceleration is modeled as white noise
+
+    Args:
+        process_noise: float (optional)
+            spectral density of the acceleration noise in
+            units of position squared per second cubed
+        measurement_noise: float (optional)
+            variance of a position measurement with a mean
+            keypoint confidence of 1
+    """
+
+    def __init__(self, process_noise:float = 1e5, measurement_noise:float = 4.):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.x = np.zeros(4)
+        self.P = np.eye(4)
+        self.t = None
+        self._F = np.eye(4)
+        self._Q = np.zeros((4, 4))
+
+    def reset(self):
+        """
+        forget the state so the next measurement starts a new track
+        """
+        self.x[:] = 0
+        self.P = np.eye(4)
+        self.t = None
+
+    def update(self, z:np.ndarray, t:float, conf:float = 1.):
+        """
+        update the filter with a position measurement
+
+        Args:
+            z: np.ndarray
+                measured (x, y) position
+            t: float
+                time of the measurement in seconds
+            conf: float (optional)
+                confidence of the measurement. the measurement
+                noise is scaled by its inverse
+        """
+        if not np.isfinite(z).all():
+            return
+        r = self.measurement_noise / max(conf, 1e-3)
+        if self.t is None:
+            self.x[:2] = z
+            self.x[2:] = 0
+            self.P = np.diag([r, r, 1e6, 1e6])
+            self.t = t
+            return
+        dt = t - self.t
+        if dt > 0:
+            self._F[0, 2] = self._F[1, 3] = dt
+            q = self.process_noise
+            self._Q[[0, 1], [0, 1]] = q * dt**3 / 3
+            self._Q[[0, 1, 2, 3], [2, 3, 0, 1]] = q * dt**2 / 2
+            self._Q[[2, 3], [2, 3]] = q * dt
+            self.x = self._F @ self.x
+            self.P = self._F @ self.P @ self._F.T + self._Q
+            self.t = t
+        S = self.P[:2, :2] + r * np.eye(2)
+        K = self.P[:, :2] @ np.linalg.inv(S)
+        self.x += K @ (z - self.x[:2])
+        self.P -= K @ self.P[:2, :]
+
+    @property
+    def position(self) -> np.ndarray:
+        """
+        filtered (x, y) position at the time of the last measurement
+        """
+        return self.x[:2]
+
+    def predict(self, horizon:float) -> np.ndarray:
+        """
+        predict the (x, y) position horizon seconds
+        after the time of the last measurement
+        """
+        return self.x[:2] + horizon * self.x[2:]
 
 
 class Position(QGroupBox):
@@ -12,21 +259,32 @@ class Position(QGroupBox):
 
     Widget to receive, display and provide access to
     real-time position estimates sent over a UDP socket by rataGUI.
+    positions are emitted as [y, x] (row, column), the convention
+    pyBehavior.interfaces.zones.ZoneMap expects.
 
     (This widget is still under construction)
 
     PyQt Signals:
     new_position(list)
-    
+    smoothed_position(list)
+    predicted_position(list)
+    source_position(object, list)
+
     """
 
     new_position = pyqtSignal(list, name = 'newPosition')
+    smoothed_position = pyqtSignal(list)
+    predicted_position = pyqtSignal(list)
+    source_position = pyqtSignal(object, list)
 
-    def __init__(self, port:int = 1234):
+    def __init__(self, port:int = 1234, max_rate:float = None, **kwargs):
 
         super(Position, self).__init__()
-        self.pos_thread = PositionThread(port)
+        self.pos_thread = PositionThread(port, max_rate = max_rate, **kwargs)
         self.pos_thread.new_position.connect(lambda x: self.new_position.emit(x))
+        self.pos_thread.source_position.connect(lambda a, x: self.source_position.emit(a, x))
+        self.pos_thread.smoothed_position.connect(lambda x: self.smoothed_position.emit(x))
+        self.pos_thread.predicted_position.connect(lambda x: self.predicted_position.emit(x))
 
         layout = QVBoxLayout()
         port_layout = QHBoxLayout()
@@ -51,33 +309,562 @@ class Position(QGroupBox):
     def start(self):
         self.pos_thread.start()
 
+    def stop(self):
+        self.pos_thread.stop()
+        self.pos_thread.wait()
+
+
+class PositionSource:
+    """
+    state of a single tracker sending keypoints to a PositionThread.
+    only the newest frame received since the last update is kept, and
+    the keypoints of the last window frames are kept in a ring buffer
+    so the confidence weighted average can be computed in place
+
+    Attributes:
+        address (tuple):
+            address of the tracker
+        frame (int):
+            frame index of the newest binary packet
+        timestamp (float):
+            timestamp of the newest binary packet
+        received (int):
+            number of packets received
+        dropped (int):
+            number of packets dropped because a newer frame was
+            received before they could be processed
+        gaps (int):
+            number of gaps in the sequence of frame indices
+        lost (int):
+            number of frames missing from the sequence of frame indices
+        out_of_order (int):
+            number of packets received after a newer frame
+        resets (int):
+            number of times the frame index restarted, e.g.
+            because the tracker was restarted
+        kalman (ConstantVelocityKalman):
+            filter applied to the confidence weighted mean keypoint
+            position of each processed frame, or None if no filter is used
+        latency (float):
+            moving average of the end-to-end latency in seconds from the
+            acquisition of a frame to the emission of its position. only
+            measured for binary packets. if the timestamps of the source
+            are not on this computer's clock (see shared_clock) this is
+            measured from the receipt of the frame instead
+        shared_clock (bool):
+            whether the timestamps of the source appear to be on this
+            computer's clock, i.e. no frame has been received before its
+            timestamp or more than max_transit seconds after it
+    """
+
+    def __init__(self, address:tuple, window:int = 5, n_latencies:int = 1000,
+                 kalman:ConstantVelocityKalman = None, reset_frames:int = 100, max_transit:float = 1.):
+        self.address = address
+        self.window = window
+        self.reset_frames = reset_frames
+        self.max_transit = max_transit
+        self.shared_clock = True
+        self.kalman = kalman
+        self.latency = None
+        self.frame = None
+        self.timestamp = None
+        self.received = 0
+        self.dropped = 0
+        self.gaps = 0
+        self.lost = 0
+        self.out_of_order = 0
+        self.resets = 0
+        self.emitted = 0
+        self.last_emit = -np.inf
+        self.pending = False
+        self._staged = False
+        self._recv_time = None
+        self._latencies = np.full(n_latencies, np.nan)
+        self._e2e = np.full(n_latencies, np.nan)
+        self._n_e2e = 0
+        self._n_keypoints = None
+
+    def _alloc(self, n_keypoints:int):
+        """
+        (re)allocate the buffers for a given number of keypoints
+        """
+        self._n_keypoints = n_keypoints
+        self._keypoints = np.zeros((n_keypoints, 3), dtype = np.float32)
+        self._ring = np.zeros((self.window, n_keypoints, 3), dtype = np.float32)
+        self._weighted = np.zeros((self.window, n_keypoints, 2), dtype = np.float32)
+        self._num = np.zeros((n_keypoints, 2), dtype = np.float64)
+        self._den = np.zeros((n_keypoints, 1), dtype = np.float64)
+        self._pos = np.zeros(2, dtype = np.float64)
+        self._frame_pos = np.zeros(2, dtype = np.float64)
+        self._n_frames = 0
+
+    def _is_reset(self, frame:int, timestamp:float) -> bool:
+        """
+        whether a frame index at or before the last one starts a new
+        stream rather than being a late packet. this is the case if the
+        index jumped back by more than reset_frames or if the timestamp
+        moved forward
+        """
+        if self.frame - frame > self.reset_frames:
+            return True
+        return timestamp is not None and self.timestamp is not None and timestamp > self.timestamp
+
+    def reset(self):
+        """
+        start a new stream, discarding the buffered frames
+        """
+        self.resets += 1
+        self.frame = None
+        self.shared_clock = True
+        self._n_frames = 0
+        if self.kalman is not None:
+            self.kalman.reset()
+
+    def stage(self, frame:int, timestamp:float, keypoints:np.ndarray, recv_time:float, skipped:int = 0):
+        """
+        stage a received frame for the next update, replacing any older
+        frame that hasn't been processed yet
+
+        Args:
+            frame: int
+                frame index of the packet or None if it has none
+            timestamp: float
+                timestamp of the packet or None if it has none
+            keypoints: np.ndarray
+                array of shape (n_keypoints, 3)
+            recv_time: float
+                time the packet was received
+            skipped: int (optional)
+                number of frames the transport skipped over since the
+                last frame because they were already stale
+        """
+        self.received += 1
+        self.dropped += skipped
+        if frame is not None and self.frame is not None and frame <= self.frame:
+            if not self._is_reset(frame, timestamp):
+                self.out_of_order += 1
+                self.dropped += 1
+                return
+            self.reset()
+        if frame is not None and self.frame is not None:
+            if frame > self.frame + 1 + skipped:
+                self.gaps += 1
+                self.lost += frame - self.frame - 1 - skipped
+        if self._staged:
+            self.dropped += 1
+        if keypoints.shape[0] != self._n_keypoints:
+            self._alloc(keypoints.shape[0])
+        np.copyto(self._keypoints, keypoints)
+        self.frame = frame
+        self.timestamp = timestamp
+        self._recv_time = recv_time
+        self._staged = True
+
+    def update(self) -> bool:
+        """
+        add the staged frame to the ring buffer. returns whether
+        there was a staged frame
+        """
+        if not self._staged:
+            return False
+        self._staged = False
+        np.copyto(self._ring[self._n_frames % self.window], self._keypoints)
+        self._n_frames += 1
+        if self.kalman is not None:
+            # confidence weighted mean over the keypoints that were detected
+            kp = self._keypoints
+            valid = np.isfinite(kp).all(axis = 1) & (kp[:, 2] > 0)
+            if valid.any():
+                conf = kp[valid, 2]
+                np.divide((kp[valid, :2] * conf[:, None]).sum(axis = 0), conf.sum(), out = self._frame_pos)
+                t = self.timestamp if self.timestamp is not None else self._recv_time
+                self.kalman.update(self._frame_pos, t, float(conf.mean()))
+        self.pending = True
+        return True
+
+    def position(self) -> np.ndarray:
+        """
+        compute the confidence weighted average position over the
+        buffered frames in place. returns an array of (x, y)
+        """
+        n = min(self._n_frames, self.window)
+        ring = self._ring[:n]
+        np.multiply(ring[..., :2], ring[..., 2:], out = self._weighted[:n])
+        np.sum(self._weighted[:n], axis = 0, out = self._num)
+        np.sum(ring[..., 2:], axis = 0, out = self._den)
+        np.divide(self._num, self._den, out = self._num)
+        return np.mean(self._num, axis = 0, out = self._pos)
+
+    def emitted_at(self, t:float):
+        """
+        record that the position of this source was emitted at time t
+        """
+        self._latencies[self.emitted % self._latencies.size] = t - self._recv_time
+        if self.timestamp is not None:
+            transit = self._recv_time - self.timestamp
+            if self.shared_clock and not (0 <= transit <= self.max_transit):
+                # latencies measured so far mixed the two clocks
+                self.shared_clock = False
+                self.latency = None
+            e2e = t - self.timestamp if self.shared_clock else t - self._recv_time
+            self._e2e[self._n_e2e % self._e2e.size] = e2e
+            self._n_e2e += 1
+            self.latency = e2e if self.latency is None else self.latency + .05 * (e2e - self.latency)
+        self.emitted += 1
+        self.last_emit = t
+        self.pending = False
+
+    def stats(self) -> dict:
+        """
+        summary of the packets received from this source. latencies
+        are the time in seconds from receiving a frame to emitting
+        its position over the most recent emissions, and end-to-end
+        latencies are the time from acquiring a frame to emitting its
+        position
+        """
+        latencies = self._latencies[:min(self.emitted, self._latencies.size)]
+        e2e = self._e2e[:min(self._n_e2e, self._e2e.size)]
+        expected = self.received + self.lost
+        return {
+            'received': self.received,
+            'emitted': self.emitted,
+            'dropped': self.dropped,
+            'gaps': self.gaps,
+            'lost': self.lost,
+            'loss': self.lost / expected if expected > 0 else 0.,
+            'out_of_order': self.out_of_order,
+            'resets': self.resets,
+            'shared_clock': self.shared_clock,
+            'latency_p50': float(np.percentile(latencies, 50)) if latencies.size else np.nan,
+            'latency_p99': float(np.percentile(latencies, 99)) if latencies.size else np.nan,
+            'e2e_latency_p50': float(np.percentile(e2e, 50)) if e2e.size else np.nan,
+            'e2e_latency_p99': float(np.percentile(e2e, 99)) if e2e.size else np.nan,
+        }
+
+
 class PositionThread(QThread):
-    
+    """
+    thread which receives keypoint estimates over udp and emits the
+    confidence weighted average position over the last few frames.
+    datagrams may either be binary packets (see pack_position) or the
+    text format sent by rataGUI. binary packets are received into a
+    preallocated buffer and decoded through numpy views onto it.
+
+    the socket is non-blocking; on each wake-up all pending datagrams
+    are drained and only the newest frame from each source is
+    processed, so a slow consumer never acts on stale positions.
+    keypoints are sent as (x, y) but positions are emitted as [y, x].
+    positions are emitted at most max_rate times per second per source.
+
+    the position of every source is emitted with its address through
+    source_position, while new_position, smoothed_position and
+    predicted_position only carry the positions of one source so
+    positions from different trackers are never interleaved. this is
+    the source given by the source argument or, by default, the first
+    source packets are received from. if the default source stops
+    sending for source_timeout seconds, the most recently active source
+    is used instead (e.g. if a restarted tracker sends from a new port)
+
+    trackers on the same computer can instead write frames to a named
+    shared memory ring (see PositionRing). if shm is given, the ring is
+    checked every poll_interval seconds in addition to listening on the
+    udp port, and only the newest frame in the ring is read. if the
+    tracker recreates the ring (i.e. its sequence counter goes back or
+    a ring with a different instance id is found under the name while
+    the ring is idle) the thread attaches to the new ring
+
+    optionally, the mean keypoint position of each processed frame is
+    also passed through a constant velocity kalman filter, and the
+    filtered position and the position predicted horizon seconds after
+    the frame was acquired are emitted through smoothed_position and
+    predicted_position. with horizon = 'auto' the horizon is the
+    measured end-to-end latency plus lead seconds, limited to
+    max_horizon seconds, so the prediction tracks where the animal is
+    when the position is acted on. the end-to-end latency can only be
+    measured if the tracker timestamps frames with this computer's
+    clock (e.g. through the shared memory ring). otherwise only the
+    latency from receiving a frame is measured
+
+    Args:
+        port: int
+            port to receive packets on
+        window: int (optional)
+            number of frames to average over for new_position
+        max_packet: int (optional)
+            maximum size of a packet in bytes
+        max_rate: float (optional)
+            maximum rate in Hz at which to emit positions per source
+        kalman: bool (optional)
+            whether or not to filter positions [default: False]
+        horizon: float or str (optional)
+            time in seconds after the acquisition of a frame to predict
+            the position at, or 'auto' [default: 0]
+        lead: float (optional)
+            time in seconds added to the measured latency when
+            horizon is 'auto', e.g. to cover the latency of a reward
+        max_horizon: float (optional)
+            maximum horizon in seconds when horizon is 'auto' [default: .5]
+        process_noise: float (optional)
+            see ConstantVelocityKalman
+        measurement_noise: float (optional)
+            see ConstantVelocityKalman
+        shm: str (optional)
+            name of a shared memory PositionRing to read frames from
+        poll_interval: float (optional)
+            interval in seconds at which to check the ring for new
+            frames [default: 1e-3]
+        source: tuple or str (optional)
+            address or host of the source to emit positions from.
+            the address of the shared memory ring is ('shm', shm)
+        source_timeout: float (optional)
+            time in seconds without packets after which to switch
+            to another source if source is not given [default: 1]
+
+    Attributes:
+        frame (int):
+            frame index of the last emitted binary packet
+        timestamp (float):
+            timestamp of the last emitted binary packet
+        sources (dict):
+            PositionSource for each address packets were received from
+        active (PositionSource):
+            source whose positions are emitted through new_position
+    """
+
     new_position = pyqtSignal(list, name = 'newPosition')
+    smoothed_position = pyqtSignal(list)
+    predicted_position = pyqtSignal(list)
+    source_position = pyqtSignal(object, list)
 
-    def __init__(self, port, buff_size = 10):
+    def __init__(self, port, buff_size = 10, window:int = 5, max_packet:int = 65536,
+                 max_rate:float = None, kalman:bool = False, horizon = 0., lead:float = 0.,
+                 max_horizon:float = .5, process_noise:float = 1e5, measurement_noise:float = 4., shm:str = None,
+                 poll_interval:float = 1e-3, source = None, source_timeout:float = 1.):
         super(PositionThread, self).__init__()
         self.sock = None
         self.bind_port(port)
-        self.pos_buffer = []
-        self.conf_buffer = []
+        self.window = window
+        self.max_rate = max_rate
+        self.kalman = kalman
+        self.horizon = horizon
+        self.lead = lead
+        self.max_horizon = max_horizon
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.frame = None
+        self.timestamp = None
+        self.sources = {}
+        self.source = source
+        self.source_timeout = source_timeout
+        self.active = None
+        self.running = False
+        self._buf = bytearray(max_packet)
+        self._header = np.frombuffer(self._buf, dtype = position_header, count = 1)
+        self._views = {}
+        self.shm = shm
+        self.poll_interval = poll_interval
+        self.ring = None
+        self._ring_seq = 0
+        self._ring_attempt = -np.inf
+        self._ring_checked = -np.inf
 
     def bind_port(self, port):
         if self.sock:
             self.sock.close()
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setblocking(False)
         self.sock.bind(("", int(port)))
-    
-    def run(self):
+
+    def _decode(self, n:int) -> tuple:
+        """
+        decode the datagram of n bytes in the receive buffer and
+        return its frame index, timestamp and an array of shape
+        (n_keypoints, 3). text packets have no frame index or timestamp
+        """
+        header = self._header[0]
+        if n >= position_header.itemsize and header['magic'] == POSITION_MAGIC:
+            k = int(header['n_keypoints'])
+            if n < position_header.itemsize + 12 * k:
+                raise ValueError("truncated position packet")
+            if k not in self._views:
+                self._views[k] = np.frombuffer(self._buf, dtype = '<f4', count = 3 * k,
+                                               offset = position_header.itemsize).reshape(k, 3)
+            return int(header['frame']), float(header['timestamp']), self._views[k]
+        # text format: [[[(x, y), conf], ...], ...]
+        pos = ast.literal_eval(self._buf[:n].decode())
+        keypoints = np.array([[i[0][0], i[0][1], i[1]] for i in pos[0]], dtype = np.float32)
+        return None, None, keypoints
+
+    def _drain(self, sock:socket.socket):
+        """
+        receive all pending datagrams and stage them on their source
+        """
         while True:
-            if self.sock:
-                pos = ast.literal_eval(self.sock.recv(1024).decode())
-                self.pos_buffer.append(np.array([i[0] for i in pos[0]]))
-                self.conf_buffer.append(np.array([i[1] for i in pos[0]]))
-                self.pos_buffer = self.pos_buffer[-5:]
-                self.conf_buffer = self.conf_buffer[-5:]
-                weighted_pos = np.array(self.pos_buffer) * np.array(self.conf_buffer)[:,:,None]
-                pos = weighted_pos.sum(axis=0)/np.array(self.conf_buffer).sum(axis=0)[:,None]
-                pos = pos.mean(axis=0).tolist()
-                self.new_position.emit(pos[::-1])
+            try:
+                n, address = sock.recvfrom_into(self._buf)
+            except (BlockingIOError, InterruptedError):
+                return
+            recv_time = time.time()
+            try:
+                frame, timestamp, keypoints = self._decode(n)
+            except (ValueError, SyntaxError) as e:
+                print(f"invalid position packet: {e}")
+                continue
+            self._source(address).stage(frame, timestamp, keypoints, recv_time)
+
+    def _source(self, address) -> PositionSource:
+        if address not in self.sources:
+            kalman = ConstantVelocityKalman(self.process_noise, self.measurement_noise) if self.kalman else None
+            self.sources[address] = PositionSource(address, self.window, kalman = kalman)
+        return self.sources[address]
+
+    def _select(self, now:float) -> PositionSource:
+        """
+        get the source whose positions are emitted through new_position
+        """
+        if self.source is not None:
+            for address, source in self.sources.items():
+                if address == self.source or address[0] == self.source:
+                    return source
+            return None
+        if self.active is None or now - self.active._recv_time > self.source_timeout:
+            recent = max(self.sources.values(), key = lambda x: x._recv_time or -np.inf, default = None)
+            if recent is not None and recent is not self.active and recent._recv_time is not None:
+                if self.active is not None:
+                    print(f"switching position source from {self.active.address} to {recent.address}")
+                self.active = recent
+        return self.active
+
+    def _poll_ring(self):
+        """
+        stage the newest frame in the shared memory ring if there is one
+        """
+        now = time.time()
+        if self.ring is None:
+            # the tracker may not have created the ring yet
+            if now - self._ring_attempt < .5:
+                return
+            self._ring_attempt = now
+            try:
+                ring = PositionRing(self.shm)
+            except (FileNotFoundError, ValueError):
+                return
+            self._attach_ring(ring, ring.seq)
+        seq = self.ring.seq
+        if seq < self._ring_seq:
+            # the counter went back so the ring was recreated
+            self._reattach_ring(force = True)
+            return
+        if seq == self._ring_seq:
+            # a recreated ring leaves this one idle, so check
+            # for a new ring under the same name now and then
+            if now - self._ring_checked >= .5:
+                self._ring_checked = now
+                self._reattach_ring()
+            return
+        self._ring_checked = now
+        res = self.ring.read(seq, self._ring_keypoints)
+        if res is None:
+            # overwritten while reading, try again on the next poll
+            return
+        recv_time = time.time()
+        frame, timestamp = res
+        skipped = seq - self._ring_seq - 1 if self._ring_seq > 0 else 0
+        self._ring_seq = seq
+        self._source(('shm', self.shm)).stage(frame, timestamp, self._ring_keypoints, recv_time, skipped)
+
+    def _attach_ring(self, ring:PositionRing, seq:int):
+        if self.ring is not None:
+            self.ring.close()
+        self.ring = ring
+        self._ring_seq = seq
+        self._ring_keypoints = np.zeros((ring.n_keypoints, 3), dtype = np.float32)
+
+    def _reattach_ring(self, force:bool = False):
+        """
+        attach to the ring currently under the name if it
+        is a different instance than the attached ring
+        """
+        try:
+            ring = PositionRing(self.shm)
+        except (FileNotFoundError, ValueError):
+            return
+        if force or ring.instance != self.ring.instance:
+            print(f"position ring '{self.shm}' was recreated, reattaching")
+            # read the newest frame of the new ring on the next poll
+            self._attach_ring(ring, 0)
+        else:
+            ring.close()
+
+    def _emit(self) -> float:
+        """
+        emit the position of every source with a new frame which
+        hasn't been emitted within the last 1/max_rate seconds.
+        returns the time until the next pending emission or None
+        """
+        now = time.time()
+        interval = 1/self.max_rate if self.max_rate else 0
+        wait = None
+        active = self._select(now)
+        for source in list(self.sources.values()):
+            source.update()
+            if not source.pending:
+                continue
+            remaining = source.last_emit + interval - now
+            if remaining > 0:
+                wait = remaining if wait is None else min(wait, remaining)
+                continue
+            pos = source.position()[::-1].tolist()
+            self.source_position.emit(source.address, pos)
+            if source is active:
+                self.frame = source.frame
+                self.timestamp = source.timestamp
+                self.new_position.emit(pos)
+                if source.kalman is not None and source.kalman.t is not None:
+                    self.smoothed_position.emit(source.kalman.position[::-1].tolist())
+                    self.predicted_position.emit(source.kalman.predict(self.get_horizon(source))[::-1].tolist())
+            source.emitted_at(time.time())
+        return wait
+
+    def get_horizon(self, source:PositionSource) -> float:
+        """
+        get the prediction horizon in seconds for a source
+        """
+        if self.horizon == 'auto':
+            return min(max((source.latency or 0.) + self.lead, 0.), self.max_horizon)
+        return self.horizon
+
+    def stats(self) -> dict:
+        """
+        packet statistics for each source (see PositionSource.stats)
+        """
+        return {address: source.stats() for address, source in list(self.sources.items())}
+
+    def run(self):
+        self.running = True
+        wait = None
+        try:
+            while self.running:
+                sock = self.sock
+                timeout = .1 if wait is None else wait
+                if self.shm is not None:
+                    timeout = min(timeout, self.poll_interval)
+                try:
+                    ready, _, _ = select.select([sock], [], [], timeout)
+                    if ready:
+                        self._drain(sock)
+                except (OSError, ValueError):
+                    # the socket was closed while rebinding
+                    time.sleep(.01)
+                    continue
+                if self.shm is not None:
+                    self._poll_ring()
+                wait = self._emit()
+        finally:
+            if self.ring is not None:
+                self.ring.close()
+                self.ring = None
+
+    def stop(self):
+        self.running = False
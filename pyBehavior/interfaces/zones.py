@@ -0,0 +1,251 @@
+"""
+spatial zones for position driven protocol inputs. a ZoneMap takes
+position estimates (e.g. from pyBehavior.interfaces.socket.Position) and
+emits signals only when the animal enters, exits or dwells in a zone, so
+protocols don't need to test every position against their own regions.
+
+zones are indexed on a uniform grid; each cell of the grid stores the
+zones whose bounding boxes overlap it, so only a handful of zones are
+tested against each position regardless of how many zones there are.
+zones can be declared in a yaml file of the form:
+
+    CELL_SIZE: 20
+    ZONES:
+      arm1:
+        polygon: [[0, 0], [100, 0], [100, 20], [0, 20]]
+      reward1:
+        circle: [50, 50]
+        radius: 10
+        dwell: 1.5
+
+where dwell is an optional time in seconds after which a dwell event
+is emitted while the animal stays in the zone.
+
+zones are defined in (x, y) coordinates, while positions are taken in
+the order emitted by pyBehavior.interfaces.socket.Position, i.e. as
+[y, x] (row, column), so position signals can be connected directly
+to ZoneMap.update
+"""
+
+from PyQt5.QtCore import QObject, QTimer, Qt, pyqtSignal
+from abc import ABC, abstractmethod
+import numpy as np
+import math
+import yaml
+
+
+class Zone(ABC):
+    """
+    abstract base class for zones. subclasses must define
+    bounds and contains
+
+    Args:
+        name: str
+            name of the zone
+        dwell: float (optional)
+            time in seconds after entering the zone after
+            which a dwell event should be emitted
+    """
+
+    def __init__(self, name:str, dwell:float = None):
+        self.name = name
+        self.dwell = dwell
+
+    @property
+    @abstractmethod
+    def bounds(self) -> tuple:
+        """
+        bounding box of the zone as (xmin, ymin, xmax, ymax)
+        """
+        ...
+
+    @abstractmethod
+    def contains(self, x:float, y:float) -> bool:
+        """
+        whether the point (x, y) is inside the zone
+        """
+        ...
+
+
+class CircleZone(Zone):
+    """
+    circular zone
+
+    Args:
+        name: str
+            name of the zone
+        center: tuple
+            (x, y) coordinates of the center of the circle
+        radius: float
+            radius of the circle
+        dwell: float (optional)
+            see Zone
+    """
+
+    def __init__(self, name:str, center:tuple, radius:float, dwell:float = None):
+        super(CircleZone, self).__init__(name, dwell)
+        self.x, self.y = map(float, center)
+        self.radius = float(radius)
+        self._r2 = self.radius**2
+
+    @property
+    def bounds(self) -> tuple:
+        return (self.x - self.radius, self.y - self.radius, self.x + self.radius, self.y + self.radius)
+
+    def contains(self, x:float, y:float) -> bool:
+        return (x - self.x)**2 + (y - self.y)**2 <= self._r2
+
+
+class PolygonZone(Zone):
+    """
+    polygonal zone. the polygon is closed automatically
+    and may be concave
+
+    Args:
+        name: str
+            name of the zone
+        vertices: list
+            list of (x, y) coordinates of the vertices of the polygon
+        dwell: float (optional)
+            see Zone
+    """
+
+    def __init__(self, name:str, vertices:list, dwell:float = None):
+        super(PolygonZone, self).__init__(name, dwell)
+        self.vertices = np.asarray(vertices, dtype = float)
+        assert self.vertices.ndim == 2 and self.vertices.shape[0] >= 3 and self.vertices.shape[1] == 2, \
+            "a polygon must have at least 3 (x, y) vertices"
+        # edges as tuples of (x0, y0, x1, y1) for a fast pure python crossing test
+        nxt = np.roll(self.vertices, -1, axis = 0)
+        self._edges = [tuple(e) for e in np.hstack([self.vertices, nxt]).tolist()]
+
+    @property
+    def bounds(self) -> tuple:
+        return (*self.vertices.min(axis = 0), *self.vertices.max(axis = 0))
+
+    def contains(self, x:float, y:float) -> bool:
+        inside = False
+        for x0, y0, x1, y1 in self._edges:
+            if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+                inside = not inside
+        return inside
+
+
+class ZoneMap(QObject):
+    """
+    emits events as a position moves between zones. connect
+    a position signal to update, for example:
+
+        zones = ZoneMap([CircleZone('reward1', (50, 50), 10, dwell = 1)])
+        position.new_position.connect(zones.update)
+
+    positions are taken to be in the same coordinates as the zones but
+    as [y, x], the order they are emitted in by the Position widget.
+    dwell events are emitted by timers, so they fire on time even if
+    no new positions arrive
+
+    Args:
+        zones: list
+            list of Zone objects
+        cell_size: float (optional)
+            size of the cells of the grid used to index the zones.
+            by default this is the median size of the zones' bounding
+            boxes
+
+    PyQt Signals:
+        entered(str): emitted with the name of a zone when it is entered
+        exited(str): emitted with the name of a zone when it is exited
+        dwell(str): emitted with the name of a zone when the position has
+            stayed in it for the dwell time of the zone
+    """
+
+    entered = pyqtSignal(str)
+    exited = pyqtSignal(str)
+    dwell = pyqtSignal(str)
+
+    def __init__(self, zones:list, cell_size:float = None):
+        super(ZoneMap, self).__init__()
+        self.zones = {zone.name: zone for zone in zones}
+        assert len(self.zones) == len(zones), "zone names must be unique"
+        if cell_size is None:
+            sizes = [max(b[2] - b[0], b[3] - b[1]) for b in (z.bounds for z in zones)]
+            cell_size = float(np.median(sizes)) if sizes else 1.
+        self.cell_size = cell_size if cell_size > 0 else 1.
+        self.current = frozenset()
+        self._dwell_timers = {}
+        for zone in zones:
+            if zone.dwell is not None:
+                timer = QTimer(self)
+                timer.setSingleShot(True)
+                timer.setTimerType(Qt.PreciseTimer)
+                timer.setInterval(int(round(zone.dwell * 1000)))
+                timer.timeout.connect(lambda name = zone.name: self._on_dwell(name))
+                self._dwell_timers[zone.name] = timer
+        self._cell = None
+        self._candidates = ()
+        self._index()
+
+    @classmethod
+    def from_yaml(cls, path) -> 'ZoneMap':
+        """
+        create a ZoneMap from a yaml file (see the module docstring)
+        """
+        with open(path, 'r') as f:
+            config = yaml.safe_load(f)
+        zones = []
+        for name, spec in config.get('ZONES', {}).items():
+            if 'circle' in spec:
+                zones.append(CircleZone(name, spec['circle'], spec['radius'], spec.get('dwell')))
+            elif 'polygon' in spec:
+                zones.append(PolygonZone(name, spec['polygon'], spec.get('dwell')))
+            else:
+                raise ValueError(f"zone '{name}' must specify either a circle or a polygon")
+        return cls(zones, config.get('CELL_SIZE'))
+
+    def _index(self):
+        """
+        build the grid index mapping each cell to the
+        zones whose bounding boxes overlap it
+        """
+        self._grid = {}
+        for zone in self.zones.values():
+            xmin, ymin, xmax, ymax = zone.bounds
+            for i in range(math.floor(xmin / self.cell_size), math.floor(xmax / self.cell_size) + 1):
+                for j in range(math.floor(ymin / self.cell_size), math.floor(ymax / self.cell_size) + 1):
+                    self._grid[(i, j)] = self._grid.get((i, j), ()) + (zone,)
+
+    def locate(self, x:float, y:float) -> frozenset:
+        """
+        get the names of all zones containing a point
+        """
+        if not (math.isfinite(x) and math.isfinite(y)):
+            return frozenset()
+        cell = (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+        if cell != self._cell:
+            self._cell = cell
+            self._candidates = self._grid.get(cell, ())
+        return frozenset(zone.name for zone in self._candidates if zone.contains(x, y))
+
+    def update(self, pos:list):
+        """
+        update the current position and emit any resulting events
+
+        Args:
+            pos: list
+                [y, x] position, as emitted by the Position widget
+        """
+        current = self.locate(float(pos[1]), float(pos[0]))
+        if current != self.current:
+            previous, self.current = self.current, current
+            for name in previous - current:
+                if name in self._dwell_timers:
+                    self._dwell_timers[name].stop()
+                self.exited.emit(name)
+            for name in current - previous:
+                if name in self._dwell_timers:
+                    self._dwell_timers[name].start()
+                self.entered.emit(name)
+
+    def _on_dwell(self, name:str):
+        if name in self.current:
+            self.dwell.emit(name)
@@ -1,5 +1,5 @@
 import sys
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayout, 
                              QWidget, QDialog, QListWidget, QDialogButtonBox,
                              QHBoxLayout,QComboBox, QLineEdit, QLabel,  QScrollArea, 
@@ -8,7 +8,6 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 from pathlib import Path
-import nidaqmx
 import os
 
 
@@ -100,10 +99,70 @@ class NewSetupDialog(QDialog):
             self.accept()
 
 
+class PortScanThread(QThread):
+    """
+    thread for enumerating the lines and channels available on all
+    national instruments devices. channels are cached by serial number 
+    so a device is only enumerated again if it has been renamed. 
+
+    the thread only reads a copy of the cache. once all devices have been
+    scanned it emits scanned with the channels of every device present,
+    keyed by serial number, which should be used to replace the cache on
+    the gui thread so devices which are no longer present are dropped.
+    when scans overlap only the results of the most recently started 
+    scan should be kept, since an earlier scan may finish last with a 
+    stale view of the devices
+
+    Args:
+        cache: dict
+            cache of channels keyed by device serial number
+    """
+    device_scanned = pyqtSignal(str, list)
+    scanned = pyqtSignal(dict)
+
+    def __init__(self, cache:dict):
+        super(PortScanThread, self).__init__()
+        self.cache = dict(cache)
+
+    @staticmethod
+    def _serial(dev):
+        try:
+            return dev.dev_serial_num
+        except Exception:
+            # some devices (e.g. simulated ones) don't have a serial number
+            return dev.name
+
+    def run(self):
+        from pyBehavior.interfaces import ni
+        if not ni.daqmx_supported():
+            return
+        system = ni.nidaqmx.system.System.local()
+        results = {}
+        for dev in system.devices:
+            serial = self._serial(dev)
+            cached = self.cache.get(serial)
+            if cached is not None and cached[0] == dev.name:
+                channels = cached[1]
+            else:
+                channels = []
+                channels += [i.name for i in dev.di_lines]
+                channels += [i.name for i in dev.do_lines]
+                channels += [i.name for i in dev.ai_physical_chans] 
+                channels += [i.name for i in dev.ao_physical_chans]
+                channels = np.unique(channels).tolist()
+            results[serial] = (dev.name, channels)
+            self.device_scanned.emit(dev.name, channels)
+        self.scanned.emit(results)
+
+
 class Settings(QMainWindow):
     def __init__(self, root_dir):
         super(Settings, self).__init__()
         self.root_dir = root_dir
+        self._port_cache = {}
+        self._port_cache_scan = 0
+        self._scan_threads = []
+        self._n_scans = 0
 
         # create layout elements
         self.layout = QVBoxLayout()
@@ -205,22 +264,46 @@ class Settings(QMainWindow):
         for port, data in self.mapping.T.items():
             self.add_row(port, data['name'], data['DI'])
 
-    def scan_ports(self):
-        from pyBehavior.interfaces.ni import daqmx_supported
-        if daqmx_supported():
-            system = nidaqmx.system.System.local()
-            channels = []
-            for dev in system.devices:
-                channels += [i.name for i in dev.di_lines]
-                channels += [i.name for i in dev.do_lines]
-                channels += [i.name for i in dev.ai_physical_chans] 
-                channels += [i.name for i in dev.ao_physical_chans]
-            return np.unique(channels).tolist()
-        else:
-            return []
+    def scan_ports(self, device_scanned, finished = None):
+        """
+        enumerate the ports on all national instruments devices 
+        in the background
+
+        Args:
+            device_scanned: callable
+                called on the gui thread with the name of each
+                device and a list of its ports as it is scanned
+            finished: callable, optional
+                called on the gui thread once all devices have been scanned
+        """
+        self._n_scans += 1
+        scan = self._n_scans
+        thread = PortScanThread(self._port_cache)
+        thread.device_scanned.connect(device_scanned)
+        thread.scanned.connect(lambda results: self._update_port_cache(scan, results))
+        if finished is not None:
+            thread.finished.connect(finished)
+        thread.finished.connect(lambda: self._scan_threads.remove(thread))
+        self._scan_threads.append(thread)
+        thread.start()
+
+    def _update_port_cache(self, scan:int, results:dict):
+        # the cache is only replaced here, on the gui thread, so it is never
+        # modified concurrently. results from a scan started before the one 
+        # the cache came from are stale and are dropped
+        if scan > self._port_cache_scan:
+            self._port_cache = results
+            self._port_cache_scan = scan
 
     def get_all_ports(self):
-        channels = self.scan_ports()
+        self.get_btn.setEnabled(False)
+        self.scan_ports(lambda dev, channels: self.add_ports(channels),
+                        lambda: self.get_btn.setEnabled(True))
+
+    def add_ports(self, channels:list):
+        """
+        add rows for any ports that aren't already mapped
+        """
         channels = list(filter(lambda x: x not in self.mapping.index.tolist(), channels))
         for port in channels:
             self.mapping.loc[port, 'name'] = ""
@@ -281,11 +364,7 @@ class {dialog.fname}(SetupGUI):
 """
             if dialog.use_ni_cards.isChecked():
                 new_map_file = os.path.join(setup_path, 'port_map.csv')
-                channels = self.scan_ports()
-                new_mapping = pd.DataFrame({"port":channels, 
-                                            "name": [""] * len(channels), 
-                                            "DI": [False] * len(channels)}).set_index("port")
-                new_mapping.to_csv(new_map_file)
+                pd.DataFrame({"port": [], "name": [], "DI": []}).set_index("port").to_csv(new_map_file)
                 starter_code = "from pyBehavior.interfaces.ni import *\n" + starter_code
 
             if dialog.use_rpi.isChecked():
@@ -307,6 +386,28 @@ class {dialog.fname}(SetupGUI):
             if dialog.use_ni_cards.isChecked():
                 self.map_file_select.addItems([dialog.fname])
                 self.map_file_select.setCurrentText(dialog.fname)
+                self._scan_new_map(dialog.fname, new_map_file)
+
+    def _scan_new_map(self, fname:str, map_file:str):
+        """
+        fill a newly created map file with all available ports. the
+        file is updated as each device is scanned, so closing before the
+        scan finishes still leaves the ports found so far, and rows are
+        added if the map is still selected
+        """
+        def device_scanned(dev, channels):
+            if self.map_file_select.currentText() == fname:
+                self.add_ports(channels)
+                self.save()
+            else:
+                mapping = pd.read_csv(map_file).set_index('port')
+                new = [i for i in channels if i not in mapping.index]
+                mapping = pd.concat([mapping, pd.DataFrame({"port": new, 
+                                                            "name": [""] * len(new), 
+                                                            "DI": [False] * len(new)}).set_index("port")])
+                mapping.to_csv(map_file)
+
+        self.scan_ports(device_scanned)
 
 
     def change_map_file(self):
@@ -6,7 +6,7 @@ setup(
     author = "Nathaniel Nyema",
     author_email = "nnyema@caltech.edu",
     description = "A Python based system for controlling rodent behavior experiments", 
-    packages = find_packages(),
+    packages = find_packages(exclude = ['tests', 'tests.*']),
     scripts = ['pyBehavior/main.py'],
     package_data = {"": ["*.csv", "*.mat"]},
     entry_points = {'console_scripts': ['pyBehavior = pyBehavior.main:main']},
@@ -0,0 +1,28 @@
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import pytest
+from PyQt5.QtWidgets import QApplication
+
+
+@pytest.fixture(scope = 'session')
+def qapp():
+    app = QApplication.instance()
+    if app is None:
+        app = QApplication([])
+    return app
+
+
+@pytest.fixture
+def sim_device(qapp):
+    """
+    select the simulated nidaqmx backend and create a device
+    with 16 quiet digital lines, which is removed afterwards
+    """
+    from pyBehavior.interfaces import ni, ni_sim
+    ni.use_backend('sim')
+    ni_sim.reset()
+    dev = ni_sim.add_device('Dev1', n_lines = 16)
+    yield dev
+    ni.do_tasks.close()
+    ni_sim.reset()
@@ -0,0 +1,58 @@
+import time
+import pytest
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication
+
+from pyBehavior.main import PortScanThread, Settings
+
+
+def test_port_scan_lists_channels(sim_device):
+    scanned = []
+    results = []
+    thread = PortScanThread({})
+    thread.device_scanned.connect(lambda dev, channels: scanned.append((dev, channels)), Qt.DirectConnection)
+    thread.scanned.connect(results.append, Qt.DirectConnection)
+    thread.run()
+
+    assert [dev for dev, _ in scanned] == ['Dev1']
+    assert 'Dev1/port0/line0' in scanned[0][1]
+    assert results == [{sim_device.dev_serial_num: ('Dev1', scanned[0][1])}]
+
+
+def test_port_scan_uses_cache(sim_device):
+    cache = {sim_device.dev_serial_num: ('Dev1', ['cached']),
+             'missing': ('Dev2', ['gone'])}
+    results = []
+    thread = PortScanThread(cache)
+    thread.scanned.connect(results.append, Qt.DirectConnection)
+    thread.run()
+    assert results == [{sim_device.dev_serial_num: ('Dev1', ['cached'])}]
+
+    # a renamed device is enumerated again
+    cache = {sim_device.dev_serial_num: ('Old', ['cached'])}
+    results = []
+    thread = PortScanThread(cache)
+    thread.scanned.connect(results.append, Qt.DirectConnection)
+    thread.run()
+    assert results[0][sim_device.dev_serial_num][1] != ['cached']
+
+
+def test_overlapping_scans_keep_latest(sim_device, tmp_path):
+    settings = Settings(str(tmp_path))
+    devices = []
+    settings.scan_ports(lambda dev, channels: devices.append(dev))
+    settings.scan_ports(lambda dev, channels: devices.append(dev))
+    deadline = time.time() + 5
+    while settings._scan_threads and time.time() < deadline:
+        QApplication.processEvents()
+        time.sleep(.01)
+    assert settings._scan_threads == []
+    assert devices == ['Dev1', 'Dev1']
+    assert settings._port_cache_scan == 2
+    assert list(settings._port_cache) == [sim_device.dev_serial_num]
+
+    # a scan started earlier but finishing later doesn't replace the cache
+    settings._update_port_cache(1, {'stale': ('Dev1', [])})
+    assert list(settings._port_cache) == [sim_device.dev_serial_num]
+    settings._update_port_cache(3, {'new': ('Dev1', [])})
+    assert settings._port_cache == {'new': ('Dev1', [])}
@@ -0,0 +1,392 @@
+import logging
+import socket
+import threading
+import time
+import types
+import numpy as np
+import pytest
+from PyQt5.QtCore import Qt
+
+from pyBehavior.interfaces import ni
+
+
+def run_daemon(daemon, duration):
+    thread = threading.Thread(target = daemon.run)
+    thread.start()
+    time.sleep(duration)
+    daemon.stop()
+    thread.join()
+
+
+def record_edges(daemon, name, t0):
+    edges = []
+    chan = daemon.channels.loc[name]
+    chan.rising_edge_time.connect(lambda t: edges.append((True, t - t0)), Qt.DirectConnection)
+    chan.falling_edge_time.connect(lambda t: edges.append((False, t - t0)), Qt.DirectConnection)
+    return edges
+
+
+@pytest.mark.parametrize('mode', ['poll', 'buffered', 'change'])
+def test_di_daemon_edges(sim_device, mode):
+    sim_device.script('Dev1/port0/line0', [(.3, 1), (.5, 0)])
+    daemon = ni.NIDIDaemon(1000, mode = mode)
+    daemon.register('Dev1/port0/line0', 'a')
+    daemon.register('Dev1/port0/line1', 'b')
+    edges = record_edges(daemon, 'a', sim_device.t0)
+    other = record_edges(daemon, 'b', sim_device.t0)
+    run_daemon(daemon, .8)
+
+    assert daemon.status == 1
+    assert [rising for rising, _ in edges] == [True, False]
+    assert edges[0][1] == pytest.approx(.3, abs = .02)
+    assert edges[1][1] == pytest.approx(.5, abs = .02)
+    assert other == []
+    assert not daemon.state['a']
+
+
+def test_di_daemon_state_before_run(sim_device):
+    daemon = ni.NIDIDaemon(mode = 'buffered')
+    assert daemon.state.size == 0
+    daemon.register('Dev1/port0/line0', 'a', min_pulse = .01)
+    assert daemon.state.tolist() == [False]
+    assert daemon.glitches.tolist() == [0]
+
+
+def test_di_daemon_invalid_mode(sim_device):
+    with pytest.raises(ValueError):
+        ni.NIDIDaemon(mode = 'interrupt')
+
+
+def test_min_pulse_filters_glitches(sim_device):
+    # a 1 ms glitch followed by a 200 ms pulse
+    sim_device.script('Dev1/port0/line0', [(.2, 1), (.201, 0), (.3, 1), (.5, 0)])
+    daemon = ni.NIDIDaemon(1000, mode = 'buffered')
+    daemon.register('Dev1/port0/line0', 'a', min_pulse = .01)
+    edges = record_edges(daemon, 'a', sim_device.t0)
+    run_daemon(daemon, .8)
+
+    assert [rising for rising, _ in edges] == [True, False]
+    # accepted edges are timestamped to the start of the new level
+    assert edges[0][1] == pytest.approx(.3, abs = .005)
+    assert edges[1][1] == pytest.approx(.5, abs = .005)
+    # the glitch is filtered out as a single change
+    assert daemon.glitches['a'] == 1
+
+
+def test_debounce_ignores_bounces(sim_device):
+    sim_device.script('Dev1/port0/line0', [(.3, 1), (.302, 0), (.304, 1), (.5, 0), (.503, 1), (.505, 0)])
+    daemon = ni.NIDIDaemon(1000, mode = 'buffered')
+    daemon.register('Dev1/port0/line0', 'a', debounce = .01)
+    edges = record_edges(daemon, 'a', sim_device.t0)
+    run_daemon(daemon, .8)
+
+    assert [rising for rising, _ in edges] == [True, False]
+    assert edges[0][1] == pytest.approx(.3, abs = .005)
+    assert edges[1][1] == pytest.approx(.5, abs = .005)
+    assert daemon.glitches['a'] > 0
+
+
+@pytest.mark.parametrize('mode', ['poll', 'buffered'])
+def test_di_daemon_reads_devices_concurrently(sim_device, mode, monkeypatch):
+    from pyBehavior.interfaces import ni_sim
+    dev2 = ni_sim.add_device('Dev2', n_lines = 16, read_latency = .01)
+    sim_device.read_latency = .01
+    sim_device.script('Dev1/port0/line0', [(.3, 1), (.5, 0)])
+    dev2.script('Dev2/port0/line3', [(.4, 1), (.6, 0)])
+
+    reads = []
+    read = ni_sim.Task.read
+    def recorded_read(task, *args, **kwargs):
+        start = time.time()
+        data = read(task, *args, **kwargs)
+        reads.append((task.lines[0].name.split('/')[0], threading.current_thread().name, start, time.time()))
+        return data
+    monkeypatch.setattr(ni_sim.Task, 'read', recorded_read)
+
+    daemon = ni.NIDIDaemon(1000, mode = mode)
+    daemon.register('Dev1/port0/line0', 'a')
+    daemon.register('Dev2/port0/line3', 'b')
+    a = record_edges(daemon, 'a', sim_device.t0)
+    b = record_edges(daemon, 'b', dev2.t0)
+    run_daemon(daemon, .8)
+
+    assert daemon.status == 1
+    assert daemon._readers is None
+    assert [rising for rising, _ in a] == [True, False]
+    assert [rising for rising, _ in b] == [True, False]
+    assert b[0][1] == pytest.approx(.4, abs = .03)
+    assert b[1][1] == pytest.approx(.6, abs = .03)
+
+    # the second device is read on a reader thread, not the daemon thread
+    threads = {name: {t for n, t, *_ in reads if n == name} for name, *_ in reads}
+    assert len(threads) == 2
+    first, second = sorted(threads)
+    assert not threads[first] & threads[second]
+    assert all(t.startswith('NIDIDaemon') for t in threads[second])
+    if mode == 'poll':
+        # and the slow on demand reads of both devices overlap in time
+        spans = {name: [(s, e) for n, _, s, e in reads if n == name] for name in threads}
+        overlapping = sum(any(s1 < e2 and s2 < e1 for s2, e2 in spans[second]) for s1, e1 in spans[first])
+        assert overlapping > len(spans[first]) / 2
+
+
+def test_do_task_cache_write(sim_device):
+    cache = ni.DOTaskCache()
+    line0, line1 = sim_device.line('Dev1/port0/line0'), sim_device.line('Dev1/port0/line1')
+    cache.write('Dev1/port0/line0', True)
+    cache.write('Dev1/port0/line0', False)
+    assert not line0.value
+    assert line0.n_writes == 2
+    # the task is reused between writes
+    assert len(cache.tasks) == 1
+
+    # a line must be released before it is written as part of a group
+    cache.release('Dev1/port0/line0')
+    cache.write(['Dev1/port0/line0', 'Dev1/port0/line1'], [True, False])
+    assert line0.value and not line1.value
+    cache.close()
+    assert cache.tasks == {}
+
+
+def test_do_task_cache_generate(sim_device):
+    cache = ni.DOTaskCache()
+    line = sim_device.line('Dev1/port0/line2')
+    waveform = ni.pulse_waveform([.05], 0, 1000)
+    cache.generate('Dev1/port0/line2', waveform, 1000)
+    assert not cache.is_done('Dev1/port0/line2')
+    cache.wait_until_done('Dev1/port0/line2')
+    assert cache.is_done('Dev1/port0/line2')
+    # the line holds the last value of the waveform
+    assert not line.value
+    # writing on demand recreates the task
+    cache.write('Dev1/port0/line2', True)
+    assert line.value
+    cache.close()
+
+
+def test_pulse_waveform():
+    waveform = ni.pulse_waveform([.002, .003], .001, 1000)
+    assert waveform.tolist() == [True, True, False, True, True, True, False]
+
+
+class Parent:
+    logger = logging.getLogger('test_ni')
+
+
+@pytest.fixture
+def receiver():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(.2)
+    yield sock
+    sock.close()
+
+
+def receive_all(sock):
+    msgs = []
+    try:
+        while True:
+            msgs.append(sock.recv(65536).decode())
+    except socket.timeout:
+        return msgs
+
+
+def test_eventstring_sender_pulse_per_message(sim_device, receiver):
+    sender = ni.EventstringSender(Parent(), 'ev', 'Dev1/port0/line0', ip = '127.0.0.1',
+                                  port = receiver.getsockname()[1])
+    line = sim_device.line('Dev1/port0/line0')
+    for i in range(5):
+        sender.send(f"msg{i}")
+    assert sender.flush()
+    msgs = receive_all(receiver)
+    sender.close()
+
+    assert len(msgs) == 5
+    assert all(f"msg{i}" in m for i, m in enumerate(msgs))
+    # the line is raised and lowered once per message
+    assert line.n_writes == 10
+    assert not line.value
+
+
+def test_eventstring_sender_survives_card_errors(sim_device, receiver):
+    sender = ni.EventstringSender(Parent(), 'ev', 'Dev1/port9/line0', ip = '127.0.0.1',
+                                  port = receiver.getsockname()[1])
+    sender.send('msg')
+    assert sender.flush()
+    assert sender.sender_thread.isRunning()
+    sender.close()
+
+
+def test_do_task_cache_lines_are_reserved(sim_device):
+    from pyBehavior.interfaces import ni_sim
+    cache = ni.DOTaskCache()
+    cache.write(['Dev1/port0/line0', 'Dev1/port0/line1'], [True, True])
+    # the running group task holds both lines
+    with pytest.raises(ni_sim.DaqError):
+        cache.write(['Dev1/port0/line0', 'Dev1/port0/line2'], [False, False])
+    cache.release(['Dev1/port0/line0', 'Dev1/port0/line1'])
+    cache.write(['Dev1/port0/line0', 'Dev1/port0/line2'], [False, False])
+    cache.close()
+
+
+def test_reward_widgets_share_purge_and_flush(sim_device, qapp):
+    parent = types.SimpleNamespace(log = lambda *args, **kwargs: None)
+    widgets = [ni.NIRewardControl(f"Dev1/port0/line{i}", f"module{i}", parent,
+                                  'Dev1/port1/line0', 'Dev1/port1/line1',
+                                  f"Dev1/port1/line{2 + 2*i}", f"Dev1/port1/line{3 + 2*i}")
+               for i in range(2)]
+    assert sim_device.line('Dev1/port1/line0').value
+    assert sim_device.line('Dev1/port1/line1').value
+    assert not sim_device.line('Dev1/port1/line5').value
+    # the valves are closed and can still be pulsed
+    widgets[1].trigger_reward(.01, sync = True)
+    assert sim_device.line('Dev1/port0/line1').value
+    assert sim_device.line('Dev1/port0/line1').n_writes == 3
+
+
+def test_eventstring_sender_logs_at_info(sim_device, receiver, caplog):
+    sender = ni.EventstringSender(Parent(), 'ev', 'Dev1/port0/line0', ip = '127.0.0.1',
+                                  port = receiver.getsockname()[1])
+    with caplog.at_level(logging.WARNING, logger = 'test_ni'):
+        sender.send('hidden')
+        assert sender.flush()
+    with caplog.at_level(logging.INFO, logger = 'test_ni'):
+        sender.send('shown')
+        assert sender.flush()
+    sender.close()
+    assert [r.getMessage() for r in caplog.records] == ['shown']
+    # records are attributed to the code that sent the message
+    assert caplog.records[0].pathname == __file__
+    assert caplog.records[0].funcName == 'test_eventstring_sender_logs_at_info'
+
+
+@pytest.fixture
+def counter_device(qapp):
+    from pyBehavior.interfaces import ni_sim
+    ni.use_backend('sim')
+    ni_sim.reset()
+    dev = ni_sim.add_device('Dev1', n_lines = 16, n_ctr = 2)
+    yield dev
+    ni_sim.reset()
+
+
+def record_counts(daemon, name):
+    counts = []
+    daemon.counters.loc[name].new_counts.connect(counts.append, Qt.DirectConnection)
+    return counts
+
+
+@pytest.mark.parametrize('mode', ['poll', 'buffered', 'change'])
+def test_counter_counts_edges(counter_device, mode):
+    # three pulses on the default terminal of ctr0 (line 0)
+    counter_device.script('Dev1/port0/line0', [(.2, 1), (.21, 0), (.3, 1), (.31, 0), (.4, 1), (.41, 0)])
+    daemon = ni.NIDIDaemon(1000, mode = mode, counter_rate = 100)
+    daemon.register('Dev1/port0/line2', 'a')
+    daemon.register_counter('Dev1/ctr0', 'licks')
+    counts = record_counts(daemon, 'licks')
+    run_daemon(daemon, .6)
+    assert daemon.status == 1
+    assert sum(counts) == 3
+    assert len(counts) == 3
+
+
+def test_counter_without_lines_and_terminal(counter_device):
+    # PFI1 is mapped to port1/line1 by the simulated backend
+    counter_device.script('Dev1/port1/line1', [(.2, 1), (.3, 0), (.4, 1), (.5, 0)])
+    daemon = ni.NIDIDaemon(1000, counter_rate = 100)
+    daemon.register_counter('Dev1/ctr1', 'ttl', terminal = '/Dev1/PFI1', edge = 'falling')
+    counts = record_counts(daemon, 'ttl')
+    run_daemon(daemon, .7)
+    assert daemon.status == 1
+    assert sum(counts) == 2
+
+
+def test_invalid_counter(counter_device):
+    from pyBehavior.interfaces import ni_sim
+    daemon = ni.NIDIDaemon()
+    with pytest.raises(ni_sim.DaqError):
+        daemon.register_counter('Dev1/ctr5', 'licks')
+    assert daemon.counter_tasks == {}
+
+
+def test_daemon_subclass_must_read_blocks():
+    class Daemon(ni.NIDaemon):
+        pass
+    with pytest.raises(TypeError):
+        Daemon()
+
+
+@pytest.fixture
+def ai_device(qapp):
+    from pyBehavior.interfaces import ni_sim
+    ni.use_backend('sim')
+    ni_sim.reset()
+    dev = ni_sim.add_device('Dev1', n_lines = 8, n_ai = 2, ai_levels = (0., 5.), ai_noise = .01)
+    yield dev
+    ni_sim.reset()
+
+
+def test_ai_daemon_threshold_crossings(ai_device):
+    ai_device.script('Dev1/ai0', [(.3, 1), (.5, 0)])
+    daemon = ni.NIAIDaemon(1000, window = 1.)
+    daemon.register('Dev1/ai0', 'beam', high = 2.5)
+    daemon.register('Dev1/ai1', 'quiet', high = 2.5)
+    edges = record_edges(daemon, 'beam', ai_device.t0)
+    other = record_edges(daemon, 'quiet', ai_device.t0)
+    run_daemon(daemon, .8)
+
+    assert daemon.status == 1
+    assert [rising for rising, _ in edges] == [True, False]
+    assert edges[0][1] == pytest.approx(.3, abs = .01)
+    assert edges[1][1] == pytest.approx(.5, abs = .01)
+    assert other == []
+    window = daemon.get_window('beam')
+    assert 500 < window.size <= 1000
+    assert window.max() == pytest.approx(5, abs = .1)
+
+
+def test_ai_daemon_hysteresis(ai_device):
+    daemon = ni.NIAIDaemon(1000)
+    daemon.register('Dev1/ai0', 'a', high = 3., low = 1.)
+    samples = np.array([[0., 2., 3.5, 2., 1.5, 0.5, 2., 3.]])
+    daemon._read_devices = lambda read: [samples]
+    # the channel only goes low again once it drops to the low threshold
+    assert daemon.read_block()[0].tolist() == [False, False, True, True, True, False, False, True]
+    with pytest.raises(ValueError):
+        daemon.register('Dev1/ai1', 'b', high = 1., low = 2.)
+
+
+def test_eventstring_codes(sim_device, receiver, tmp_path):
+    code_lines = [f"Dev1/port0/line{i}" for i in range(1, 4)]
+    sender = ni.EventstringSender(Parent(), 'ev', 'Dev1/port0/line0', ip = '127.0.0.1',
+                                  port = receiver.getsockname()[1], code_lines = code_lines)
+    sender.set_session_dir(tmp_path)
+    sender.set_code('reward #', 5)
+    with pytest.raises(ValueError):
+        sender.set_code('lick', 5)
+    with pytest.raises(ValueError):
+        sender.set_code('lick', 8)
+    for msg in ['reward 0.2', 'lick', 'reward 0.1']:
+        sender.send(msg)
+    assert sender.flush()
+    sender.close()
+
+    # numbers are ignored so rewards of different amounts share a code
+    assert sender.codes == {'reward #': 5, 'lick': 1}
+    table = (tmp_path/'ev_event_codes.csv').read_text().splitlines()
+    assert table == ['code,event', '1,lick', '5,reward #']
+    assert len(receive_all(receiver)) == 3
+
+
+def test_eventstring_code_waveform(sim_device):
+    sender = ni.EventstringSender(Parent(), 'ev', 'Dev1/port0/line0', ip = '127.0.0.1', port = 9,
+                                  code_lines = ['Dev1/port0/line1', 'Dev1/port0/line2'],
+                                  strobe_width = 2e-4, hw_rate = 10000)
+    waveform = sender._code_waveform([1, 2])
+    sender.close()
+    # each code is set up a sample before its 2 sample strobe and held a sample after
+    assert waveform.astype(int).tolist() == [
+        [1, 1, 1, 1, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 1, 1, 1, 1, 0],
+        [0, 1, 1, 0, 0, 1, 1, 0, 0],
+    ]
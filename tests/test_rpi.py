@@ -0,0 +1,474 @@
+import gc
+import logging
+import os
+import socket
+import threading
+import time
+import types
+import pytest
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication
+
+from pyBehavior.interfaces.rpi import remote, sim
+
+
+def wait_for(cond, timeout = 5.):
+    deadline = time.time() + timeout
+    while not cond():
+        if time.time() > deadline:
+            return False
+        time.sleep(.005)
+    return True
+
+
+@pytest.fixture
+def server():
+    server = sim.SimServer(modules = ['module1', 'module2'], seed = 0)
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_lick_stream_receives_licks(qapp, server):
+    stream = remote.LickStream(server.host, server.stream_port, reconnect_interval = .1)
+    connected = []
+    licks = []
+    stream.connected.connect(connected.append, Qt.DirectConnection)
+    stream.licks.connect(lambda module, n, t: licks.append((module, n, t)), Qt.DirectConnection)
+    stream.start()
+    try:
+        assert wait_for(lambda: connected == [True])
+        # the subscription is registered once the server reads it
+        assert wait_for(lambda: len(server._streams) == 1)
+        with server._lock:
+            server.modules['module2'].lick_rate = 50
+            server.modules['module2'].next_lick = time.time()
+        assert wait_for(lambda: len(licks) >= 5)
+    finally:
+        stream.stop()
+        stream.wait()
+
+    assert connected == [True, False]
+    assert {module for module, _, _ in licks} == {'module2'}
+    assert all(n == 1 for _, n, _ in licks)
+    times = [t for _, _, t in licks]
+    assert times == server.modules['module2'].lick_times[:len(times)]
+
+
+def test_lick_stream_reconnects(qapp):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    stream = remote.LickStream('127.0.0.1', port, reconnect_interval = .05)
+    connected = []
+    stream.connected.connect(connected.append, Qt.DirectConnection)
+    stream.start()
+    try:
+        # nothing is listening yet
+        time.sleep(.2)
+        assert connected == []
+        server = sim.SimServer(stream_port = port)
+        server.start()
+        try:
+            assert wait_for(lambda: connected == [True])
+        finally:
+            server.stop()
+    finally:
+        stream.stop()
+        stream.wait()
+    assert connected[:2] == [True, False]
+    assert connected[-1] is False
+
+
+def test_lick_stream_ignores_invalid_messages(qapp, capsys):
+    stream = remote.LickStream('127.0.0.1', 0)
+    licks = []
+    stream.licks.connect(lambda module, n, t: licks.append((module, n, t)), Qt.DirectConnection)
+    stream._dispatch('{"module": "module1", "licks": 2, "time": 1.5}\n')
+    stream._dispatch('{"module": "module1"}\n')
+    stream._dispatch('not json\n')
+    assert licks == [('module1', 2, 1.5)]
+    assert capsys.readouterr().out.count("invalid message") == 2
+
+
+@pytest.fixture
+def client(server):
+    client = sim.SimClient(server.host, server.port)
+    client.new_channel('run')
+    yield client
+    client.close()
+
+
+def reject_lists(server):
+    get = server.get
+    def _get(expr):
+        if expr.startswith('['):
+            raise SyntaxError("list expressions are not supported")
+        return get(expr)
+    server.get = _get
+
+
+def test_get_many_batches(server, client):
+    exprs = ['auto_fill', "modules['module1'].LED.on", "pumps['pump1'].speed"]
+    n = server.n_requests
+    assert remote.get_many(client, exprs) == [False, False, 1000.]
+    assert server.n_requests == n + 1
+    assert remote._list_exprs[client]
+
+
+def test_get_many_falls_back(server, client, caplog):
+    reject_lists(server)
+    exprs = ['auto_fill', "modules['module1'].LED.on"]
+    with caplog.at_level(logging.WARNING, logger = remote.__name__):
+        assert remote.get_many(client, exprs) == [False, False]
+        n = server.n_requests
+        assert remote.get_many(client, exprs) == [False, False]
+    # the list expression isn't tried again and the fallback is only logged once
+    assert server.n_requests == n + 2
+    assert len([r for r in caplog.records if 'batched' in r.getMessage()]) == 1
+
+    # state is kept per client and dropped with the client
+    other = sim.SimClient(server.host, server.port)
+    assert other not in remote._list_exprs
+    remote.get_many(other, exprs, channel = 'default')
+    assert remote._list_exprs[other] is False
+    n = len(remote._list_exprs)
+    other.close()
+    del other
+    gc.collect()
+    assert len(remote._list_exprs) == n - 1
+
+
+def test_get_many_errors_are_traced_to_attributes(server, client):
+    with pytest.raises(RuntimeError, match = "KeyError"):
+        remote.get_many(client, ['auto_fill', "modules['missing'].LED.on"])
+
+
+def test_poller_batches_due_attributes(qapp, server, client):
+    try:
+        led = remote.RemotePoller.watch(client, "modules['module1'].LED.on", .02)
+        valve = remote.RemotePoller.watch(client, "modules['module1'].valve.is_open", .02)
+        assert remote.RemotePoller.watch(client, "modules['module1'].LED.on", .01) is led
+        assert led.interval == .01
+        changes = []
+        led.changed.connect(lambda v: changes.append(('led', v)), Qt.DirectConnection)
+        valve.changed.connect(lambda v: changes.append(('valve', v)), Qt.DirectConnection)
+
+        assert wait_for(lambda: led.value is not None and valve.value is not None)
+        with server._lock:
+            server.modules['module1'].LED.on = True
+        assert wait_for(lambda: ('led', True) in changes)
+        time.sleep(.1)
+        # values are only emitted when they change
+        assert changes.count(('led', True)) == 1
+        assert ('valve', True) not in changes
+    finally:
+        remote.RemotePoller.stop_all()
+
+
+@pytest.mark.parametrize('batched', [True, False])
+def test_snapshot_setup(server, client, batched):
+    if not batched:
+        reject_lists(server)
+    exprs = set(remote.RemoteSnapshot.global_attrs)
+    exprs.update(remote.PumpConfig.remote_attrs('pump1'))
+    for module in ['module1', 'module2']:
+        exprs.update(remote.RPIRewardControl.remote_attrs(module))
+
+    n = server.n_requests
+    snapshot = remote.RemoteSnapshot(client)
+    remote.RemoteSnapshot._snapshots[id(client)] = snapshot
+    try:
+        assert remote.snapshot_setup(client, ['module1', 'module2'], ['pump1']) is snapshot
+        # one round trip, or one per attribute with the fallback
+        assert server.n_requests - n == (1 if batched else 1 + len(exprs))
+        assert set(snapshot.values) == exprs
+
+        # fresh values are read from the snapshot
+        n = server.n_requests
+        assert snapshot.get("pumps['pump1'].syringe.syringeType") == 'BD5mL'
+        assert snapshot.get("modules['module2'].pump.name") == 'pump1'
+        assert server.n_requests == n
+
+        # stale values are fetched again
+        snapshot.max_age = 0
+        with server._lock:
+            server.modules['module1'].LED.on = True
+        assert snapshot.get("modules['module1'].LED.on") is True
+        assert server.n_requests == n + 1
+    finally:
+        remote.RemoteSnapshot._snapshots.pop(id(client))
+
+
+def process_until(cond, timeout = 5.):
+    deadline = time.time() + timeout
+    while not cond():
+        if time.time() > deadline:
+            return False
+        QApplication.processEvents()
+        time.sleep(.005)
+    return True
+
+
+@pytest.fixture
+def commands(qapp, client):
+    commands = remote.RemoteCommands(client)
+    yield commands
+    commands.stop()
+
+
+def test_commands_return_futures(commands, client, server):
+    assert 'async_run' in client.channels
+    results = []
+    future = commands.run_command('toggle_LED', {'module': 'module1', 'on': True},
+                                  callback = lambda status: results.append((status, threading.current_thread())))
+    assert future.result(5) == 'SUCCESS\n'
+    assert server.modules['module1'].LED.on
+    # callbacks run on the gui thread
+    assert process_until(lambda: len(results) == 1)
+    assert results == [('SUCCESS\n', threading.main_thread())]
+
+    future = commands.get("modules['module1'].LED.on", callback = results.append)
+    assert future.result(5) is True
+    assert process_until(lambda: len(results) == 2)
+
+
+def test_commands_report_failures(commands):
+    failed = []
+    finished = []
+    commands.command_failed.connect(lambda name, msg: failed.append(name), Qt.DirectConnection)
+    future = commands.run_command('toggle_LED', {'module': 'missing', 'on': True},
+                                  finished = lambda: finished.append(True))
+    with pytest.raises(RuntimeError, match = "KeyError"):
+        future.result(5)
+    assert process_until(lambda: finished == [True])
+    assert failed == ['toggle_LED']
+
+
+def test_commands_need_open_channels(commands, client):
+    with pytest.raises(RuntimeError, match = "open_channel"):
+        commands.submit(commands.get_async('auto_fill', channel = 'pump1')).result(5)
+    # run_command and get open the channel on the calling thread
+    assert commands.get('auto_fill', channel = 'pump1').result(5) is False
+    assert 'async_pump1' in client.channels
+
+
+def test_commands_run_in_order_on_a_channel(commands, server):
+    server.latency = .005
+    server.fill_time = .5
+    futures = [commands.run_command('update_post_delay', {'module': 'module1', 'post_delay': i})
+               for i in range(10)]
+    slow = commands.run_command('fill_lines', {'modules': None}, channel = 'pump1')
+    # a long command on one channel doesn't hold up the others
+    assert futures[-1].result(5) == 'SUCCESS\n'
+    assert not slow.done()
+    assert server.modules['module1'].post_delay == 9
+    assert slow.result(5) == 'SUCCESS\n'
+
+
+def test_pump_setters_return_immediately(commands, client, server):
+    remote.RemoteCommands._layers[id(client)] = commands
+    try:
+        pump = remote.PumpConfig(client, 'pump1', None)
+        future = pump.set_flow_rate(.5)
+        assert isinstance(future, remote.Future)
+        future.result(5)
+        assert server.pumps['pump1'].flow_rate == .5
+        assert process_until(lambda: pump.flow_rate.text() == '0.5')
+
+        server.fill_time = .1
+        future = pump.fill_lines()
+        assert not pump.fill_btn.isEnabled()
+        future.result(5)
+        assert process_until(pump.fill_btn.isEnabled)
+    finally:
+        remote.RemoteCommands._layers.pop(id(client))
+        remote.RemotePoller.stop_all()
+
+
+@pytest.fixture
+def reward_widget(commands, client):
+    remote.RemoteCommands._layers[id(client)] = commands
+    parent = types.SimpleNamespace(logger = logging.getLogger('test_rpi'), log = lambda msg: None)
+    widgets = []
+    def make(module = 'module1', **kwargs):
+        widget = remote.RPIRewardControl(client, module, parent, **kwargs)
+        widgets.append(widget)
+        return widget
+    yield make
+    remote.RemoteCommands._layers.pop(id(client))
+    remote.RemoteSnapshot._snapshots.pop(id(client), None)
+    remote.RemotePoller.stop_all()
+
+
+def test_pipelined_rewards_are_acknowledged(reward_widget, server):
+    widget = reward_widget(pipelined = True)
+    server.latency = .02
+    futures = [widget.trigger_reward(.1) for _ in range(3)]
+    assert len(widget.pending) == 3
+    # the widget is only updated once the pi acknowledges the reward
+    assert widget.amt_disp.text() == '0'
+    assert process_until(lambda: len(widget.pending) == 0)
+    assert all(f.result() == 'SUCCESS\n' for f in futures)
+    assert float(widget.amt_disp.text()) == pytest.approx(.3)
+    assert server.pumps['pump1'].position == pytest.approx(.3)
+
+
+def test_pipelined_failures_are_reported_once(reward_widget, commands, server, caplog):
+    widget = reward_widget(pipelined = True)
+    run_command = server.run_command
+    def fail_tones(cmd, args):
+        if cmd == 'play_tone':
+            raise RuntimeError("speaker unplugged")
+        return run_command(cmd, args)
+    server.run_command = fail_tones
+
+    widget_failed = []
+    layer_failed = []
+    widget.command_failed.connect(lambda seq, cmd, msg: widget_failed.append((seq, cmd)), Qt.DirectConnection)
+    commands.command_failed.connect(lambda name, msg: layer_failed.append(name), Qt.DirectConnection)
+    with caplog.at_level(logging.ERROR):
+        widget.trigger_reward(.1)
+        widget.play_tone(800, 1, .1)
+        assert process_until(lambda: len(widget.pending) == 0)
+    assert widget_failed == [(1, 'play_tone')]
+    assert layer_failed == []
+    errors = [r for r in caplog.records if 'speaker unplugged' in r.getMessage()]
+    assert len(errors) == 1
+    assert errors[0].name == 'test_rpi'
+    assert float(widget.amt_disp.text()) == pytest.approx(.1)
+
+
+def test_toggle_led(reward_widget, server):
+    widget = reward_widget()
+    future = widget.toggle_led()
+    assert future.result(5) is True
+    assert server.modules['module1'].LED.on
+    assert process_until(widget.led_btn.isChecked)
+
+    # in pipelined mode the led is toggled from the last commanded state
+    widget = reward_widget('module2', pipelined = True)
+    assert not widget._led_on
+    server.latency = .02
+    widget.toggle_led()
+    assert widget.led_btn.isChecked()
+    # a stale polled value doesn't override a pending command
+    widget._on_led_polled(False)
+    assert widget.led_btn.isChecked()
+    widget.toggle_led().result(5)
+    assert process_until(lambda: len(widget.pending) == 0)
+    assert not widget.led_btn.isChecked()
+    assert not server.modules['module2'].LED.on
+    assert server.modules['module1'].LED.on
+
+
+def recorded_commands(server):
+    with open(server.data_path) as f:
+        rows = [line.split(',', 2) for line in f.read().splitlines()]
+    return [(float(t), cmd) for t, cmd, _ in rows if cmd not in ('record', 'run_action')]
+
+
+STEPS = [(0, 'toggle_LED', {'on': True}),
+         (.1, 'play_tone', {'freq': 800, 'dur': .1, 'volume': 1}),
+         (.2, 'trigger_reward', {'amount': .2})]
+
+
+def test_server_runs_actions(server, client):
+    client.run_command('record', {})
+    steps = [{'at': t, 'command': cmd, 'args': {'module': 'module1', **args}} for t, cmd, args in STEPS]
+    t = time.time()
+    status = client.run_command('run_action', {'module': 'module1', 'name': 'trial', 'steps': steps})
+    # the action only succeeds once all steps are done
+    assert status == 'SUCCESS\n'
+    assert time.time() - t >= .2
+    log = recorded_commands(server)
+    assert [cmd for _, cmd in log] == ['toggle_LED', 'play_tone', 'trigger_reward']
+    assert [lt - log[0][0] for lt, _ in log] == pytest.approx([0, .1, .2], abs = .02)
+
+    steps[0]['args']['module'] = 'missing'
+    status = client.run_command('run_action', {'module': 'module1', 'name': 'trial', 'steps': steps})
+    assert status.startswith('ERROR: toggle_LED')
+
+
+def test_action_steps_are_not_chained(reward_widget, server, client):
+    widget = reward_widget()
+    widget.define_action('trial', STEPS)
+    client.run_command('record', {})
+    # with replies slower than the spacing of the steps, steps sent
+    # once the previous one is acknowledged would drift late
+    server.latency = .15
+    widget.run_action('trial').result(5)
+    log = recorded_commands(server)
+    assert [cmd for _, cmd in log] == ['toggle_LED', 'play_tone', 'trigger_reward']
+    assert [lt - log[0][0] for lt, _ in log] == pytest.approx([0, .1, .2], abs = .03)
+    assert process_until(lambda: widget.amt_disp.text() != '0')
+    assert float(widget.amt_disp.text()) == pytest.approx(.2)
+
+
+def test_action_on_pi(reward_widget, server, client):
+    widget = reward_widget(pipelined = True)
+    widget.define_action('trial', STEPS)
+    client.run_command('record', {})
+    future = widget.run_action('trial', on_pi = True)
+    assert future.result(5) == 'SUCCESS\n'
+    log = recorded_commands(server)
+    assert [lt - log[0][0] for lt, _ in log] == pytest.approx([0, .1, .2], abs = .02)
+    assert process_until(lambda: len(widget.pending) == 0)
+    assert float(widget.amt_disp.text()) == pytest.approx(.2)
+    assert float(widget.npulse.text()) == 1
+
+
+def test_server_gets_attributes(server, client):
+    assert client.get("modules['module1'].valve.is_open") is False
+    assert client.get("[auto_fill, (pumps['pump1'].speed, recording)]") == [False, [1000., False]]
+    assert client.get("modules['module2'].pump.name") == 'pump1'
+
+
+@pytest.mark.parametrize('expr', ["modules['module1'].__class__", "modules['module1']._draw",
+                                  "len(modules)", "auto_fill or True", "modules[auto_fill]",
+                                  "[m for m in modules]", "__import__('os')", "missing"])
+def test_server_rejects_expressions(server, client, expr):
+    with pytest.raises((ValueError, NameError)):
+        server.get(expr)
+    with pytest.raises(RuntimeError, match = "^ERROR"):
+        client.get(expr)
+    # the connection survives the error
+    assert client.get('auto_fill') is False
+
+
+def test_server_rejects_unknown_commands(server, client):
+    assert client.run_command('self_destruct', {}).startswith("ERROR: ValueError")
+    assert client.run_command('toggle_LED', {'module': 'module1', 'on': True}) == 'SUCCESS\n'
+
+
+def test_server_downloads_over_scp(tmp_path):
+    import paramiko
+    from scp import SCPClient
+    server = sim.SimServer(ssh = True)
+    server.start()
+    try:
+        client = sim.SimClient(server.host, server.port)
+        client.run_command('record', {})
+        client.run_command('toggle_LED', {'module': 'module1', 'on': True})
+        data_path = client.get('data_path')
+        client.close()
+
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(server.host, port = server.ssh.port, username = 'pi', key_filename = server.ssh.key_file,
+                    look_for_keys = False, allow_agent = False)
+        try:
+            scp = SCPClient(ssh.get_transport())
+            scp.get(data_path, tmp_path.as_posix())
+            with open(data_path) as f:
+                assert (tmp_path / 'ratBerryPi_log.csv').read_text() == f.read()
+            # only files under the data directory are served
+            with pytest.raises(Exception, match = "No such file"):
+                scp.get('/etc/hostname', tmp_path.as_posix())
+        finally:
+            ssh.close()
+    finally:
+        server.stop()
+    assert not os.path.exists(server.data_dir)
+    assert not os.path.exists(server.ssh.key_file)
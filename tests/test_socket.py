@@ -0,0 +1,302 @@
+import socket
+import time
+import uuid
+import numpy as np
+import pytest
+from PyQt5.QtCore import Qt
+
+from pyBehavior.interfaces.socket import (ConstantVelocityKalman, PositionRing, PositionSource, PositionThread,
+                                          pack_position, position_header)
+
+
+def test_pack_position_decodes():
+    keypoints = np.arange(6, dtype = np.float32).reshape(2, 3)
+    packet = pack_position(7, 1.5, keypoints)
+    header = np.frombuffer(packet, dtype = position_header, count = 1)[0]
+    assert header['frame'] == 7 and header['timestamp'] == 1.5 and header['n_keypoints'] == 2
+    decoded = np.frombuffer(packet, dtype = '<f4', offset = position_header.itemsize).reshape(2, 3)
+    assert (decoded == keypoints).all()
+
+
+@pytest.fixture
+def position_thread(qapp):
+    thread = PositionThread(0)
+    yield thread
+    thread.sock.close()
+
+
+@pytest.fixture
+def sender():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    yield sock
+    sock.close()
+
+
+def send(thread, sock, *packets):
+    address = ('127.0.0.1', thread.sock.getsockname()[1])
+    for packet in packets:
+        sock.sendto(packet, address)
+    # datagrams on the loopback interface arrive almost immediately
+    time.sleep(.05)
+    return sock.getsockname()
+
+
+def test_drain_decodes_binary_packets(position_thread, sender):
+    packets = [pack_position(i, 10. + i, np.full((2, 3), i)) for i in range(1, 4)]
+    address = send(position_thread, sender, *packets)
+    position_thread._drain(position_thread.sock)
+
+    source = position_thread.sources[address]
+    # all packets were received but only the newest frame is staged
+    assert source.received == 3
+    assert source.dropped == 2
+    assert (source.frame, source.timestamp) == (3, 13.)
+    assert (source._keypoints == 3).all()
+    # the socket is left drained
+    with pytest.raises(BlockingIOError):
+        position_thread.sock.recv(1)
+
+    # frames with a different number of keypoints are decoded through their own view
+    send(position_thread, sender, pack_position(4, 14., np.arange(12).reshape(4, 3)))
+    position_thread._drain(position_thread.sock)
+    assert source._keypoints.tolist() == np.arange(12).reshape(4, 3).tolist()
+
+
+def test_drain_decodes_text_packets(position_thread, sender):
+    address = send(position_thread, sender, str([[[(1., 2.), .5], [(3., 4.), 1.]]]).encode())
+    position_thread._drain(position_thread.sock)
+    source = position_thread.sources[address]
+    assert source.frame is None and source.timestamp is None
+    assert source._keypoints.tolist() == [[1, 2, .5], [3, 4, 1]]
+
+    positions = []
+    position_thread.new_position.connect(positions.append, Qt.DirectConnection)
+    position_thread._emit()
+    # positions are the confidence weighted mean keypoint as [y, x]
+    expected = np.mean([[1, 2], [3, 4]], axis = 0)[::-1]
+    assert positions == [pytest.approx(expected.tolist())]
+
+
+def test_drain_skips_invalid_packets(position_thread, sender, capsys):
+    truncated = pack_position(1, 1., np.ones((4, 3)))[:-12]
+    address = send(position_thread, sender, b'not a position', truncated, pack_position(2, 2., np.ones((1, 3))))
+    position_thread._drain(position_thread.sock)
+    assert capsys.readouterr().out.count("invalid position packet") == 2
+    source = position_thread.sources[address]
+    assert source.received == 1
+    assert source.frame == 2
+
+
+def test_source_frames_out_of_order_and_reset():
+    source = PositionSource(('host', 1))
+    keypoints = np.ones((2, 3), dtype = np.float32)
+    now = time.time()
+    for frame in range(500, 505):
+        source.stage(frame, now + frame * .01, keypoints, now)
+    # a late packet is dropped
+    source.stage(502, now + 5.02, keypoints, now)
+    assert source.out_of_order == 1
+    assert source.frame == 504
+    # a restarted tracker starts counting frames again
+    source.stage(0, now + 10, keypoints, now)
+    assert source.resets == 1
+    assert source.frame == 0
+    source.stage(3, now + 10.03, keypoints, now)
+    assert source.lost == 2
+
+
+def test_positions_come_from_one_source(position_thread, sender):
+    other = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    other.bind(('127.0.0.1', 0))
+    try:
+        positions = []
+        by_source = []
+        position_thread.new_position.connect(positions.append, Qt.DirectConnection)
+        position_thread.source_position.connect(lambda address, pos: by_source.append(address), Qt.DirectConnection)
+
+        first = send(position_thread, sender, pack_position(1, 1., np.array([[1, 2, 1]])))
+        position_thread._drain(position_thread.sock)
+        position_thread._emit()
+        second = send(position_thread, other, pack_position(1, 1., np.array([[5, 6, 1]])))
+        position_thread._drain(position_thread.sock)
+        position_thread._emit()
+        # every source is emitted with its address but new_position
+        # only carries the first source packets were received from
+        assert sorted(by_source) == sorted([first, second])
+        assert positions == [[2, 1]]
+        assert position_thread.active.address == first
+
+        # once the active source goes quiet the most recent one is used
+        position_thread.source_timeout = .05
+        time.sleep(.1)
+        send(position_thread, other, pack_position(2, 2., np.array([[5, 6, 1]])))
+        position_thread._drain(position_thread.sock)
+        position_thread._emit()
+        assert position_thread.active.address == second
+        assert positions[-1] == [6, 5]
+    finally:
+        other.close()
+
+
+def test_explicit_source(qapp, sender):
+    thread = PositionThread(0, source = '127.0.0.2')
+    try:
+        send(thread, sender, pack_position(1, 1., np.ones((1, 3))))
+        thread._drain(thread.sock)
+        assert thread._select(time.time()) is None
+        thread.source = '127.0.0.1'
+        assert thread._select(time.time()).address == sender.getsockname()
+    finally:
+        thread.sock.close()
+
+
+def test_kalman_tracks_constant_velocity():
+    kalman = ConstantVelocityKalman(process_noise = 1, measurement_noise = 1e-4)
+    for i in range(50):
+        kalman.update(np.array([10. * i * .01, -5. * i * .01]), i * .01)
+    assert kalman.x[2:] == pytest.approx([10, -5], rel = 1e-2)
+    assert kalman.predict(.1) == pytest.approx(kalman.position + [1, -.5], abs = 1e-2)
+
+
+def test_kalman_ignores_missing_measurements():
+    kalman = ConstantVelocityKalman()
+    kalman.update(np.array([1., 1.]), 0.)
+    kalman.update(np.array([np.nan, 1.]), .01)
+    assert np.isfinite(kalman.x).all()
+    kalman.reset()
+    assert kalman.t is None
+
+
+def test_source_weighted_position():
+    source = PositionSource(('host', 1), window = 2, kalman = ConstantVelocityKalman())
+    keypoints = np.array([[0, 0, 1], [10, 10, 3], [np.nan, np.nan, 0]], dtype = np.float32)
+    now = time.time()
+    source.stage(0, now, keypoints, now)
+    assert source.update()
+    # the kalman filter is fed the confidence weighted mean of the detected keypoints
+    assert source.kalman.position == pytest.approx([7.5, 7.5])
+
+
+def test_source_clock_detection():
+    keypoints = np.ones((1, 3), dtype = np.float32)
+    now = time.time()
+    shared = PositionSource(('host', 1))
+    shared.stage(0, now - .02, keypoints, now)
+    shared.update()
+    shared.emitted_at(now + .001)
+    assert shared.shared_clock
+    assert shared.latency == pytest.approx(.021, abs = 1e-6)
+    # the tracker's clock is far behind ours
+    other = PositionSource(('host', 2))
+    other.stage(0, now - 100, keypoints, now)
+    other.update()
+    other.emitted_at(now + .001)
+    assert not other.shared_clock
+    assert other.latency == pytest.approx(.001, abs = 1e-6)
+
+
+def test_predicted_positions(qapp, sender):
+    thread = PositionThread(0, kalman = True, horizon = 'auto', lead = .05, max_horizon = .2,
+                            process_noise = 1, measurement_noise = 1e-4)
+    try:
+        smoothed = []
+        predicted = []
+        thread.smoothed_position.connect(smoothed.append, Qt.DirectConnection)
+        thread.predicted_position.connect(predicted.append, Qt.DirectConnection)
+        t0 = time.time()
+        # moving at 100 px/s along x, timestamped on this computer's clock
+        for i in range(20):
+            t = time.time()
+            send(thread, sender, pack_position(i, t, np.array([[100 * (t - t0), 0, 1]])))
+            thread._drain(thread.sock)
+            thread._emit()
+        source = thread.active
+        assert source.shared_clock
+        horizon = thread.get_horizon(source)
+        assert horizon == pytest.approx(min(source.latency + .05, .2))
+        # positions are [y, x] and the prediction leads along x
+        assert smoothed[-1] == pytest.approx([0, 100 * (t - t0)], abs = .5)
+        assert predicted[-1][1] - smoothed[-1][1] == pytest.approx(100 * horizon, rel = .1)
+        thread.horizon = 10
+        assert thread.get_horizon(source) == 10
+    finally:
+        thread.sock.close()
+
+
+@pytest.fixture
+def ring_name():
+    return f"pbtest_{uuid.uuid4().hex[:8]}"
+
+
+def test_ring_write_read(ring_name):
+    ring = PositionRing(ring_name, n_keypoints = 2, capacity = 4, create = True)
+    try:
+        out = np.zeros((2, 3), dtype = np.float32)
+        for i in range(6):
+            ring.write(i, float(i), np.full((2, 3), i))
+        assert ring.seq == 6
+        assert ring.read(6, out) == (5, 5.)
+        assert (out == 5).all()
+        # frame 1 has been overwritten
+        assert ring.read(1, out) is None
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_ring_reattach(ring_name, qapp):
+    ring = PositionRing(ring_name, n_keypoints = 1, create = True)
+    thread = PositionThread(0, shm = ring_name)
+    thread.sock.close()
+    try:
+        thread._poll_ring()
+        ring.write(100, time.time(), np.array([[1, 2, 1]]))
+        thread._poll_ring()
+        assert thread.ring.instance == ring.instance
+        # the tracker restarts and recreates the ring
+        ring.close()
+        ring.unlink()
+        ring = PositionRing(ring_name, n_keypoints = 1, create = True)
+        ring.write(0, time.time(), np.array([[3, 4, 1]]))
+        thread._ring_checked = -np.inf
+        thread._poll_ring()
+        assert thread.ring.instance == ring.instance
+        thread._poll_ring()
+        source = thread.sources[('shm', ring_name)]
+        assert source.frame == 0
+        assert source.resets == 1
+    finally:
+        if thread.ring is not None:
+            thread.ring.close()
+        ring.close()
+        ring.unlink()
+
+
+def test_thread_reads_newest_ring_frame(ring_name, qapp):
+    ring = PositionRing(ring_name, n_keypoints = 1, create = True)
+    thread = PositionThread(0, shm = ring_name, poll_interval = 1e-3)
+    positions = []
+    thread.new_position.connect(positions.append, Qt.DirectConnection)
+    thread.start()
+    try:
+        # frames written before the thread attaches aren't read
+        deadline = time.time() + 2
+        while thread.ring is None and time.time() < deadline:
+            time.sleep(.01)
+        for i in range(5):
+            ring.write(i, time.time(), np.array([[i, 2 * i, 1]]))
+        while (len(positions) == 0 or positions[-1] != [8, 4]) and time.time() < deadline:
+            time.sleep(.01)
+    finally:
+        thread.stop()
+        thread.wait()
+        thread.sock.close()
+        ring.close()
+        ring.unlink()
+    # frames written between polls are skipped rather than queued
+    source = thread.sources[('shm', ring_name)]
+    assert positions[-1] == [8, 4]
+    assert thread.frame == 4
+    assert source.received <= 5
+    assert source.shared_clock
@@ -0,0 +1,94 @@
+import pytest
+from PyQt5.QtCore import QEventLoop, QTimer
+
+from pyBehavior.interfaces.zones import ZoneMap, CircleZone, PolygonZone
+
+
+def record(zones):
+    events = []
+    zones.entered.connect(lambda name: events.append(('entered', name)))
+    zones.exited.connect(lambda name: events.append(('exited', name)))
+    zones.dwell.connect(lambda name: events.append(('dwell', name)))
+    return events
+
+
+def wait(qapp, seconds):
+    loop = QEventLoop()
+    QTimer.singleShot(int(seconds * 1000), loop.quit)
+    loop.exec_()
+
+
+def test_contains():
+    circle = CircleZone('c', (50, 50), 10)
+    assert circle.contains(55, 55)
+    assert not circle.contains(60, 60)
+    # concave polygon shaped like a U
+    u = PolygonZone('u', [[0, 0], [30, 0], [30, 30], [20, 30], [20, 10], [10, 10], [10, 30], [0, 30]])
+    assert u.contains(5, 20)
+    assert u.contains(25, 20)
+    assert not u.contains(15, 20)
+    assert u.contains(15, 5)
+
+
+def test_positions_are_y_x(qapp):
+    # a zone which is wide along x
+    zones = ZoneMap([PolygonZone('arm', [[0, 0], [100, 0], [100, 20], [0, 20]])])
+    events = record(zones)
+    zones.update([10, 80])
+    assert zones.current == {'arm'}
+    zones.update([80, 10])
+    assert zones.current == frozenset()
+    assert events == [('entered', 'arm'), ('exited', 'arm')]
+
+
+def test_overlapping_zones_and_grid(qapp):
+    zones = ZoneMap([CircleZone('a', (0, 0), 10), CircleZone('b', (15, 0), 10),
+                     CircleZone('far', (1000, 1000), 10)], cell_size = 5)
+    assert zones.locate(7, 0) == {'a', 'b'}
+    assert zones.locate(-8, 0) == {'a'}
+    assert zones.locate(500, 500) == frozenset()
+    assert zones.locate(float('nan'), 0) == frozenset()
+
+
+def test_dwell_fires_without_new_positions(qapp):
+    zones = ZoneMap([CircleZone('reward', (50, 50), 10, dwell = .1)])
+    events = record(zones)
+    zones.update([50, 50])
+    wait(qapp, .2)
+    assert events == [('entered', 'reward'), ('dwell', 'reward')]
+
+
+def test_dwell_cancelled_on_exit(qapp):
+    zones = ZoneMap([CircleZone('reward', (50, 50), 10, dwell = .1)])
+    events = record(zones)
+    zones.update([50, 50])
+    zones.update([0, 0])
+    wait(qapp, .2)
+    assert events == [('entered', 'reward'), ('exited', 'reward')]
+
+
+def test_from_yaml(tmp_path):
+    path = tmp_path/'zones.yaml'
+    path.write_text("CELL_SIZE: 20\n"
+                    "ZONES:\n"
+                    "  arm1:\n"
+                    "    polygon: [[0, 0], [100, 0], [100, 20], [0, 20]]\n"
+                    "  reward1:\n"
+                    "    circle: [50, 50]\n"
+                    "    radius: 10\n"
+                    "    dwell: 1.5\n")
+    zones = ZoneMap.from_yaml(path)
+    assert zones.cell_size == 20
+    assert zones.zones['reward1'].dwell == 1.5
+    assert zones.locate(50, 10) == {'arm1'}
+
+
+def test_zone_subclass_must_define_geometry():
+    from pyBehavior.interfaces.zones import Zone
+    class Incomplete(Zone):
+        def contains(self, x, y):
+            return False
+    with pytest.raises(TypeError):
+        Incomplete('z')
+    with pytest.raises(TypeError):
+        Zone('z')